@@ -0,0 +1,203 @@
+import json
+import os
+import re
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Flexible Amenity Matching: canonical label -> substrings that identify it in a raw amenity string
+AMENITY_MAPPING = {
+    'Wifi': ['wifi'],
+    'Kitchen': ['kitchen', 'kitchenette'],
+    'Heating': ['heating', 'indoor fireplace'],
+    'Washer': ['washer'],
+    'Dryer': ['dryer'],
+    'Air conditioning': ['air conditioning', 'central air conditioning'],
+    'Free parking': ['free parking', 'free driveway parking', 'free street parking', 'free residential garage'],
+    'Hot tub': ['hot tub', 'sauna'],
+    'Pool': ['pool'],
+    'Gym': ['gym', 'exercise equipment'],
+    'Pet-friendly': ['pets allowed', 'cat(s)', 'dog(s)'],
+    'Self check-in': ['self check-in', 'keypad', 'smart lock'],
+    'Lockbox': ['lockbox'],
+    'Elevator': ['elevator'],
+    'Balcony': ['balcony', 'patio', 'terrace'],
+    'Garden': ['garden', 'backyard'],
+    'BBQ grill': ['bbq', 'barbecue', 'grill'],
+    'Workspace': ['workspace', 'desk']
+}
+
+# Amenity strings seen on fewer listings than this are left out of the full-vocabulary matrix
+AMENITY_MIN_COUNT = 20
+
+
+def amenity_column_name(label):
+    """Feature column for a canonical amenity label, e.g. 'Self check-in' -> 'has_self_check_in'."""
+    return f'has_{label.lower().replace(" ", "_").replace("-", "_")}'
+
+
+def _parse_one(amenities_str):
+    if pd.isna(amenities_str) or amenities_str == '':
+        return []
+    try:
+        amenities_str = amenities_str.replace('""', '"')
+        return json.loads(amenities_str)
+    except (ValueError, TypeError):
+        return []
+
+
+def parse_amenities(amenities):
+    """
+    Parses a column of JSON amenity arrays.
+
+    All rows are decoded with a single json.loads over the joined column; if
+    any row is malformed the column falls back to per-row parsing, where a
+    bad row yields an empty list.
+    Returns a list with one list of amenity strings per row.
+    """
+    texts = amenities.fillna('').astype(object)
+    texts = [t.replace('""', '"') if t else '[]' for t in texts]
+    try:
+        parsed = json.loads('[' + ','.join(texts) + ']')
+        if len(parsed) != len(texts) or not all(isinstance(p, list) for p in parsed):
+            raise ValueError("row boundaries lost while batch parsing")
+    except ValueError:
+        parsed = [_parse_one(t) for t in texts]
+    return parsed
+
+
+def amenity_incidence(amenities):
+    """
+    Builds the listing x distinct-amenity-string incidence matrix.
+
+    Strings are lower-cased and stripped, so case variants share a column.
+    Returns (matrix, vocabulary): a CSR matrix with one row per input row and
+    one column per distinct amenity string, and the strings themselves.
+    """
+    parsed = parse_amenities(amenities)
+    lengths = np.fromiter((len(p) for p in parsed), dtype=np.int64, count=len(parsed))
+    values = [str(a).strip().lower() for a in chain.from_iterable(parsed)]
+    codes, vocabulary = pd.factorize(pd.Series(values, dtype=object))
+
+    rows = np.repeat(np.arange(len(parsed)), lengths)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(codes), dtype=np.int8), (rows, codes)),
+        shape=(len(parsed), len(vocabulary))
+    )
+    # Repeated strings within one listing collapse to a single incidence
+    matrix.data[:] = 1
+    return matrix, list(vocabulary)
+
+
+def label_membership(vocabulary, mapping=AMENITY_MAPPING):
+    """Boolean (distinct string x label) matrix: does the string match any of the label's keywords."""
+    lowered = [v.lower() for v in vocabulary]
+    membership = np.zeros((len(vocabulary), len(mapping)), dtype=bool)
+    for j, keywords in enumerate(mapping.values()):
+        membership[:, j] = [any(k.lower() in v for k in keywords) for v in lowered]
+    return membership
+
+
+def extract_amenity_flags(amenities, mapping=AMENITY_MAPPING):
+    """
+    Computes every has_* flag for a column of raw amenity JSON.
+
+    Each distinct amenity string is resolved to its canonical labels once; the
+    per-listing flags then come from one sparse product of the incidence matrix
+    with that resolution table.
+    Returns an int8 DataFrame aligned with `amenities`.
+    """
+    matrix, vocabulary = amenity_incidence(amenities)
+    return amenity_flags(matrix, vocabulary, amenities.index, mapping)
+
+
+def amenity_flags(matrix, vocabulary, index, mapping=AMENITY_MAPPING):
+    """has_* flags from an already built incidence matrix (see extract_amenity_flags)."""
+    membership = label_membership(vocabulary, mapping).astype(np.int32)
+    flags = np.asarray((matrix @ membership) > 0, dtype=np.int8)
+    columns = [amenity_column_name(label) for label in mapping]
+    return pd.DataFrame(flags, index=index, columns=columns)
+
+
+class AmenityMatrix:
+    """
+    Sparse listing x amenity incidence over the full amenity vocabulary.
+
+    Rows are keyed by listing id, columns by the amenity strings that occur on
+    at least `min_count` listings. The matrix stays sparse end to end: models
+    and the basket analysis take rows from it by listing id instead of
+    expanding thousands of columns into the DataFrame.
+    """
+
+    def __init__(self, matrix, vocabulary, ids):
+        self.matrix = matrix.tocsr()
+        self.vocabulary = list(vocabulary)
+        self.ids = np.asarray(ids)
+        self._positions = pd.Index(self.ids)
+
+    @classmethod
+    def from_incidence(cls, matrix, vocabulary, ids, min_count=AMENITY_MIN_COUNT):
+        """Applies the frequency cutoff to a full incidence matrix (see amenity_incidence)."""
+        counts = np.asarray(matrix.sum(axis=0)).ravel()
+        keep = np.flatnonzero(counts >= min_count)
+        keep = keep[np.argsort(-counts[keep], kind='stable')]
+        return cls(matrix[:, keep], [vocabulary[j] for j in keep], ids)
+
+    @classmethod
+    def from_amenities(cls, amenities, ids, min_count=AMENITY_MIN_COUNT):
+        matrix, vocabulary = amenity_incidence(amenities)
+        return cls.from_incidence(matrix, vocabulary, ids, min_count)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @property
+    def feature_names(self):
+        """Model-safe column names, e.g. 'amenity_free_street_parking'."""
+        names, seen = [], {}
+        for v in self.vocabulary:
+            name = 'amenity_' + (re.sub(r'[^0-9a-z]+', '_', v).strip('_') or 'blank')
+            seen[name] = seen.get(name, 0) + 1
+            names.append(name if seen[name] == 1 else f'{name}_{seen[name]}')
+        return names
+
+    def rows(self, ids):
+        """CSR rows for the given listing ids, in order; unknown ids get empty rows."""
+        positions = self._positions.get_indexer(np.asarray(ids))
+        found = positions >= 0
+        rows = self.matrix[np.where(found, positions, 0)]
+        if not found.all():
+            rows = sparse.diags(found.astype(np.int8)) @ rows
+        return rows.tocsr()
+
+    def hstack(self, X):
+        """Appends the amenity block to a feature frame indexed by listing id, as one CSR matrix."""
+        dense = sparse.csr_matrix(X.to_numpy(dtype=np.float32))
+        return sparse.hstack([dense, self.rows(X.index).astype(np.float32)], format='csr')
+
+    def support(self, ids):
+        """Share of the given listings that have each amenity."""
+        rows = self.rows(ids)
+        if rows.shape[0] == 0:
+            return np.zeros(len(self.vocabulary))
+        return np.asarray(rows.sum(axis=0)).ravel() / rows.shape[0]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+            shape=np.array(self.matrix.shape), vocabulary=np.array(self.vocabulary, dtype=str),
+            ids=self.ids
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            matrix = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            return cls(matrix, f['vocabulary'].tolist(), f['ids'])
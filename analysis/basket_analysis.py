@@ -4,9 +4,12 @@ from itertools import combinations
 import pandas as pd
 
 
-def run_basket_analysis(full_df):
+def run_basket_analysis(full_df, amenity_matrix=None):
     """
     Performs comparative basket analysis: Top 10% vs The Rest.
+
+    With an AmenityMatrix the comparison covers the full amenity vocabulary
+    (rows looked up by listing id) instead of the hand-mapped has_* columns.
     """
     print("\n[Amenity Basket Analysis] Comparative: Top 10% vs Rest")
     
@@ -18,13 +21,6 @@ def run_basket_analysis(full_df):
     print(f"Top Tier (> ${threshold:,.0f}): {len(top_df)} listings")
     print(f"Base Tier (< ${threshold:,.0f}): {len(rest_df)} listings")
     
-    # Identify Amenity Columns
-    amenity_cols = [col for col in full_df.columns if col.startswith('has_') and col != 'has_availability']
-    
-    if not amenity_cols:
-        print("No amenity columns found.")
-        return
-
     # Helper: Get Support for a list of transactions
     def get_support_map(df, amenity_columns):
         count_map = {}
@@ -35,8 +31,21 @@ def run_basket_analysis(full_df):
             count_map[clean_name] = count / total
         return count_map
 
-    top_support = get_support_map(top_df, amenity_cols)
-    rest_support = get_support_map(rest_df, amenity_cols)
+    if amenity_matrix is not None:
+        # Full vocabulary, straight from the sparse matrix
+        names = [amenity.capitalize() for amenity in amenity_matrix.vocabulary]
+        top_support = dict(zip(names, amenity_matrix.support(top_df['id'])))
+        rest_support = dict(zip(names, amenity_matrix.support(rest_df['id'])))
+    else:
+        # Identify Amenity Columns
+        amenity_cols = [col for col in full_df.columns if col.startswith('has_') and col != 'has_availability']
+
+        if not amenity_cols:
+            print("No amenity columns found.")
+            return
+
+        top_support = get_support_map(top_df, amenity_cols)
+        rest_support = get_support_map(rest_df, amenity_cols)
     
     # 2. Calculate Differentiators (Gap Analysis)
     diffs = []
@@ -65,6 +74,6 @@ def run_basket_analysis(full_df):
     meaningful_diffs = diff_df[diff_df['Top_Support'] > 0.10].sort_values('Rel_Lift', ascending=False)
     
     for _, row in meaningful_diffs.head(15).iterrows():
-        print(f"{row['Amenity']:<30} | {row['Top_Support']:<16.1%} | {row['Rest_Support']:<8.1%} | {row['Rel_Lift']:<6.2f}")
+        print(f"{row['Amenity'][:30]:<30} | {row['Top_Support']:<16.1%} | {row['Rest_Support']:<8.1%} | {row['Rel_Lift']:<6.2f}")
 
     return
@@ -0,0 +1,292 @@
+"""
+Stage-level benchmark of the data and training pipeline.
+
+`run` times every stage of a training run on the real data: load_data_raw
+(CSV parse and columnar cache), basic_cleaning, each block of
+prepare_data_pipeline, run_basket_analysis, each distinct ModelTrainer fit
+(in-process, one at a time) and the ONNX export. Wall time, CPU time and
+memory per stage go to a JSON baseline (with --repeat, the best of several
+runs). `compare` flags stages that got slower or bigger than a baseline by
+more than a threshold, and exits non-zero if any did.
+
+    python -m analysis.benchmark run --output outputs/benchmarks/baseline.json
+    python -m analysis.benchmark run --output outputs/benchmarks/current.json --compare outputs/benchmarks/baseline.json
+    python -m analysis.benchmark compare outputs/benchmarks/baseline.json outputs/benchmarks/current.json
+    python -m analysis.benchmark run --data data/synthetic/listings-10x.csv --output outputs/benchmarks/10x.json
+    python -m analysis.benchmark export-scaling --counts 1,5,10,20,39
+    python -m analysis.benchmark onnx-latency --layouts separate,fused --batch-sizes 1,100,1000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+import onnxruntime as ort
+from onnx import save_model
+
+from analysis.basket_analysis import run_basket_analysis
+from analysis.data import DATA_DIR, load_data_raw, prepare_data_pipeline
+from analysis.export import EXPORT_LAYOUTS, build_group_model, export_onnx_models, exported_names, output_sort_key
+from analysis.models import QUANTILE_MODES, ModelTrainer
+from analysis.onnx_check import time_calls
+from analysis.price_analysis import price_training_plan
+from analysis.profiling import StageProfiler
+from analysis.revenue_analysis import revenue_training_plan
+
+# Metric -> absolute change below which a difference is noise, whatever the ratio
+COMPARED_METRICS = {'wall_s': 0.05, 'cpu_s': 0.05, 'peak_rss_mb': 10.0, 'traced_peak_mb': 5.0}
+
+
+def run_benchmark(quantile_mode='independent', early_stopping_rounds=None, trace_memory=False, quiet=True,
+                  data_path=None):
+    """Runs and profiles every pipeline stage on `data_path` (default: the real snapshot); returns the StageProfiler."""
+    profiler = StageProfiler(trace_memory)
+    # The pipeline's own progress output would drown the stage lines
+    output = io.StringIO() if quiet else sys.stdout
+
+    with contextlib.redirect_stdout(output):
+        with profiler.stage('load_data_raw (csv)') as stage:
+            stage['rows'] = len(load_data_raw(data_path, use_cache=False))
+        X_train, _, y_train_price, _, y_train_rev, _, _, _, full_df, _, _ = prepare_data_pipeline(
+            profiler=profiler, data_path=data_path
+        )
+
+        with profiler.stage('run_basket_analysis') as stage:
+            run_basket_analysis(full_df)
+            stage['rows'] = len(full_df)
+
+        # One fit at a time, in this process, so each is measured on its own (duplicate plan entries are skipped).
+        # Binned Datasets come from the same on-disk cache as main.py's runs.
+        trainer = ModelTrainer(
+            quantile_mode=quantile_mode, n_jobs=1, dataset_cache_dir=os.path.join(DATA_DIR, 'cache', 'lightgbm'),
+            early_stopping_rounds=early_stopping_rounds
+        )
+        targets = {'price': y_train_price, 'revenue': y_train_rev}
+        for task in price_training_plan(quantile_mode) + revenue_training_plan(quantile_mode):
+            n_fitted = len(trainer.fitted)
+            with profiler.stage(f"fit:{task['name']}") as stage:
+                trainer.fit_plan([task], X_train, targets)
+                stage.update(rows=X_train.shape[0], cols=X_train.shape[1])
+            if len(trainer.fitted) == n_fitted:
+                profiler.stages.pop()
+            else:
+                profiler.stages[-1]['trees'] = trainer.fitted[-1].booster_.num_trees()
+
+        with tempfile.TemporaryDirectory() as model_dir, profiler.stage('export_onnx_models') as stage:
+            paths = export_onnx_models(trainer, X_train.shape[1], model_dir)
+            stage['bytes'] = sum(os.path.getsize(p) for p in paths)
+    return profiler
+
+
+def run_export_scaling(counts, quantile_mode='independent', early_stopping_rounds=None, quiet=True):
+    """
+    Export cost as the model count grows: fits the training plan once, then
+    profiles building the Price graph from its first k outputs for each k.
+    """
+    profiler = StageProfiler()
+    output = io.StringIO() if quiet else sys.stdout
+    with contextlib.redirect_stdout(output):
+        X_train, _, y_train_price, _, y_train_rev, *_ = prepare_data_pipeline()
+        trainer = ModelTrainer(
+            quantile_mode=quantile_mode, dataset_cache_dir=os.path.join(DATA_DIR, 'cache', 'lightgbm'),
+            early_stopping_rounds=early_stopping_rounds
+        )
+        trainer.fit_plan(price_training_plan(quantile_mode), X_train, {'price': y_train_price})
+        names = sorted(exported_names(trainer.models), key=output_sort_key)
+        for k in counts:
+            subset = names[:k]
+            with tempfile.TemporaryDirectory() as model_dir, profiler.stage(f"export:{len(subset)} outputs") as stage:
+                path = os.path.join(model_dir, 'Price_Model.onnx')
+                save_model(build_group_model(trainer.models, subset, X_train.shape[1]), path)
+                stage.update(outputs=len(subset), bytes=os.path.getsize(path))
+    return profiler
+
+
+def run_onnx_latency(layouts=EXPORT_LAYOUTS, batch_sizes=(1, 100, 1000), quantile_mode='independent',
+                     early_stopping_rounds=None, threads=1, quiet=True):
+    """
+    Inference latency of the Price graph per export layout: fits the Price
+    plan once, exports it in each layout and times ONNX Runtime on batches
+    of test rows (one record per layout and batch size: median wall_s per
+    call, p99_ms, rows_per_s).
+    """
+    profiler = StageProfiler()
+    output = io.StringIO() if quiet else sys.stdout
+    with contextlib.redirect_stdout(output):
+        X_train, X_test, y_train_price, *_ = prepare_data_pipeline()
+        trainer = ModelTrainer(
+            quantile_mode=quantile_mode, dataset_cache_dir=os.path.join(DATA_DIR, 'cache', 'lightgbm'),
+            early_stopping_rounds=early_stopping_rounds
+        )
+        trainer.fit_plan(price_training_plan(quantile_mode), X_train, {'price': y_train_price})
+    X = np.ascontiguousarray(X_test.to_numpy(dtype=np.float32))
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    for layout in layouts:
+        model = build_group_model(trainer.models, exported_names(trainer.models), X.shape[1], layout=layout)
+        session = ort.InferenceSession(model.SerializeToString(), options, providers=['CPUExecutionProvider'])
+        for size in batch_sizes:
+            # Batches larger than the test set repeat its rows
+            batch = X[np.arange(size) % len(X)]
+            walls, cpus = time_calls(session, batch, calls=max(5, min(500, 20_000 // size)))
+            profiler.record(f"{layout}:batch {size}", wall_s=round(float(np.median(walls)), 6),
+                            cpu_s=round(float(np.median(cpus)), 6), p99_ms=round(float(np.percentile(walls, 99)) * 1e3, 3),
+                            rows_per_s=round(size / float(np.median(walls))), rows=size, cols=X.shape[1],
+                            bytes=model.ByteSize())
+    return profiler
+
+
+def best_of(runs):
+    """
+    Merges the stage records of repeated runs: the minimum wall/CPU time per
+    stage (the least disturbed measurement) with every run's wall time kept
+    under wall_s_runs; memory fields come from the first run.
+    """
+    merged = []
+    for records in zip(*runs):
+        record = dict(records[0])
+        record['wall_s'] = min(r['wall_s'] for r in records)
+        record['cpu_s'] = min(r['cpu_s'] for r in records)
+        record['wall_s_runs'] = [r['wall_s'] for r in records]
+        merged.append(record)
+    return merged
+
+
+def compare_reports(baseline, current, threshold=0.10):
+    """
+    Stage-by-stage comparison of two benchmark reports.
+
+    Returns (rows, regressions): one row per (stage, metric) present in both,
+    and the rows where current exceeds baseline by more than `threshold`
+    (relative) and by more than the metric's noise floor (absolute).
+    """
+    base_stages = {s['stage']: s for s in baseline['stages']}
+    rows, regressions = [], []
+    for stage in current['stages']:
+        base = base_stages.get(stage['stage'])
+        if base is None:
+            continue
+        for metric, floor in COMPARED_METRICS.items():
+            if metric not in stage or metric not in base:
+                continue
+            before, after = base[metric], stage[metric]
+            change = (after - before) / before if before else 0.0
+            row = {'stage': stage['stage'], 'metric': metric, 'baseline': before, 'current': after, 'change': change}
+            rows.append(row)
+            if change > threshold and after - before > floor:
+                regressions.append(row)
+    return rows, regressions
+
+
+def print_comparison(baseline, current, threshold=0.10):
+    """Prints the comparison table; returns the regressions."""
+    if baseline.get('environment') != current.get('environment'):
+        print("Note: the reports were taken in different environments:")
+        print(f"  baseline: {json.dumps(baseline.get('environment'))}")
+        print(f"  current:  {json.dumps(current.get('environment'))}")
+    if baseline.get('config') != current.get('config'):
+        print(f"Note: the runs used different settings: {baseline.get('config')} vs {current.get('config')}")
+    rows, regressions = compare_reports(baseline, current, threshold)
+    print(f"{'stage':<36} {'metric':<14} {'baseline':>10} {'current':>10} {'change':>8}")
+    for row in rows:
+        flag = '  REGRESSION' if row in regressions else ''
+        print(f"{row['stage']:<36} {row['metric']:<14} {row['baseline']:>10.2f} {row['current']:>10.2f} "
+              f"{row['change']:>+8.1%}{flag}")
+    base_names = {s['stage'] for s in baseline['stages']}
+    current_names = {s['stage'] for s in current['stages']}
+    for name in sorted(base_names - current_names):
+        print(f"  missing from current: {name}")
+    for name in sorted(current_names - base_names):
+        print(f"  new in current: {name}")
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {threshold:.0%}.")
+    else:
+        print(f"No regressions beyond {threshold:.0%}.")
+    return regressions
+
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stage-level benchmark of the data and training pipeline.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('run', help="Profile every stage and save a JSON report.")
+    run.add_argument('--output', default=os.path.join('outputs', 'benchmarks', 'benchmark.json'))
+    run.add_argument('--data', default=None,
+                     help="Listings CSV to run on, e.g. from analysis.synthetic (default: data/listings-detail.csv).")
+    run.add_argument('--quantile-mode', choices=QUANTILE_MODES, default='independent')
+    run.add_argument('--early-stopping', type=int, default=None, metavar='ROUNDS')
+    run.add_argument('--trace-memory', action='store_true',
+                     help="Also record tracemalloc peaks (slows allocation-heavy stages).")
+    run.add_argument('--repeat', type=int, default=1,
+                     help="Run the whole benchmark this many times and keep each stage's fastest time.")
+    run.add_argument('--verbose', action='store_true', help="Show the pipeline's own output.")
+    run.add_argument('--compare', default=None, metavar='BASELINE', help="Compare against a baseline report.")
+    run.add_argument('--threshold', type=float, default=0.10, help="Relative increase counted as a regression.")
+    scaling = subparsers.add_parser('export-scaling', help="Profile the ONNX export of 1..N Price models.")
+    scaling.add_argument('--counts', default='1,5,10,20,39', help="Comma-separated output counts.")
+    scaling.add_argument('--quantile-mode', choices=QUANTILE_MODES, default='independent')
+    scaling.add_argument('--early-stopping', type=int, default=None, metavar='ROUNDS')
+    scaling.add_argument('--output', default=os.path.join('outputs', 'benchmarks', 'export_scaling.json'))
+    latency = subparsers.add_parser('onnx-latency', help="Time ONNX inference of the Price graph per export layout.")
+    latency.add_argument('--layouts', default=','.join(EXPORT_LAYOUTS), help="Comma-separated export layouts.")
+    latency.add_argument('--batch-sizes', default='1,100,1000', help="Comma-separated rows per call.")
+    latency.add_argument('--threads', type=int, default=1, help="ONNX Runtime intra-op threads.")
+    latency.add_argument('--quantile-mode', choices=QUANTILE_MODES, default='independent')
+    latency.add_argument('--early-stopping', type=int, default=None, metavar='ROUNDS')
+    latency.add_argument('--output', default=os.path.join('outputs', 'benchmarks', 'onnx_latency.json'))
+    compare = subparsers.add_parser('compare', help="Compare two reports; exits 1 on regressions.")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=0.10, help="Relative increase counted as a regression.")
+    args = parser.parse_args()
+
+    if args.command == 'export-scaling':
+        counts = [int(k) for k in args.counts.split(',')]
+        profiler = run_export_scaling(counts, args.quantile_mode, args.early_stopping)
+        print(profiler.summary())
+        profiler.save(args.output, config={'quantile_mode': args.quantile_mode,
+                                           'early_stopping_rounds': args.early_stopping})
+        print(f"Export scaling report saved to '{args.output}'.")
+        return
+    if args.command == 'onnx-latency':
+        layouts = args.layouts.split(',')
+        batch_sizes = [int(n) for n in args.batch_sizes.split(',')]
+        profiler = run_onnx_latency(layouts, batch_sizes, args.quantile_mode, args.early_stopping, args.threads)
+        print(f"{'layout:batch':<24} {'p50 ms':>9} {'p99 ms':>9} {'rows/s':>10}")
+        for r in profiler.stages:
+            print(f"{r['stage']:<24} {r['wall_s'] * 1e3:>9.3f} {r['p99_ms']:>9.3f} {r['rows_per_s']:>10,}")
+        profiler.save(args.output, config={'quantile_mode': args.quantile_mode, 'threads': args.threads,
+                                           'early_stopping_rounds': args.early_stopping})
+        print(f"ONNX latency report saved to '{args.output}'.")
+        return
+    if args.command == 'run':
+        runs = [run_benchmark(args.quantile_mode, args.early_stopping, args.trace_memory, quiet=not args.verbose,
+                              data_path=args.data)
+                for _ in range(args.repeat)]
+        profiler = runs[0]
+        if args.repeat > 1:
+            profiler.stages = best_of([run.stages for run in runs])
+        print(profiler.summary())
+        config = {'data': args.data, 'quantile_mode': args.quantile_mode, 'early_stopping_rounds': args.early_stopping,
+                  'trace_memory': args.trace_memory, 'repeat': args.repeat}
+        profiler.save(args.output, config=config)
+        print(f"Benchmark report saved to '{args.output}'.")
+        if args.compare is None:
+            return
+        baseline, current = _load(args.compare), _load(args.output)
+    else:
+        baseline, current = _load(args.baseline), _load(args.current)
+    if print_comparison(baseline, current, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,174 @@
+import glob
+import hashlib
 import json
 import os
+import re
 import warnings
 
+import joblib
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import KFold, train_test_split
-from sklearn.preprocessing import LabelEncoder
+import pyarrow.feather as feather
+from sklearn.model_selection import train_test_split
+
+from analysis.amenities import AmenityMatrix, amenity_flags, amenity_incidence
+from analysis.profiling import profile_stage
+from analysis.target_encoding import apply_target_encoding, kfold_target_encode
+from analysis.text_features import TEXT_KEYWORDS, KeywordMatcher, extract_text_features
 
 # Suppress FutureWarnings from pandas
 warnings.simplefilter(action='ignore', category=FutureWarning)
 pd.set_option('future.no_silent_downcasting', True)
 
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
 
-def load_data_raw():
-    """Loads raw data from the data directory."""
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    # Look for data in ../data/ relative to analysis/
-    data_path = os.path.join(current_dir, '..', 'data', 'listings-detail.csv')
-    
-    if not os.path.exists(data_path):
-        data_path = 'data/listings-detail.csv'
-        
+# Columns read from listings-detail.csv and their in-memory dtypes. Everything
+# else in the 79-column file is never materialised. The two targets stay
+# float64 so the stats and encodings exported to metadata are not rounded.
+INGEST_SCHEMA = {
+    'id': 'int64',
+    'name': 'string[pyarrow]',
+    'description': 'string[pyarrow]',
+    'host_since': 'string[pyarrow]',
+    'host_response_rate': 'string[pyarrow]',
+    'host_acceptance_rate': 'string[pyarrow]',
+    'host_is_superhost': 'category',
+    'host_identity_verified': 'category',
+    'neighbourhood_cleansed': 'category',
+    'latitude': 'float32',
+    'longitude': 'float32',
+    'property_type': 'category',
+    'room_type': 'category',
+    'accommodates': 'float32',
+    'bathrooms': 'float32',
+    'bedrooms': 'float32',
+    'beds': 'float32',
+    'amenities': 'string[pyarrow]',
+    'price': 'string[pyarrow]',
+    'has_availability': 'category',
+    'availability_365': 'float32',
+    'estimated_occupancy_l365d': 'float32',
+    'estimated_revenue_l365d': 'float64',
+    'review_scores_rating': 'float32',
+    'review_scores_cleanliness': 'float32',
+    'review_scores_location': 'float32',
+    'review_scores_value': 'float32',
+    'instant_bookable': 'category',
+    'calculated_host_listings_count': 'float32',
+    'reviews_per_month': 'float32',
+}
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _snapshot_cache_path(data_path, schema):
+    """
+    Columnar cache file for a CSV snapshot: <stem>-<schema key>-<content hash>.feather.
+
+    The schema key (16 hex chars of the ingest schema's hash) keeps one file
+    per schema, so schema=None and INGEST_SCHEMA reads don't evict each other.
+    """
+    schema_key = hashlib.sha256(json.dumps(schema, sort_keys=True).encode()).hexdigest()[:16]
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(data_path)), 'cache')
+    stem = os.path.splitext(os.path.basename(data_path))[0]
+    return os.path.join(cache_dir, f"{stem}-{schema_key}-{file_digest(data_path)}.feather")
+
+def _prune_stale(path):
+    """
+    Removes older versions of a cache file named <prefix>-<64 hex digest><ext>:
+    exactly that prefix and extension with another digest, never another
+    file's cache whose stem happens to extend this one.
+    """
+    directory, filename = os.path.split(path)
+    prefix, ext = re.fullmatch(r'(.*)-[0-9a-f]{64}(\.\w+)', filename).groups()
+    pattern = re.compile(re.escape(prefix) + r'-[0-9a-f]{64}' + re.escape(ext))
+    for stale in glob.glob(os.path.join(glob.escape(directory), f"{glob.escape(prefix)}-*{ext}")):
+        if stale != path and pattern.fullmatch(os.path.basename(stale)):
+            os.remove(stale)
+
+def _write_snapshot_cache(df, cache_path):
+    """Writes an uncompressed Feather file (memory-mappable) and prunes older snapshots of the same file and schema."""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    _prune_stale(cache_path)
+    tmp_path = f"{cache_path}.tmp"
+    df.to_feather(tmp_path, compression='uncompressed')
+    os.replace(tmp_path, cache_path)
+
+def read_listings_csv(data_path, schema=INGEST_SCHEMA, **kwargs):
+    """Parses a listings CSV, keeping only the schema's columns with their declared dtypes."""
+    if schema is None:
+        return pd.read_csv(data_path, **kwargs)
+    return pd.read_csv(data_path, usecols=list(schema), dtype=schema, **kwargs)
+
+def resolve_data_path(data_path=None):
+    """The listings snapshot to read: `data_path`, or data/listings-detail.csv by default."""
+    if data_path is None:
+        # Look for data in ../data/ relative to analysis/
+        data_path = os.path.join(DATA_DIR, 'listings-detail.csv')
+
+        if not os.path.exists(data_path):
+            data_path = 'data/listings-detail.csv'
+    return data_path
+
+def load_data_raw(data_path=None, use_cache=True, schema=INGEST_SCHEMA):
+    """
+    Loads raw data from the data directory.
+
+    Only the columns declared in `schema` are read, with compact dtypes
+    (categories, float32 numerics, Arrow-backed strings). Pass schema=None
+    to load every column with pandas' default inference.
+
+    The first read of a snapshot is parsed from CSV and stored as a Feather
+    file under data/cache/, keyed by the CSV's content hash. Later reads of the
+    same snapshot memory-map that file instead of parsing the CSV again.
+    """
+    data_path = resolve_data_path(data_path)
     print(f"Loading data from: {data_path}")
-    return pd.read_csv(data_path)
+    if not use_cache:
+        return read_listings_csv(data_path, schema)
+
+    cache_path = _snapshot_cache_path(data_path, schema)
+    if os.path.exists(cache_path):
+        print(f"Using columnar cache: {cache_path}")
+        return feather.read_table(cache_path, memory_map=True).to_pandas()
+
+    df = read_listings_csv(data_path, schema)
+    try:
+        _write_snapshot_cache(df, cache_path)
+    except (OSError, ValueError) as e:
+        # A read-only data directory or an unserialisable column should not block the run
+        print(f"Could not write columnar cache ({e}); continuing from CSV.")
+    return df
+
+def amenity_matrix_path(data_path=None):
+    """
+    Where prepare_data_pipeline caches a snapshot's amenity matrix: the cache/
+    next to the CSV, as <stem>-amenities-<content hash>.npz, so every snapshot
+    keeps its own matrix.
+    """
+    data_path = resolve_data_path(data_path)
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(data_path)), 'cache')
+    stem = os.path.splitext(os.path.basename(data_path))[0]
+    return os.path.join(cache_dir, f"{stem}-amenities-{file_digest(data_path)}.npz")
+
+def save_amenity_matrix(amenity_matrix, path):
+    """Caches an amenity matrix at `path` (see amenity_matrix_path), replacing older versions for the same file."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    _prune_stale(os.path.abspath(path))
+    amenity_matrix.save(path)
 
-def basic_cleaning(df):
-    """Performs initial cleaning: boolean conversion, price parsing, and IQR outlier removal."""
+def load_amenity_matrix(path=None):
+    """Loads the full-vocabulary amenity matrix cached for a snapshot (default: amenity_matrix_path())."""
+    return AmenityMatrix.load(path or amenity_matrix_path())
+
+def parse_listing_fields(df):
+    """Converts t/f flags to booleans and price strings to numbers."""
     # Boolean Conversion
     boolean_columns = [
         'host_is_superhost', 'host_identity_verified',
@@ -33,12 +176,51 @@ def basic_cleaning(df):
     ]
     for col in boolean_columns:
         if col in df.columns:
-            df[col] = df[col].map({'t': True, 'f': False})
+            df[col] = df[col].astype(object).map({'t': True, 'f': False})
             
     # Price Cleaning
     if 'price' in df.columns:
         df['price'] = df['price'].astype(str).str.replace('$', '').str.replace(',', '')
         df['price'] = pd.to_numeric(df['price'], errors='coerce')
+    return df
+
+def derive_listing_features(df, amenity_matrix=False):
+    """
+    Row-wise features: amenity flags, host experience/rates and flag columns.
+
+    With amenity_matrix=True, also returns the full-vocabulary AmenityMatrix
+    of these listings, built from the same parse: (df, matrix).
+    """
+    # Amenities: all has_* flags in one vectorized pass, plus the full-vocabulary matrix
+    incidence, vocabulary = amenity_incidence(df['amenities'])
+    df = pd.concat([df, amenity_flags(incidence, vocabulary, df.index)], axis=1)
+    matrix = AmenityMatrix.from_incidence(incidence, vocabulary, df['id']) if amenity_matrix else None
+        
+    # 6. Feature Engineering (Host & Dates)
+    df['host_since'] = pd.to_datetime(df['host_since'], errors='coerce')
+    df['host_experience_days'] = (pd.Timestamp.now() - df['host_since']).dt.days
+    df['host_experience_years'] = df['host_experience_days'] / 365.25
+    df['host_response_rate_clean'] = df['host_response_rate'].str.replace('%', '').astype(float)
+    df['host_acceptance_rate_clean'] = df['host_acceptance_rate'].str.replace('%', '').astype(float)
+    df['is_superhost'] = df['host_is_superhost'].fillna(False).astype(int)
+    df['identity_verified'] = df['host_identity_verified'].fillna(False).astype(int)
+    df['instant_bookable'] = df['instant_bookable'].fillna(False).astype(int)
+    df['total_beds'] = df['beds'].fillna(0)
+
+    # 7. Handle specific logical NaNs (before dropping actual missing data)
+    if 'reviews_per_month' in df.columns:
+        df['reviews_per_month'] = df['reviews_per_month'].fillna(0)
+    
+    return (df, matrix) if amenity_matrix else df
+
+def basic_cleaning(df, amenity_matrix=False):
+    """
+    Performs initial cleaning: boolean conversion, price parsing, and IQR outlier removal.
+
+    With amenity_matrix=True, also returns the full-vocabulary amenity matrix
+    of the cleaned listings: (df, matrix). Nothing is written to disk.
+    """
+    df = parse_listing_fields(df)
         
     # Filter Missing Targets
     df = df.dropna(subset=['price', 'estimated_revenue_l365d'])
@@ -62,73 +244,25 @@ def basic_cleaning(df):
         (df['estimated_revenue_l365d'] >= lower_rev) & (df['estimated_revenue_l365d'] <= upper_rev)
     ]
     print(f"Data Cleaning: Removed {initial_len - len(df)} outliers.")
-    
-    # Amenities Parsing
-    def parse_amenities(amenities_str):
-        if pd.isna(amenities_str) or amenities_str == '':
-            return []
-        try:
-            amenities_str = amenities_str.replace('""', '"')
-            return json.loads(amenities_str)
-        except:
-            return []
-
-    df['amenities_list'] = df['amenities'].apply(parse_amenities)
-    
-    # Flexible Amenity Matching
-    amenity_mapping = {
-        'Wifi': ['wifi'],
-        'Kitchen': ['kitchen', 'kitchenette'],
-        'Heating': ['heating', 'indoor fireplace'],
-        'Washer': ['washer'],
-        'Dryer': ['dryer'],
-        'Air conditioning': ['air conditioning', 'central air conditioning'],
-        'Free parking': ['free parking', 'free driveway parking', 'free street parking', 'free residential garage'],
-        'Hot tub': ['hot tub', 'sauna'],
-        'Pool': ['pool'],
-        'Gym': ['gym', 'exercise equipment'],
-        'Pet-friendly': ['pets allowed', 'cat(s)', 'dog(s)'],
-        'Self check-in': ['self check-in', 'keypad', 'smart lock'],
-        'Lockbox': ['lockbox'],
-        'Elevator': ['elevator'],
-        'Balcony': ['balcony', 'patio', 'terrace'],
-        'Garden': ['garden', 'backyard'],
-        'BBQ grill': ['bbq', 'barbecue', 'grill'],
-        'Workspace': ['workspace', 'desk']
-    }
-    
-    for label, keywords in amenity_mapping.items():
-        col_name = f'has_{label.lower().replace(" ", "_").replace("-", "_")}'
-        # Check if ANY keyword appears in ANY amenity string for that listing
-        df[col_name] = df['amenities_list'].apply(
-            lambda amenities: 1 if any(
-                any(k.lower() in a.lower() for k in keywords) 
-                for a in amenities
-            ) else 0
-        )
-        
-    # 6. Feature Engineering (Host & Dates)
-    df['host_since'] = pd.to_datetime(df['host_since'], errors='coerce')
-    df['host_experience_days'] = (pd.Timestamp.now() - df['host_since']).dt.days
-    df['host_experience_years'] = df['host_experience_days'] / 365.25
-    df['host_response_rate_clean'] = df['host_response_rate'].str.replace('%', '').astype(float)
-    df['host_acceptance_rate_clean'] = df['host_acceptance_rate'].str.replace('%', '').astype(float)
-    df['is_superhost'] = df['host_is_superhost'].fillna(False).astype(int)
-    df['identity_verified'] = df['host_identity_verified'].fillna(False).astype(int)
-    df['instant_bookable'] = df['instant_bookable'].fillna(False).astype(int)
-    df['total_beds'] = df['beds'].fillna(0)
 
-    # 7. Handle specific logical NaNs (before dropping actual missing data)
-    if 'reviews_per_month' in df.columns:
-        df['reviews_per_month'] = df['reviews_per_month'].fillna(0)
-    
-    return df
+    # Drop categories that only occurred in filtered rows so dummies/groupbys match the data
+    for col in df.select_dtypes(include=['category']).columns:
+        df[col] = df[col].cat.remove_unused_categories()
+
+    return derive_listing_features(df, amenity_matrix)
+
+def clean_listings(df):
+    """Row-wise cleaning for scoring: like basic_cleaning, but keeps every row and needs no targets."""
+    return derive_listing_features(parse_listing_fields(df))
 
 def get_neighborhood_stats(df_train):
     """
     Calculates neighborhood statistics from training data.
     """
-    neighborhood_stats = df_train.groupby('neighbourhood_cleansed').agg({
+    # Aggregate in float64 so the rounded stats export cleanly from float32 columns
+    stat_cols = ['price', 'estimated_revenue_l365d', 'estimated_occupancy_l365d']
+    df_train = df_train[['neighbourhood_cleansed'] + stat_cols].astype({c: 'float64' for c in stat_cols})
+    neighborhood_stats = df_train.groupby('neighbourhood_cleansed', observed=True).agg({
         'price': ['mean', 'median', 'std'],
         'estimated_revenue_l365d': ['mean', 'median'],
         'estimated_occupancy_l365d': ['mean']
@@ -136,65 +270,21 @@ def get_neighborhood_stats(df_train):
     neighborhood_stats.columns = ['neighborhood_' + '_'.join(col).strip() for col in neighborhood_stats.columns]
     return neighborhood_stats
 
-def prepare_data_pipeline():
-    """
-    Splits data and applies feature engineering to prevent leakage.
-    Returns:
-        X_train, X_test (DataFrames with features)
-        y_train_price, y_test_price
-        y_train_rev, y_test_rev
-        test_df (Original test dataframe with metadata)
-        features (List of feature names used)
-        df (Full cleaned DataFrame for comparative analysis)
-        metadata (Dictionary with stats/mappings for frontend inference)
+class FeaturePipeline:
     """
-    metadata = {}
+    Model features for cleaned listings (output of basic_cleaning or clean_listings).
 
-    # 1. Load & Clean
-    df = load_data_raw()
-    df = basic_cleaning(df)
+    fit() learns everything that depends on the training split: neighbourhood
+    stats, review-score medians, target encodings, the room type and
+    neighbourhood vocabularies and the label encodings. transform() then
+    featurizes any batch of listings without retraining. The fitted pipeline
+    is saved and loaded with joblib.
+    """
 
-    # Text / NLP Features
-    print("Extracting Text Features...")
-    
-    # Fill text NaNs
-    df['name'] = df['name'].fillna('')
-    df['description'] = df['description'].fillna('')
-    
-    # Length features
-    df['name_len'] = df['name'].apply(len)
-    df['desc_len'] = df['description'].apply(len)
-    
-    # Keywords (Binary Features)
-    keywords = ['view', 'luxury', 'ocean', 'downtown', 'renovated', 'private', 'quiet', 'garden', 'spacious']
-    for word in keywords:
-        # Case insensitive search
-        df[f'txt_{word}'] = (
-            df['name'].str.contains(word, case=False) | 
-            df['description'].str.contains(word, case=False)
-        ).astype(int)
-    
-    text_features = ['name_len', 'desc_len'] + [f'txt_{w}' for w in keywords]
-    
-    # One-Hot Encoding for Neighborhoods
-    nbhd_dummies = pd.get_dummies(df['neighbourhood_cleansed'], prefix='nbhd', dtype=int)
-    df = pd.concat([df, nbhd_dummies], axis=1)
-    
-    # Split
-    train_df, test_df = train_test_split(df, test_size=0.2, random_state=42)
-    
-    # Compute Stats (Train Only)
-    stats = get_neighborhood_stats(train_df)
-    
-    # Save stats to metadata (convert to dict of dicts)
-    metadata['neighborhood_stats'] = stats.to_dict(orient='index')
+    # Vancouver City Center coordinates approx: 49.2819, -123.1187
+    DOWNTOWN = (49.2819, -123.1187)
 
-    # Merge Stats
-    train_df = train_df.merge(stats, on='neighbourhood_cleansed', how='left')
-    test_df = test_df.merge(stats, on='neighbourhood_cleansed', how='left')
-    
-    # 5. Define Features
-    common_features = [
+    COMMON_FEATURES = [
         'accommodates', 'bedrooms', 'bathrooms', 'beds', 'total_beds',
         'host_experience_years', 'host_response_rate_clean', 'host_acceptance_rate_clean',
         'is_superhost', 'identity_verified', 'instant_bookable',
@@ -210,165 +300,240 @@ def prepare_data_pipeline():
         # Categoricals to encode
         'room_type', 'property_type'
     ]
-    
-    amenity_features = [col for col in train_df.columns if col.startswith('has_')]
-    nbhd_features = [col for col in train_df.columns if col.startswith('nbhd_')]
-    
-    # Combined features list
-    candidates = common_features + amenity_features + nbhd_features
-    features = [c for c in candidates if c in train_df.columns]
-    
-    # 6. Handle Missing Values (Smart Imputation instead of Drop)
-    # Strategy: Impute missing reviews with median, but add a flag indicating it was missing
-    review_cols = [
+
+    # Imputed with the training median, plus a flag indicating it was missing
+    REVIEW_COLS = [
         'reviews_per_month', 'review_scores_rating', 'review_scores_location',
         'review_scores_cleanliness', 'review_scores_value'
     ]
-    
-    metadata['medians'] = {}
-    for col in review_cols:
-        if col in train_df.columns:
-            # Create indicator flag
-            train_df[f'{col}_missing'] = train_df[col].isna().astype(int)
-            test_df[f'{col}_missing'] = test_df[col].isna().astype(int)
-            
-            # Fill with median
-            median_val = train_df[col].median()
-            # Save median to metadata
-            metadata['medians'][col] = float(median_val)
 
-            train_df[col] = train_df[col].fillna(median_val)
-            test_df[col] = test_df[col].fillna(median_val)
-            
-    # Update features list to include new flags
-    features.extend([f'{c}_missing' for c in review_cols if f'{c}_missing' in train_df.columns])
+    TARGET_ENCODE_COLS = ['neighbourhood_cleansed', 'property_type']
 
-    # 7. Text / NLP Features (Simple Keyword Extraction)
-    # Already processed before split, just adding to features list
-    features.extend([f for f in text_features if f not in features])
+    def __init__(self, text_keywords=TEXT_KEYWORDS):
+        self.text_keywords = list(text_keywords)
+        self.features = None
 
-    # 8. Distance Features (Geography)
-    # Vancouver City Center coordinates approx: 49.2819, -123.1187
-    downtown_lat, downtown_lon = 49.2819, -123.1187
-    
-    # Haversine formula approximation (simplified for speed)
-    train_df['dist_to_downtown'] = np.sqrt(
-        ((train_df['latitude'] - downtown_lat) * 111)**2 + 
-        ((train_df['longitude'] - downtown_lon) * 78)**2
-    )
-    test_df['dist_to_downtown'] = np.sqrt(
-        ((test_df['latitude'] - downtown_lat) * 111)**2 + 
-        ((test_df['longitude'] - downtown_lon) * 78)**2
-    )
-    features.append('dist_to_downtown')
+    def fit(self, train_df, categories_from=None):
+        """
+        Learns the pipeline state from the training split.
 
-    # 9. Interaction Features (Domain Knowledge)
-    # Quality * Popularity
-    train_df['quality_popularity'] = train_df['review_scores_rating'] * train_df['reviews_per_month']
-    test_df['quality_popularity'] = test_df['review_scores_rating'] * test_df['reviews_per_month']
-    features.append('quality_popularity')
-        
-    # Space per person (crowdedness) - Handle division by zero or NaN safely
-    for df_curr in [train_df, test_df]:
-        df_curr['people_per_bedroom'] = df_curr['accommodates'] / (df_curr['bedrooms'].replace(0, 1))
-        df_curr['people_per_bath'] = df_curr['accommodates'] / (df_curr['bathrooms'].replace(0, 1))
-    
-    features.append('people_per_bedroom')
-    features.append('people_per_bath')
+        `categories_from` (default train_df) supplies the neighbourhood and
+        label-encoding vocabularies, so categories seen only outside the
+        training split still get stable columns and codes.
+        """
+        self._fit(train_df, categories_from)
+        return self
 
-    # Target Encoding
-    print("Applying K-Fold Target Encoding...")
-    
-    target_encode_cols = ['neighbourhood_cleansed', 'property_type']
-    
-    # We need to target encode for BOTH Price and Revenue
-    targets = {
-        'price': train_df['price'], 
-        'rev': train_df['estimated_revenue_l365d']
-    }
-    
-    kf = KFold(n_splits=5, shuffle=True, random_state=42)
-    metadata['target_encoding'] = {}
+    def fit_transform(self, train_df, categories_from=None, profiler=None, stage='feature_pipeline.fit_transform'):
+        """
+        Fits on train_df and featurizes it, using out-of-fold target encodings for the training rows.
 
-    for col in target_encode_cols:
-        if col not in train_df.columns:
-            continue
-            
-        metadata['target_encoding'][col] = {}
+        With a StageProfiler, its blocks are recorded as <stage>.<block>
+        stages in order (stats, target_encoding, vocabulary, columns,
+        text_features, assemble).
+        """
+        te_block = self._fit(train_df, categories_from, profiler, stage)
+        return self._transform(train_df, te_block, profiler, stage)
 
-        for target_name, target_vals in targets.items():
-            new_col_name = f'TE_{target_name}_{col}'
-            
-            # Initialize with NaN
-            train_df[new_col_name] = np.nan
-            
-            # Train Set: K-Fold to prevent leakage
-            for tr_ind, val_ind in kf.split(train_df):
-                X_tr, X_val = train_df.iloc[tr_ind], train_df.iloc[val_ind]
-                y_tr = target_vals.iloc[tr_ind]
-                
-                # Calculate means on training fold
-                means = pd.DataFrame({'cat': X_tr[col], 'target': y_tr}).groupby('cat')['target'].mean()
-                
-                # Map to validation fold
-                train_df.loc[train_df.index[val_ind], new_col_name] = X_val[col].map(means)
-            
-            # Fill NaNs in Train with global mean
-            global_mean = target_vals.mean()
-            train_df[new_col_name] = train_df[new_col_name].fillna(global_mean)
-            
-            # Test Set: Map using full training set means
-            full_means = pd.DataFrame({'cat': train_df[col], 'target': target_vals}).groupby('cat')['target'].mean()
-            test_df[new_col_name] = test_df[col].map(full_means)
-            test_df[new_col_name] = test_df[new_col_name].fillna(global_mean)
-            
-            features.append(new_col_name)
+    def transform(self, df, profiler=None, stage='feature_pipeline.transform'):
+        """Featurizes a batch of cleaned listings with the fitted state; returns a frame with self.features."""
+        if self.features is None:
+            raise RuntimeError("FeaturePipeline must be fitted before transform().")
+        with profile_stage(profiler, f'{stage}.target_encoding', rows=len(df)):
+            te_block = apply_target_encoding(df, self.target_encoding)
+        return self._transform(df, te_block, profiler, stage)
 
-            # Save mappings to metadata
-            # full_means is a Series, convert to dict
-            metadata['target_encoding'][col][target_name] = {
-                'map': full_means.to_dict(),
-                'global_mean': float(global_mean)
+    @property
+    def metadata(self):
+        """Stats/mappings for frontend inference (models_metadata.json, without feature_names)."""
+        return {
+            'neighborhood_stats': self.neighborhood_stats.to_dict(orient='index'),
+            'medians': dict(self.medians),
+            'target_encoding': self.target_encoding,
+            'label_encoding': self.label_encoding
+        }
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path):
+        return joblib.load(path)
+
+    def _fit(self, train_df, categories_from=None, profiler=None, stage='fit'):
+        reference = train_df if categories_from is None else categories_from
+        with profile_stage(profiler, f'{stage}.stats', rows=len(train_df)):
+            self.neighbourhoods = sorted(reference['neighbourhood_cleansed'].dropna().astype(str).unique())
+
+            # Compute Stats (Train Only)
+            self.neighborhood_stats = get_neighborhood_stats(train_df)
+            self.neighborhood_stats.index = self.neighborhood_stats.index.astype(object)
+
+            self.medians = {}
+            for col in self.REVIEW_COLS:
+                if col in train_df.columns:
+                    # Shortest repr of the float32 median, so the exported metadata reads 4.88 rather than 4.880000114...
+                    self.medians[col] = float(str(np.float32(train_df[col].median())))
+
+        # Target Encoding: out-of-fold for the training rows, full-train maps for everything else
+        with profile_stage(profiler, f'{stage}.target_encoding', rows=len(train_df)):
+            print("Applying K-Fold Target Encoding...")
+            # We need to target encode for BOTH Price and Revenue
+            targets = {
+                'price': train_df['price'],
+                'rev': train_df['estimated_revenue_l365d']
             }
+            te_block, self.target_encoding = kfold_target_encode(train_df, self.TARGET_ENCODE_COLS, targets)
 
-    # Encode Categoricals
-    # One-Hot Encode room_type
-    if 'room_type' in train_df.columns:
-        rt_dummies_train = pd.get_dummies(train_df['room_type'], prefix='rt', dtype=int)
-        rt_dummies_test = pd.get_dummies(test_df['room_type'], prefix='rt', dtype=int)
-        
-        # Align columns
-        rt_dummies_test = rt_dummies_test.reindex(columns=rt_dummies_train.columns, fill_value=0)
-        
-        train_df = pd.concat([train_df, rt_dummies_train], axis=1)
-        test_df = pd.concat([test_df, rt_dummies_test], axis=1)
-        
-        features.extend(rt_dummies_train.columns.tolist())
-        if 'room_type' in features:
-            features.remove('room_type')
-
-    # Label Encode remaining categoricals
-    categorical_cols = train_df[features].select_dtypes(include=['object']).columns
-    metadata['label_encoding'] = {}
-
-    for col in categorical_cols:
-        le = LabelEncoder()
-        all_cats = pd.concat([train_df[col], test_df[col]]).astype(str).unique()
-        le.fit(all_cats)
-        train_df[col] = le.transform(train_df[col].astype(str))
-        test_df[col] = le.transform(test_df[col].astype(str))
-        
-        # Save classes to metadata
-        # We need a mapping: string -> int
-        metadata['label_encoding'][col] = {label: int(i) for i, label in enumerate(le.classes_)}
+        with profile_stage(profiler, f'{stage}.vocabulary', rows=len(train_df)):
+            # One-Hot Encode room_type (training vocabulary)
+            self.room_types = sorted(train_df['room_type'].dropna().astype(str).unique()) if 'room_type' in train_df.columns else []
+
+            # 5. Define Features
+            available = set(train_df.columns) | set(self.neighborhood_stats.columns)
+            amenity_features = [col for col in train_df.columns if col.startswith('has_')]
+            nbhd_features = [f'nbhd_{n}' for n in self.neighbourhoods]
+            candidates = self.COMMON_FEATURES + amenity_features
+            features = [c for c in candidates if c in available] + nbhd_features
+            features.extend([f'{c}_missing' for c in self.REVIEW_COLS if c in self.medians])
+            features.extend(['name_len', 'desc_len'] + [f'txt_{w.lower()}' for w in self.text_keywords])
+            features.extend(['dist_to_downtown', 'quality_popularity', 'people_per_bedroom', 'people_per_bath'])
+            features.extend(te_block.columns)
+            features.extend(f'rt_{rt}' for rt in self.room_types)
+            if self.room_types:
+                features.remove('room_type')
+            self.features = list(dict.fromkeys(features))
+
+            # Label Encode remaining categoricals (classes from the reference vocabulary, as strings)
+            self.label_encoding = {}
+            for col in self.features:
+                if col in train_df.columns and (train_df[col].dtype == object or isinstance(train_df[col].dtype, pd.CategoricalDtype)):
+                    classes = sorted(reference[col].astype(str).unique())
+                    self.label_encoding[col] = {label: i for i, label in enumerate(classes)}
+
+            self._matcher = KeywordMatcher(self.text_keywords)
+        return te_block
+
+    def _transform(self, df, te_block, profiler=None, stage='transform'):
+        with profile_stage(profiler, f'{stage}.columns', rows=len(df)):
+            blocks = [df.reindex(columns=[c for c in self.features if c in df.columns])]
+
+            # Neighbourhood dummies and stats
+            nbhd = df['neighbourhood_cleansed'].astype(object)
+            nbhd_dummies = pd.get_dummies(
+                pd.Categorical(nbhd, categories=self.neighbourhoods), prefix='nbhd', dtype='int8'
+            )
+            nbhd_dummies.index = df.index
+            stats = self.neighborhood_stats.reindex(nbhd.to_numpy())
+            stats.index = df.index
+            blocks += [nbhd_dummies, stats]
+
+        # Text / NLP Features
+        with profile_stage(profiler, f'{stage}.text_features', rows=len(df)):
+            empty_text = pd.Series('', index=df.index, dtype=object)
+            blocks.append(extract_text_features(
+                df['name'] if 'name' in df.columns else empty_text,
+                df['description'] if 'description' in df.columns else empty_text,
+                matcher=self._matcher
+            ))
+
+        with profile_stage(profiler, f'{stage}.assemble', rows=len(df)) as record:
+            # Room type dummies on the training vocabulary
+            if self.room_types:
+                rt_dummies = pd.get_dummies(
+                    pd.Categorical(df['room_type'].astype(object), categories=self.room_types), prefix='rt', dtype='int8'
+                )
+                rt_dummies.index = df.index
+                blocks.append(rt_dummies)
+
+            blocks.append(te_block)
+            X = pd.concat(blocks, axis=1)
+
+            # 6. Handle Missing Values (Smart Imputation instead of Drop)
+            for col, median_val in self.medians.items():
+                X[f'{col}_missing'] = X[col].isna().astype(int)
+                X[col] = X[col].fillna(median_val)
+
+            # 8. Distance Features (Geography)
+            downtown_lat, downtown_lon = self.DOWNTOWN
+            # Haversine formula approximation (simplified for speed)
+            X['dist_to_downtown'] = np.sqrt(
+                ((X['latitude'] - downtown_lat) * 111)**2 + 
+                ((X['longitude'] - downtown_lon) * 78)**2
+            )
+
+            # 9. Interaction Features (Domain Knowledge)
+            # Quality * Popularity
+            X['quality_popularity'] = X['review_scores_rating'] * X['reviews_per_month']
+            # Space per person (crowdedness) - Handle division by zero or NaN safely
+            X['people_per_bedroom'] = X['accommodates'] / (X['bedrooms'].replace(0, 1))
+            X['people_per_bath'] = X['accommodates'] / (X['bathrooms'].replace(0, 1))
+
+            # Label Encode (unseen categories become NaN, which the models treat as missing)
+            for col, mapping in self.label_encoding.items():
+                X[col] = X[col].astype(str).map(mapping)
+            record['cols'] = len(self.features)
+
+        return X[self.features]
+
+def prepare_data_pipeline(text_keywords=TEXT_KEYWORDS, profiler=None, data_path=None):
+    """
+    Splits data and applies feature engineering to prevent leakage.
+    `text_keywords` are the words flagged as txt_* features. `data_path`
+    is a listings-detail.csv snapshot (default data/listings-detail.csv);
+    its amenity matrix is saved to amenity_matrix_path(data_path). With a
+    StageProfiler, each block (load, clean, amenity matrix, split, and the
+    feature pipeline's stats, target encoding, text features, ...) is
+    recorded as a stage.
+    Returns:
+        X_train, X_test (DataFrames with features, indexed by listing id)
+        y_train_price, y_test_price
+        y_train_rev, y_test_rev
+        test_df (Original test dataframe with metadata)
+        features (List of feature names used)
+        df (Full cleaned DataFrame for comparative analysis)
+        metadata (Dictionary with stats/mappings for frontend inference)
+        pipeline (FeaturePipeline fitted on the training split)
+    """
+    # 1. Load & Clean
+    with profile_stage(profiler, 'load_data_raw') as stage:
+        df = load_data_raw(data_path)
+        stage.update(rows=len(df), cols=df.shape[1])
+    with profile_stage(profiler, 'basic_cleaning') as stage:
+        df, amenity_matrix = basic_cleaning(df, amenity_matrix=True)
+        stage.update(rows=len(df), cols=df.shape[1])
+    with profile_stage(profiler, 'save_amenity_matrix') as stage:
+        matrix_path = amenity_matrix_path(data_path)
+        save_amenity_matrix(amenity_matrix, matrix_path)
+        print(f"Amenity matrix: {amenity_matrix.shape[1]} amenities cached to {matrix_path}")
+        stage.update(rows=amenity_matrix.shape[0], cols=amenity_matrix.shape[1])
+    
+    # Split
+    with profile_stage(profiler, 'train_test_split') as stage:
+        train_df, test_df = train_test_split(df, test_size=0.2, random_state=42)
+
+        # Index by listing id so rows can be joined with the sparse amenity matrix
+        train_df.index = train_df['id'].to_numpy()
+        test_df.index = test_df['id'].to_numpy()
+        stage.update(rows=len(train_df), cols=train_df.shape[1])
+
+    # Fit on train only; the category vocabularies come from the whole cleaned snapshot
+    print("Extracting Features...")
+    pipeline = FeaturePipeline(text_keywords)
+    # Profiled block by block (target encoding, text features, ...) as feature_pipeline.* stages
+    X_train = pipeline.fit_transform(train_df, categories_from=df, profiler=profiler)
+    X_test = pipeline.transform(test_df, profiler=profiler)
+    features = pipeline.features
         
-    print(f"Final Training Set Shape: {train_df[features].shape}")
+    print(f"Final Training Set Shape: {X_train.shape}")
         
     return (
-        train_df[features], test_df[features],
+        X_train, X_test,
         train_df['price'], test_df['price'],
         train_df['estimated_revenue_l365d'], test_df['estimated_revenue_l365d'],
         test_df, features,
         df,
-        metadata
+        pipeline.metadata,
+        pipeline
     )
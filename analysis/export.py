@@ -0,0 +1,221 @@
+import gzip
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import onnxruntime as ort
+from onnx import NodeProto, helper, save_model
+
+from analysis.interpolation import pchip_nodes
+from analysis.models import AnchorQuantiles, QuantileView
+from analysis.onnx_export import (
+    COMPACT_OPSETS, ONNX_OPSETS, booster_ensemble, fused_ensemble_nodes, graph_model, prune_ensemble, tree_ensemble_nodes
+)
+
+GROUPS = ('Price', 'Revenue')
+
+# 'separate': one tree operator per fitted ensemble; 'fused': all of a group's ensembles in one
+EXPORT_LAYOUTS = ('separate', 'fused')
+
+
+def exported_names(models, group=''):
+    """The models of `group` that export as trees: all but conformal levels, which ship as a metadata lookup."""
+    return [name for name, info in models.items() if name.startswith(group) and not info.get('conformal')]
+
+
+def reference_predictions(trainer, names, X):
+    """Each named model's predictions on float32 X (as float64, the way LightGBM reads it)."""
+    X_source = np.asarray(X, dtype=np.float32).astype(np.float64)
+    return {name: np.asarray(trainer.models[name]['model'].predict(X_source)).reshape(-1) for name in names}
+
+
+def output_sort_key(name):
+    """Point first, then quantiles numerically (Price_Lower_q5 next to Price_q5)."""
+    if 'Point' in name:
+        return -1.0
+    match = re.search(r'_q(\d+)$', name)
+    return float(match.group(1)) if match else 0.0
+
+
+def _ensembles(models, names):
+    """
+    The distinct ensembles behind `names`, as (model, [[output names per column], ...]).
+
+    Plan entries the trainer deduplicated (Price_Lower_q5 and Price_q5) share
+    one fitted model; all their names are collected on that ensemble. A
+    multi-quantile or anchor-interpolated parent has one column per level.
+    """
+    ensembles = {}
+    for name in names:
+        model = models[name]['model']
+        if isinstance(model, QuantileView):
+            parent, column = model.parent, model.index
+            width = len(parent.alphas)
+        else:
+            parent, column, width = model, 0, 1
+        entry = ensembles.setdefault(id(parent), (parent, [[] for _ in range(width)]))
+        entry[1][column].append(name)
+    return list(ensembles.values())
+
+
+def _ensemble_arrays(model, prune=False):
+    """(trees, leaf_weights, base_values) of a LightGBM booster or a MultiQuantileRegressor, optionally pruned."""
+    if hasattr(model, 'onnx_ensemble'):
+        trees, leaf_weights, base_values = model.onnx_ensemble()
+    else:
+        trees, leaf_weights, base_values = booster_ensemble(model.booster_)
+    if prune:
+        trees, leaf_weights = prune_ensemble(trees, leaf_weights)
+    return trees, leaf_weights, base_values
+
+
+def _ensemble_nodes(model, output_names, name, prune=False, operator='TreeEnsembleRegressor'):
+    """Serialized nodes of one ensemble: a LightGBM booster or a MultiQuantileRegressor."""
+    nodes = tree_ensemble_nodes(*_ensemble_arrays(model, prune), output_names, name=name, operator=operator)
+    return [node.SerializeToString() for node in nodes]
+
+
+def _map(function, jobs, n_jobs):
+    """function(*job) for every job, across worker processes when n_jobs > 1."""
+    if n_jobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(min(n_jobs, len(jobs))) as pool:
+            return list(pool.map(function, *zip(*jobs)))
+    return [function(*job) for job in jobs]
+
+
+def build_group_model(models, names, n_features, n_jobs=1, layout='separate', compact=False):
+    """
+    One ONNX graph with an output per name, all reading 'float_input'.
+
+    Each distinct ensemble is converted once, in worker processes when
+    n_jobs > 1, and the graph is assembled in a single step. With the
+    'separate' layout every ensemble is its own tree operator; 'fused'
+    packs them all into one (n_targets = one per distinct output) followed
+    by a Split, so the runtime evaluates the whole group in a single
+    operator call. Names that share a fitted model (e.g. Price_Lower_q5 and
+    Price_q5) are Identity aliases of one output rather than copies of the
+    ensemble. Cost is linear in the number of trees.
+
+    `compact` collapses duplicate subtrees (prune_tree) and, when every
+    ensemble has one output per tree, encodes them with the ai.onnx.ml 5
+    TreeEnsemble operator; multi-quantile ensembles keep
+    TreeEnsembleRegressor, whose leaves can hold several targets.
+
+    Anchor-interpolated levels (AnchorQuantiles) export their anchor
+    ensembles under internal names, followed by the interpolation as graph
+    ops (pchip_nodes) that produce every level's output.
+    """
+    if layout not in EXPORT_LAYOUTS:
+        raise ValueError(f"Unknown export layout '{layout}'. Choose from: {', '.join(EXPORT_LAYOUTS)}")
+    names = sorted(names, key=output_sort_key)
+    ensembles = _ensembles(models, names)
+    # The first name of every column is computed; the others alias it
+    computed = [[column[0] for column in columns] for _, columns in ensembles]
+    # (tree ensemble, its outputs), then the ops computing outputs from other outputs
+    trees, interpolation = [], []
+    for i, ((model, _), outputs) in enumerate(zip(ensembles, computed)):
+        if isinstance(model, AnchorQuantiles):
+            anchor_outputs = [f'interpolation{i}_anchor{j}' for j in range(len(model.anchors))]
+            trees.extend((anchor, [output]) for anchor, output in zip(model.anchors, anchor_outputs))
+            interpolation.extend(pchip_nodes(anchor_outputs, outputs, model.anchor_alphas, model.alphas,
+                                             name=f'interpolation{i}_'))
+        else:
+            trees.append((model, outputs))
+    single_target = all(len(outputs) == 1 for _, outputs in trees)
+    operator = 'TreeEnsemble' if compact and single_target else 'TreeEnsembleRegressor'
+
+    if layout == 'fused':
+        arrays = _map(_ensemble_arrays, [(model, compact) for model, _ in trees], n_jobs)
+        nodes = fused_ensemble_nodes(arrays, [name for _, outputs in trees for name in outputs], name='fused_',
+                                     operator=operator)
+    else:
+        jobs = [(model, outputs, f'ensemble{i}_', compact, operator) for i, (model, outputs) in enumerate(trees)]
+        serialized = _map(_ensemble_nodes, jobs, n_jobs)
+        nodes = [NodeProto.FromString(data) for node_list in serialized for data in node_list]
+    nodes.extend(interpolation)
+    for _, columns in ensembles:
+        for column in columns:
+            nodes.extend(helper.make_node('Identity', [column[0]], [alias], name=f'{alias}_alias')
+                         for alias in column[1:])
+    opsets = COMPACT_OPSETS if operator == 'TreeEnsemble' else ONNX_OPSETS
+    return graph_model(nodes, n_features, names, opsets=opsets)
+
+
+def export_onnx_models(trainer, n_features, model_dir='outputs', n_jobs=None, layout='separate'):
+    """
+    Exports the trainer's models as one ONNX graph per target group (<Group>_Model.onnx).
+
+    Every model of a group becomes an output of a single graph with a shared
+    'float_input' (Price_Point, Price_q5, ...), laid out as in
+    build_group_model. Boosters are converted in parallel across `n_jobs`
+    processes (default: every core). Returns the saved paths.
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    saved = []
+    for group_name in GROUPS:
+        names = exported_names(trainer.models, group_name)
+        if not names:
+            continue
+        start = time.perf_counter()
+        model = build_group_model(trainer.models, names, n_features, n_jobs, layout)
+        onnx_filename = os.path.join(model_dir, f"{group_name}_Model.onnx")
+        save_model(model, onnx_filename)
+        print(f"Saved Combined ONNX model: {onnx_filename} ({len(names)} outputs, "
+              f"{os.path.getsize(onnx_filename) / 2**20:.1f}MB, {time.perf_counter() - start:.1f}s)")
+        saved.append(onnx_filename)
+    return saved
+
+
+def _graph_stats(data, X, references):
+    """Size (raw and gzip), best-of-3 ONNX Runtime load time and max |deviation| from `references` of a graph."""
+    loads = []
+    for _ in range(3):
+        start = time.perf_counter()
+        session = ort.InferenceSession(data, providers=['CPUExecutionProvider'])
+        loads.append(time.perf_counter() - start)
+    names = list(references)
+    outputs = session.run(names, {'float_input': X})
+    deviation = {name: float(np.abs(out.reshape(-1) - references[name]).max()) for name, out in zip(names, outputs)}
+    return {
+        'bytes': len(data), 'gzip_bytes': len(gzip.compress(data, compresslevel=6)), 'load_s': round(min(loads), 4),
+        'max_deviation': max(deviation.values()), 'deviation': deviation,
+    }
+
+
+def compact_onnx_models(trainer, X, model_dir='outputs', n_jobs=None, layout='separate'):
+    """
+    Replaces each exported <Group>_Model.onnx with its compact build
+    (build_group_model(..., compact=True)) and reports what changed: size
+    raw and gzipped, ONNX Runtime load time and the max |deviation| of every
+    output from its source model on X, for both graphs. The report is
+    printed and saved to <model_dir>/onnx_compaction.json.
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    report = {'rows': len(X), 'layout': layout, 'groups': {}}
+    for group_name in GROUPS:
+        path = os.path.join(model_dir, f"{group_name}_Model.onnx")
+        names = exported_names(trainer.models, group_name)
+        if not names or not os.path.exists(path):
+            continue
+        references = reference_predictions(trainer, names, X)
+        with open(path, 'rb') as f:
+            exported = _graph_stats(f.read(), X, references)
+        start = time.perf_counter()
+        model = build_group_model(trainer.models, names, X.shape[1], n_jobs, layout, compact=True)
+        build_s = time.perf_counter() - start
+        compact = _graph_stats(model.SerializeToString(), X, references)
+        compact['build_s'] = round(build_s, 2)
+        compact['operator'] = next(node.op_type for node in model.graph.node if node.op_type.startswith('TreeEnsemble'))
+        save_model(model, path)
+        report['groups'][group_name] = {'exported': exported, 'compact': compact}
+        print(f"Compacted {path}: {exported['bytes'] / 2**20:.1f}MB -> {compact['bytes'] / 2**20:.1f}MB "
+              f"(gzip {exported['gzip_bytes'] / 2**20:.1f}MB -> {compact['gzip_bytes'] / 2**20:.1f}MB), "
+              f"load {exported['load_s']:.2f}s -> {compact['load_s']:.2f}s, max deviation from the models "
+              f"{exported['max_deviation']:.2g} -> {compact['max_deviation']:.2g} ({compact['operator']})")
+    with open(os.path.join(model_dir, 'onnx_compaction.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
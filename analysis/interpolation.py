@@ -0,0 +1,137 @@
+"""
+Monotone (PCHIP) interpolation between anchor quantiles, for whole batches.
+
+Given each row's predictions at a few anchor levels (e.g. q5/q25/q50/q75/
+q95), the levels in between come from the piecewise cubic Hermite
+interpolant with Fritsch-Carlson slopes (what scipy's PchipInterpolator
+computes), which never overshoots: sorted anchors give non-decreasing
+quantiles. The knots are the same for every row, so the spline is a fixed
+linear map of the anchors and their slopes, and the slopes are elementwise
+formulas of the anchor differences. pchip_quantiles evaluates that with
+NumPy and pchip_nodes builds the same computation as ONNX graph ops.
+"""
+import numpy as np
+from onnx import helper, numpy_helper
+
+# Guards 0/0 where both neighbouring secants are flat (the slope is 0 there)
+_TINY = float(np.finfo(np.float32).tiny)
+
+
+def pchip_coefficients(knots, levels):
+    """
+    Constant matrices of the interpolation from `knots` (anchor levels,
+    increasing, at least three, spanning `levels`) to `levels`:
+
+        d = Y @ secant                       (per-interval slopes)
+        interior = (num_weight * dl * dr) / max(right_weight * dr + left_weight * dl, tiny)
+            with dl = d @ left, dr = d @ right
+        ends = max(d @ ends, 0)
+        slopes = ends @ end_slots + interior @ interior_slots
+        quantiles = Y @ values + slopes @ tangents
+    """
+    knots = np.asarray(knots, dtype=np.float64)
+    levels = np.asarray(levels, dtype=np.float64)
+    n = len(knots)
+    if n < 3 or np.any(np.diff(knots) <= 0):
+        raise ValueError("Anchor levels must be increasing and at least three.")
+    if levels.min() < knots[0] - 1e-9 or levels.max() > knots[-1] + 1e-9:
+        raise ValueError("Interpolated levels must lie between the lowest and highest anchor.")
+    h = np.diff(knots)
+
+    secant = np.zeros((n, n - 1))
+    secant[np.arange(n - 1), np.arange(n - 1)] = -1 / h
+    secant[np.arange(1, n), np.arange(n - 1)] = 1 / h
+    left = np.eye(n - 1)[:, :-1]
+    right = np.eye(n - 1)[:, 1:]
+    # Weighted harmonic mean of the neighbouring secants at interior knots
+    left_weight = h[1:] + 2 * h[:-1]
+    right_weight = 2 * h[1:] + h[:-1]
+    # Three-point end slopes, clipped at 0 (for sorted anchors this is scipy's edge rule)
+    ends = np.zeros((n - 1, 2))
+    ends[0, 0] = (2 * h[0] + h[1]) / (h[0] + h[1])
+    ends[1, 0] = -h[0] / (h[0] + h[1])
+    ends[-1, 1] = (2 * h[-1] + h[-2]) / (h[-1] + h[-2])
+    ends[-2, 1] = -h[-1] / (h[-1] + h[-2])
+    end_slots = np.zeros((2, n))
+    end_slots[0, 0] = end_slots[1, -1] = 1
+    interior_slots = np.eye(n)[1:-1]
+
+    # Hermite basis at each level's position within its interval
+    interval = np.clip(np.searchsorted(knots, levels, side='right') - 1, 0, n - 2)
+    t = np.clip((levels - knots[interval]) / h[interval], 0, 1)
+    columns = np.arange(len(levels))
+    values = np.zeros((n, len(levels)))
+    tangents = np.zeros((n, len(levels)))
+    values[interval, columns] = 2 * t**3 - 3 * t**2 + 1
+    values[interval + 1, columns] = -2 * t**3 + 3 * t**2
+    tangents[interval, columns] = (t**3 - 2 * t**2 + t) * h[interval]
+    tangents[interval + 1, columns] = (t**3 - t**2) * h[interval]
+    return {
+        'secant': secant, 'left': left, 'right': right, 'num_weight': left_weight + right_weight,
+        'left_weight': left_weight, 'right_weight': right_weight, 'ends': ends, 'end_slots': end_slots,
+        'interior_slots': interior_slots, 'values': values, 'tangents': tangents,
+    }
+
+
+def pchip_quantiles(anchors, knots, levels):
+    """(n_rows x n_levels) interpolated quantiles from (n_rows x n_knots) anchor predictions (sorted per row first)."""
+    c = pchip_coefficients(knots, levels)
+    Y = np.sort(np.asarray(anchors, dtype=np.float64), axis=1)
+    d = Y @ c['secant']
+    dl, dr = d @ c['left'], d @ c['right']
+    interior = c['num_weight'] * dl * dr / np.maximum(c['right_weight'] * dr + c['left_weight'] * dl, _TINY)
+    slopes = np.maximum(d @ c['ends'], 0) @ c['end_slots'] + interior @ c['interior_slots']
+    return Y @ c['values'] + slopes @ c['tangents']
+
+
+def pchip_nodes(anchor_outputs, output_names, knots, levels, name=''):
+    """
+    ONNX nodes computing pchip_quantiles: the (N x 1) `anchor_outputs` are
+    sorted per row with a Min/Max sorting network, interpolated with the
+    pchip_coefficients matrices and split into one (N x 1) output per level.
+    Uses only default-domain opset 8 operators.
+    """
+    c = pchip_coefficients(knots, levels)
+    nodes = []
+
+    def constant(key, value):
+        tensor_name = f'{name}pchip_{key}'
+        tensor = numpy_helper.from_array(np.asarray(value, dtype=np.float32), tensor_name)
+        nodes.append(helper.make_node('Constant', [], [tensor_name], name=f'{tensor_name}_const', value=tensor))
+        return tensor_name
+
+    def op(op_type, inputs, key, **attributes):
+        output = f'{name}pchip_{key}'
+        nodes.append(helper.make_node(op_type, inputs, [output], name=output, **attributes))
+        return output
+
+    # Odd-even transposition sort: n rounds of compare-exchanges between neighbours
+    columns = list(anchor_outputs)
+    for round_ in range(len(columns)):
+        for i in range(round_ % 2, len(columns) - 1, 2):
+            low = op('Min', [columns[i], columns[i + 1]], f'sort{round_}_{i}_min')
+            high = op('Max', [columns[i], columns[i + 1]], f'sort{round_}_{i}_max')
+            columns[i], columns[i + 1] = low, high
+    Y = op('Concat', columns, 'anchors', axis=1)
+
+    d = op('MatMul', [Y, constant('secant', c['secant'])], 'secants')
+    dl = op('MatMul', [d, constant('left', c['left'])], 'left_secants')
+    dr = op('MatMul', [d, constant('right', c['right'])], 'right_secants')
+    numerator = op('Mul', [op('Mul', [dl, dr], 'secant_products'), constant('num_weight', c['num_weight'])],
+                   'interior_numerator')
+    denominator = op('Add', [op('Mul', [dr, constant('right_weight', c['right_weight'])], 'weighted_right'),
+                             op('Mul', [dl, constant('left_weight', c['left_weight'])], 'weighted_left')],
+                     'interior_denominator')
+    interior = op('Div', [numerator, op('Max', [denominator, constant('tiny', [_TINY])], 'guarded_denominator')],
+                  'interior_slopes')
+    ends = op('Max', [op('MatMul', [d, constant('ends', c['ends'])], 'raw_end_slopes'), constant('zero', [0.0])],
+              'end_slopes')
+    slopes = op('Add', [op('MatMul', [ends, constant('end_slots', c['end_slots'])], 'end_slot_slopes'),
+                        op('MatMul', [interior, constant('interior_slots', c['interior_slots'])], 'interior_slot_slopes')],
+                'slopes')
+    quantiles = op('Add', [op('MatMul', [Y, constant('values', c['values'])], 'value_terms'),
+                           op('MatMul', [slopes, constant('tangents', c['tangents'])], 'tangent_terms')],
+                   'quantiles')
+    nodes.append(helper.make_node('Split', [quantiles], list(output_names), name=f'{name}pchip_split', axis=1,
+                                  split=[1] * len(output_names)))
+    return nodes
@@ -0,0 +1,132 @@
+"""
+Load generator for the local prediction service (analysis/service.py).
+
+Sends randomized PredictionForm payloads from concurrent clients and reports
+latency percentiles and throughput. With --p50-ms / --p99-ms / --min-rps it
+exits non-zero when a target is missed.
+
+    python -m analysis.loadgen --url http://127.0.0.1:8000/predict --concurrency 16 --requests 2000
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+from analysis.service import PROPERTY_TYPE_TO_ROOM_TYPE
+
+NEIGHBOURHOODS = [
+    'Arbutus Ridge', 'Downtown', 'Downtown Eastside', 'Dunbar Southlands', 'Fairview', 'Grandview-Woodland',
+    'Hastings-Sunrise', 'Kensington-Cedar Cottage', 'Kerrisdale', 'Killarney', 'Kitsilano', 'Marpole',
+    'Mount Pleasant', 'Oakridge', 'Renfrew-Collingwood', 'Riley Park', 'Shaughnessy', 'South Cambie',
+    'Strathcona', 'Sunset', 'Victoria-Fraserview', 'West End', 'West Point Grey'
+]
+
+FORM_AMENITIES = [
+    'Wifi', 'Kitchen', 'Heating', 'Washer', 'Dryer', 'Air conditioning', 'Free parking', 'Hot tub', 'Pool',
+    'Gym', 'Pet-friendly', 'Self check-in', 'Lockbox', 'Elevator', 'Balcony', 'Garden', 'BBQ grill', 'Workspace'
+]
+
+
+def sample_form(rng):
+    """A plausible random PredictionForm payload."""
+    bedrooms = rng.randint(0, 5)
+    return {
+        'neighbourhood_cleansed': rng.choice(NEIGHBOURHOODS),
+        'property_type': rng.choice(list(PROPERTY_TYPE_TO_ROOM_TYPE)),
+        'accommodates': rng.randint(1, 10),
+        'bedrooms': bedrooms,
+        'bathrooms': rng.choice([1, 1, 1.5, 2, 2.5, 3]),
+        'beds': max(bedrooms, 1) + rng.randint(0, 2),
+        'host_experience_years': round(rng.uniform(0, 15), 1),
+        'latitude': round(rng.uniform(49.20, 49.30), 5),
+        'longitude': round(rng.uniform(-123.22, -123.03), 5),
+        'reviews_per_month': round(rng.uniform(0, 6), 2),
+        'review_scores_rating': round(rng.uniform(3.5, 5.0), 2),
+        'availability_365': rng.randint(0, 365),
+        'instant_bookable': rng.random() < 0.5,
+        'host_is_superhost': rng.random() < 0.4,
+        'host_identity_verified': rng.random() < 0.9,
+        'amenities': rng.sample(FORM_AMENITIES, rng.randint(3, 12)),
+        'name': rng.randint(15, 50),
+        'description': rng.randint(100, 1000),
+    }
+
+
+def run_load(url, concurrency=16, requests=2000, seed=42):
+    """Sends `requests` payloads from `concurrency` threads; returns (latencies in ms, errors, wall seconds)."""
+    rng = random.Random(seed)
+    payloads = [json.dumps(sample_form(rng)).encode() for _ in range(requests)]
+    latencies = [None] * requests
+    errors = []
+    next_index = iter(range(requests))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            request = urllib.request.Request(url, data=payloads[i], headers={'Content-Type': 'application/json'})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    response.read()
+                latencies[i] = (time.perf_counter() - start) * 1000
+            except Exception as e:
+                errors.append(str(e))
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    return np.array([l for l in latencies if l is not None]), errors, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the local prediction service.")
+    parser.add_argument('--url', default='http://127.0.0.1:8000/predict')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--p50-ms', type=float, default=None, help="Target median latency.")
+    parser.add_argument('--p99-ms', type=float, default=None, help="Target 99th percentile latency.")
+    parser.add_argument('--min-rps', type=float, default=None, help="Target throughput (requests/s).")
+    args = parser.parse_args()
+
+    print(f"Sending {args.requests:,} requests to {args.url} from {args.concurrency} clients...")
+    latencies, errors, wall = run_load(args.url, args.concurrency, args.requests, args.seed)
+    if len(latencies) == 0:
+        print(f"All requests failed, e.g. {errors[0]}")
+        sys.exit(1)
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    rps = len(latencies) / wall
+    print(f"  ok: {len(latencies):,}  errors: {len(errors):,}  wall: {wall:.2f}s")
+    print(f"  latency ms  p50: {p50:.1f}  p95: {p95:.1f}  p99: {p99:.1f}  max: {latencies.max():.1f}")
+    print(f"  throughput: {rps:,.0f} requests/s")
+
+    missed = []
+    if args.p50_ms is not None and p50 > args.p50_ms:
+        missed.append(f"p50 {p50:.1f}ms > {args.p50_ms}ms")
+    if args.p99_ms is not None and p99 > args.p99_ms:
+        missed.append(f"p99 {p99:.1f}ms > {args.p99_ms}ms")
+    if args.min_rps is not None and rps < args.min_rps:
+        missed.append(f"throughput {rps:.0f}/s < {args.min_rps}/s")
+    if errors:
+        missed.append(f"{len(errors)} failed requests")
+    if missed:
+        print("Targets missed: " + "; ".join(missed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,81 +1,789 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import lightgbm as lgb
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.metrics import mean_absolute_error, r2_score
 
+from analysis.interpolation import pchip_coefficients, pchip_quantiles
+from analysis.onnx_export import booster_trees, graph_model, tree_ensemble_nodes
+
+# LightGBM settings for the point models
+POINT_PARAMS = dict(
+    random_state=42,
+    verbose=-1,
+    n_estimators=2000,
+    learning_rate=0.01,
+    num_leaves=64,
+    max_depth=10,
+    colsample_bytree=0.8,
+    subsample=0.8
+)
+
+# LightGBM settings shared by the quantile models
+QUANTILE_PARAMS = dict(
+    random_state=42,
+    verbose=-1,
+    n_estimators=1000,
+    learning_rate=0.05,
+    num_leaves=20,
+    min_child_samples=50,
+    reg_alpha=1.0,
+    colsample_bytree=0.8
+)
+
+# Every 5% percentile
+QUANTILE_LEVELS = [float(f"{q:.2f}") for q in np.arange(0.05, 1.0, 0.05)]
+
+# 'independent': one booster per quantile level; 'multi': one MultiQuantileRegressor per target;
+# 'conformal': no quantile boosters, levels from the point model plus calibrated residual offsets (ConformalQuantiles);
+# 'anchors': one booster per ANCHOR_LEVELS level, the levels in between interpolated per row (AnchorQuantiles)
+QUANTILE_MODES = ('independent', 'multi', 'conformal', 'anchors')
+
+# Levels trained in 'anchors' mode; they must span QUANTILE_LEVELS (no extrapolation past q5 or q95)
+ANCHOR_LEVELS = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+def _leaf_quantiles(residuals, leaf, n_leaves, alphas):
+    """(n_leaves x n_alphas): alphas[k]-percentile of residual column k over the rows in each leaf."""
+    order = np.argsort(leaf, kind='stable')
+    counts = np.bincount(leaf, minlength=n_leaves)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    columns = np.arange(len(alphas))
+    values = np.zeros((n_leaves, len(alphas)))
+    for j in np.flatnonzero(counts):
+        block = np.sort(residuals[order[starts[j]:starts[j] + counts[j]]], axis=0)
+        # Linear interpolation between order statistics (np.quantile's default)
+        position = alphas * (counts[j] - 1)
+        lo = np.floor(position).astype(np.int64)
+        hi = np.minimum(lo + 1, counts[j] - 1)
+        frac = position - lo
+        values[j] = block[lo, columns] * (1 - frac) + block[hi, columns] * frac
+    return values
+
+
+# LightGBM parameters that shape a binned Dataset (bin edges, pre-filtered features, sampling seed)
+_DATASET_PARAMS = (
+    'max_bin', 'max_bin_by_feature', 'min_data_in_bin', 'subsample_for_bin', 'bin_construct_sample_cnt',
+    'min_child_samples', 'min_data_in_leaf', 'feature_pre_filter', 'use_missing', 'zero_as_missing',
+    'linear_tree', 'random_state', 'seed', 'data_random_seed'
+)
+
+
+def _take_rows(X, rows):
+    return X.iloc[rows] if isinstance(X, pd.DataFrame) else X[rows]
+
+
+def validation_rows(n_rows, fraction):
+    """Held-out row positions for early stopping (fixed seed, so every model sees the same split)."""
+    n_valid = int(round(n_rows * fraction))
+    return np.sort(np.random.RandomState(42).permutation(n_rows)[:n_valid])
+
+
+def _stopped_early(booster, params):
+    """Whether early stopping ended training before the tree budget (check before _truncate drops trees)."""
+    budget = params.get('n_estimators', params.get('num_iterations', 100))
+    return booster.current_iteration() < budget
+
+
+def _truncate(booster):
+    """Drops the trees after best_iteration (set by early stopping), so exports carry only the trees in use."""
+    if booster.best_iteration <= 0 or booster.best_iteration >= booster.current_iteration():
+        return booster
+    return lgb.Booster(model_str=booster.model_to_string(num_iteration=booster.best_iteration))
+
+
+class BinnedDatasets:
+    """
+    Constructed lgb.Dataset objects over one design matrix, shared by every fit on it.
+
+    Features are binned once per distinct set of dataset parameters (fits
+    that differ there, e.g. in min_child_samples, would otherwise get other
+    bins or pre-filtered features); fits then only swap the label. Raw data
+    is kept (free_raw_data=False) so the Dataset stays reusable.
+
+    With `cache_dir`, each binned Dataset is also saved with save_binary,
+    keyed by a hash of the design matrix, the dataset parameters and the
+    LightGBM version, so later runs on the same features load the bins
+    instead of recomputing them.
+
+    With `valid_rows`, those rows are held out: the Datasets are built on the
+    remaining (fit) rows and get_valid returns the held-out fold binned the
+    same way, for early stopping.
+    """
+
+    def __init__(self, X, feature_name='auto', cache_dir=None, data_key=None, valid_rows=None):
+        self.valid_rows = None if valid_rows is None else np.asarray(valid_rows)
+        self.fit_rows = None
+        self.X_valid = None
+        if self.valid_rows is not None:
+            self.fit_rows = np.setdiff1d(np.arange(X.shape[0]), self.valid_rows)
+            X, self.X_valid = _take_rows(X, self.fit_rows), _take_rows(X, self.valid_rows)
+            # The cache is keyed by the rows actually binned
+            data_key = None
+        self.X = X
+        self.feature_name = feature_name
+        self.cache_dir = cache_dir
+        self._data_key = data_key
+        self.datasets = {}
+        self.valid_datasets = {}
+        self.construct_seconds = 0.0
+        self.cache_hits = 0
+
+    def labels(self, y):
+        """The labels of the rows the Datasets are built on (`y` has one per row of the full matrix)."""
+        return y if self.fit_rows is None else np.asarray(y)[self.fit_rows]
+
+    def cache_path(self, dataset_params):
+        if self.cache_dir is None:
+            return None
+        if self._data_key is None:
+            self._data_key = fingerprint(self.X)
+        h = hashlib.sha256()
+        h.update(self._data_key.encode())
+        h.update(json.dumps(self.feature_name if self.feature_name != 'auto' else None).encode())
+        h.update(json.dumps(dataset_params, sort_keys=True).encode())
+        h.update(lgb.__version__.encode())
+        return os.path.join(self.cache_dir, f"dataset-{h.hexdigest()[:16]}.bin")
+
+    def _load_or_construct(self, dataset_params, label):
+        params = {'verbose': -1, **dataset_params}
+        path = self.cache_path(dataset_params)
+        if path is not None and os.path.exists(path):
+            self.cache_hits += 1
+            return lgb.Dataset(path, params=params, free_raw_data=False).construct()
+
+        dataset = lgb.Dataset(
+            self.X, label=label, feature_name=self.feature_name, params=params, free_raw_data=False
+        ).construct()
+        if path is not None:
+            # Write to a temporary name first so concurrent workers never read a partial file
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            dataset.save_binary(tmp_path)
+            os.replace(tmp_path, path)
+        return dataset
+
+    def get(self, params, label):
+        """The Dataset for `params`' binning settings, with `label` (one per row of the full matrix) set."""
+        dataset_params = {k: params[k] for k in _DATASET_PARAMS if k in params}
+        key = json.dumps(dataset_params, sort_keys=True)
+        if key not in self.datasets:
+            start = time.perf_counter()
+            self.datasets[key] = self._load_or_construct(dataset_params, self.labels(label))
+            self.construct_seconds += time.perf_counter() - start
+        return self.datasets[key].set_label(self.labels(label))
+
+    def get_valid(self, params, label):
+        """The held-out fold binned like get(params, label), or None without a validation split."""
+        if self.X_valid is None:
+            return None
+        reference = self.get(params, label)
+        key = json.dumps({k: params[k] for k in _DATASET_PARAMS if k in params}, sort_keys=True)
+        valid_label = np.asarray(label)[self.valid_rows]
+        if key not in self.valid_datasets:
+            self.valid_datasets[key] = reference.create_valid(self.X_valid, label=valid_label).construct()
+        return self.valid_datasets[key].set_label(valid_label)
+
+
+class BoosterRegressor:
+    """
+    A LightGBM regressor trained with lgb.train, so it can fit on a shared binned Dataset.
+
+    Takes the same (sklearn-style) parameters as LGBMRegressor and exposes
+    the parts of its interface used here: fit, predict, booster_ and
+    feature_importances_.
+    """
+
+    def __init__(self, objective='regression', alpha=None, **params):
+        self.params = {**params, 'objective': objective}
+        if alpha is not None:
+            self.params['alpha'] = alpha
+        self.booster_ = None
+        self.stopped_early_ = False
+
+    def fit(self, X, y, dataset=None, valid_set=None, **fit_params):
+        """
+        Fits on X (or on `dataset`, an already binned lgb.Dataset of X whose label is y).
+
+        With `valid_set` and an early_stopping_round param, training stops
+        once the validation metric stalls and the booster is truncated to its
+        best iteration; stopped_early_ records whether that happened before
+        the n_estimators budget ran out.
+        """
+        if dataset is None:
+            dataset = BinnedDatasets(X, **fit_params).get(self.params, y)
+        valid_sets = [] if valid_set is None else [valid_set]
+        booster = lgb.train(self.params, dataset, valid_sets=valid_sets)
+        self.stopped_early_ = _stopped_early(booster, self.params)
+        self.booster_ = _truncate(booster)
+        return self
+
+    def predict(self, X):
+        return self.booster_.predict(X)
+
+    @property
+    def feature_importances_(self):
+        return self.booster_.feature_importance()
+
+
+class MultiQuantileRegressor:
+    """
+    Several quantile levels learned on one shared set of trees.
+
+    The trees are grown once by a LightGBM median (alpha=0.5) regressor.
+    Every leaf then holds one value per level: tree by tree, it is the
+    learning-rate-scaled alpha-percentile of that level's residuals among the
+    leaf's training rows, which is the leaf renewal LightGBM's quantile
+    objective itself applies. Prediction walks the trees once for all levels.
+    """
+
+    def __init__(self, alphas, **params):
+        self.alphas = np.asarray(alphas, dtype=np.float64)
+        self.params = {**QUANTILE_PARAMS, **params}
+        self.booster_ = None
+        self.base_values = None
+        self.leaf_values = None
+        self.stopped_early_ = False
+
+    def fit(self, X, y, dataset=None, valid_set=None, **fit_params):
+        """Fits on X (see BoosterRegressor.fit); early stopping follows the median's validation loss."""
+        if dataset is None:
+            dataset = BinnedDatasets(X, **fit_params).get(self.params, y)
+        valid_sets = [] if valid_set is None else [valid_set]
+        params = {**self.params, 'objective': 'quantile', 'alpha': 0.5}
+        booster = lgb.train(params, dataset, valid_sets=valid_sets)
+        self.stopped_early_ = _stopped_early(booster, params)
+        self.booster_ = _truncate(booster)
+
+        y = np.asarray(y, dtype=np.float64)
+        leaves = self.booster_.predict(X, pred_leaf=True)
+        n_leaves = [tree['num_leaves'] for tree in self.booster_.dump_model()['tree_info']]
+        learning_rate = self.params['learning_rate']
+
+        self.base_values = np.quantile(y, self.alphas)
+        pred = np.tile(self.base_values, (len(y), 1))
+        self.leaf_values = []
+        for t, count in enumerate(n_leaves):
+            values = learning_rate * _leaf_quantiles(y[:, None] - pred, leaves[:, t], count, self.alphas)
+            pred += values[leaves[:, t]]
+            self.leaf_values.append(values)
+        return self
+
+    def predict(self, X):
+        """(n_rows x n_levels) predictions, columns in the order of `alphas`."""
+        leaves = self.booster_.predict(X, pred_leaf=True)
+        pred = np.tile(self.base_values, (leaves.shape[0], 1))
+        for t, values in enumerate(self.leaf_values):
+            pred += values[leaves[:, t]]
+        return pred
+
+    def onnx_ensemble(self):
+        """(trees, leaf_weights, base_values) for the ONNX builders: one target per level."""
+        return booster_trees(self.booster_), self.leaf_values, self.base_values
+
+    def onnx_nodes(self, output_names, input_name='float_input', name=''):
+        """Graph nodes: one TreeEnsembleRegressor with a target per level, split into `output_names`."""
+        return tree_ensemble_nodes(*self.onnx_ensemble(), output_names, input_name, name)
+
+    def to_onnx(self, n_features, output_names, input_name='float_input'):
+        """Standalone ONNX model of onnx_nodes."""
+        return graph_model(self.onnx_nodes(output_names, input_name), n_features, output_names, input_name)
+
+
+def conformal_offsets(residuals, alphas):
+    """
+    Split-conformal residual quantiles: for each level, an order statistic
+    of the calibration residuals at rank (n + 1) * alpha, rounded outwards
+    (down below the median, up above it) so every central band [q_a,
+    q_1-a] covers at least its nominal share of new rows.
+    """
+    residuals = np.sort(np.asarray(residuals, dtype=np.float64))
+    n = len(residuals)
+    alphas = np.asarray(alphas, dtype=np.float64)
+    rank = np.where(alphas < 0.5, np.floor((n + 1) * alphas), np.ceil((n + 1) * alphas)).astype(np.int64)
+    return residuals[np.clip(rank, 1, n) - 1]
+
+
+class ConformalQuantiles:
+    """
+    Quantile levels from a point model plus split-conformal residual offsets.
+
+    Each level adds a constant to the point prediction: the residual
+    quantile (conformal_offsets) of the point model on a calibration fold it
+    never trained or early-stopped on, taken in the point model's label space (log1p for
+    log-target models, mapped back with expm1). All levels cost one tree
+    pass plus arithmetic, and the offsets are a small lookup table.
+    """
+
+    def __init__(self, point, alphas, offsets, log_transform=False):
+        self.point = point
+        self.alphas = np.asarray(alphas, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.float64)
+        self.log_transform = log_transform
+
+    @classmethod
+    def calibrate(cls, point, alphas, X_calibration, y_calibration, log_transform=False):
+        """Offsets from the point model's residuals on the calibration rows (labels on the original scale)."""
+        y = np.asarray(y_calibration, dtype=np.float64)
+        residuals = (np.log1p(y) if log_transform else y) - point.predict(X_calibration)
+        return cls(point, alphas, conformal_offsets(residuals, alphas), log_transform)
+
+    def predict(self, X):
+        """(n_rows x n_levels) predictions, columns in the order of `alphas`."""
+        pred = np.asarray(self.point.predict(X), dtype=np.float64)[:, None] + self.offsets
+        return np.expm1(pred) if self.log_transform else pred
+
+    def lookup(self, point_name, calibration_rows):
+        """The offsets as JSON-serialisable metadata (what a scorer needs besides the point model)."""
+        return {'point': point_name, 'log_transform': self.log_transform, 'calibration_rows': int(calibration_rows),
+                'alphas': self.alphas.tolist(), 'offsets': self.offsets.tolist()}
+
+
+class AnchorQuantiles:
+    """
+    Quantile levels interpolated between a few anchor quantile models.
+
+    Each row's anchor predictions are sorted and joined by a monotone cubic
+    (PCHIP, see analysis.interpolation), which is evaluated at every level in
+    `alphas`; the anchor levels themselves come back unchanged. Export
+    writes the anchors' trees plus the interpolation as graph ops.
+    """
+
+    def __init__(self, anchors, anchor_alphas, alphas):
+        self.anchors = list(anchors)
+        self.anchor_alphas = np.asarray(anchor_alphas, dtype=np.float64)
+        self.alphas = np.asarray(alphas, dtype=np.float64)
+
+    def predict(self, X):
+        """(n_rows x n_levels) predictions, columns in the order of `alphas`."""
+        anchors = np.column_stack([np.asarray(model.predict(X), dtype=np.float64) for model in self.anchors])
+        return pchip_quantiles(anchors, self.anchor_alphas, self.alphas)
+
+
+class QuantileView:
+    """A single level of a MultiQuantileRegressor, ConformalQuantiles or AnchorQuantiles, with predict(X) -> 1-D array."""
+
+    def __init__(self, parent, index):
+        self.parent = parent
+        self.index = index
+
+    @property
+    def alpha(self):
+        return float(self.parent.alphas[self.index])
+
+    def predict(self, X):
+        return self.parent.predict(X)[:, self.index]
+
+
+def interval_coverage(y, distribution, alphas=QUANTILE_LEVELS, widths=(0.9, 0.5)):
+    """% of `y` inside each central band of a predict_distribution array (width 0.9: the q5 to q95 columns)."""
+    alphas = np.round(np.asarray(alphas, dtype=np.float64), 6)
+    y = np.asarray(y, dtype=np.float64)
+    coverage = {}
+    for width in widths:
+        low = int(np.flatnonzero(alphas == round((1 - width) / 2, 6))[0])
+        high = int(np.flatnonzero(alphas == round((1 + width) / 2, 6))[0])
+        coverage[width] = float(np.mean((y >= distribution[:, low]) & (y <= distribution[:, high])) * 100)
+    return coverage
+
+
+def quantile_name(name, alpha):
+    """<name>_qNN, unless name already carries the suffix."""
+    q_suffix = f"_q{int(alpha*100)}"
+    return name if name.endswith(q_suffix) else f"{name}{q_suffix}"
+
+
+def point_task(target, name, log_transform=False, **params):
+    """Training plan entry for a point (L2) model of `target`."""
+    return {'name': name, 'target': target, 'objective': 'regression', 'alpha': None,
+            'log_transform': log_transform, 'params': {**POINT_PARAMS, **params}}
+
+
+def quantile_task(target, name, alpha, **params):
+    """Training plan entry for one quantile level of `target`, named <name>_qNN."""
+    return {'name': quantile_name(name, alpha), 'target': target, 'objective': 'quantile', 'alpha': alpha,
+            'log_transform': False, 'params': {**QUANTILE_PARAMS, **params}}
+
+
+def conformal_task(target, name_prefix, point_name, alphas=QUANTILE_LEVELS):
+    """Plan entry for conformal levels <name_prefix>_qNN around the plan's `point_name` model (no extra fit)."""
+    if point_name is None:
+        raise ValueError("Conformal quantiles need the name of the point model they are calibrated around.")
+    return {'name': name_prefix, 'target': target, 'objective': 'conformal', 'alpha': list(alphas),
+            'point': point_name, 'log_transform': False, 'params': {}}
+
+
+def anchor_tasks(target, name_prefix, alphas=QUANTILE_LEVELS, anchors=ANCHOR_LEVELS, **params):
+    """
+    Plan entries for levels <name_prefix>_qNN interpolated between quantile
+    models at the `anchors` levels: one quantile entry per anchor, then the
+    interpolation entry (no extra fit) that replaces them with all `alphas`.
+    """
+    pchip_coefficients(anchors, alphas)
+    tasks = [quantile_task(target, name_prefix, alpha, **params) for alpha in anchors]
+    return tasks + [{'name': name_prefix, 'target': target, 'objective': 'anchors', 'alpha': list(alphas),
+                     'anchors': [task['name'] for task in tasks], 'anchor_alpha': list(anchors),
+                     'log_transform': False, 'params': {}}]
+
+
+def quantile_tasks(target, name_prefix, alphas=QUANTILE_LEVELS, mode='independent', point_name=None, **params):
+    """
+    Plan entries for every level in `alphas`: one per level, a single
+    multi-quantile entry, (mode='conformal') a conformal entry around the
+    point model `point_name`, or (mode='anchors') anchor levels plus an
+    interpolation entry.
+    """
+    if mode == 'conformal':
+        return [conformal_task(target, name_prefix, point_name, alphas)]
+    if mode == 'anchors':
+        return anchor_tasks(target, name_prefix, alphas, **params)
+    if mode == 'multi':
+        return [{'name': name_prefix, 'target': target, 'objective': 'multi_quantile', 'alpha': list(alphas),
+                 'log_transform': False, 'params': {**QUANTILE_PARAMS, **params}}]
+    return [quantile_task(target, name_prefix, alpha, **params) for alpha in alphas]
+
+
+def fingerprint(data):
+    """SHA-256 of a feature matrix or target vector (DataFrame, Series, CSR or array)."""
+    h = hashlib.sha256()
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        h.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+        if isinstance(data, pd.DataFrame):
+            h.update(json.dumps([str(c) for c in data.columns]).encode())
+    elif sparse.issparse(data):
+        data = data.tocsr()
+        for part in (data.data, data.indices, data.indptr, np.array(data.shape)):
+            h.update(np.ascontiguousarray(part).tobytes())
+    else:
+        h.update(np.ascontiguousarray(data).tobytes())
+    return h.hexdigest()
+
+
+def _task_key(data_key, target_key, task):
+    """Tasks with the same key fit the same model: same data, labels, objective and parameters."""
+    spec = {k: task[k] for k in ('objective', 'alpha', 'params')}
+    return hashlib.sha256(f"{data_key}:{target_key}:{json.dumps(spec, sort_keys=True)}".encode()).hexdigest()
+
+
+def build_model(task, n_jobs=None):
+    params = dict(task['params'])
+    if n_jobs is not None:
+        params['n_jobs'] = n_jobs
+    if task['objective'] == 'multi_quantile':
+        return MultiQuantileRegressor(task['alpha'], **params)
+    return BoosterRegressor(task['objective'], task['alpha'], **params)
+
+
+def _fit_task(task, datasets, y, n_jobs=None):
+    """Fits one plan entry on the shared binned datasets; returns (model, wall seconds, CPU seconds)."""
+    start, cpu_start = time.perf_counter(), time.process_time()
+    model = build_model(task, n_jobs)
+    model.fit(
+        datasets.X, datasets.labels(y),
+        dataset=datasets.get(model.params, y), valid_set=datasets.get_valid(model.params, y)
+    )
+    return model, time.perf_counter() - start, time.process_time() - cpu_start
+
+
+# Binned datasets shared by the fits of one process-pool worker (built once per worker)
+_WORKER_DATA = {}
+
+
+def _init_worker(X, fit_params, cache_dir, data_key, valid_rows):
+    _WORKER_DATA['datasets'] = BinnedDatasets(
+        X, cache_dir=cache_dir, data_key=data_key, valid_rows=valid_rows, **fit_params
+    )
+
+
+def dataset_pool(workers, X, fit_params, cache_dir, data_key, valid_rows):
+    """A process pool whose workers each bin X once (BinnedDatasets); jobs read them with worker_datasets()."""
+    return ProcessPoolExecutor(workers, initializer=_init_worker,
+                               initargs=(X, fit_params, cache_dir, data_key, valid_rows))
+
+
+def worker_datasets():
+    """The BinnedDatasets of the dataset_pool worker this runs in."""
+    return _WORKER_DATA['datasets']
+
+
+def _fit_task_in_worker(task, y, n_jobs):
+    model, seconds, cpu_seconds = _fit_task(task, worker_datasets(), y, n_jobs)
+    return model, seconds, cpu_seconds, len(worker_datasets().datasets)
+
 
 class ModelTrainer:
-    def __init__(self):
+    def __init__(self, amenity_matrix=None, quantile_mode='independent', n_jobs=None, dataset_cache_dir=None,
+                 early_stopping_rounds=None, validation_fraction=0.2):
+        if quantile_mode not in QUANTILE_MODES:
+            raise ValueError(f"quantile_mode must be one of {QUANTILE_MODES}, got '{quantile_mode}'.")
+        if quantile_mode == 'conformal' and early_stopping_rounds:
+            # The held-out fold would both pick the point model's iteration count and set the offsets,
+            # so the offsets would no longer come from residuals the model never saw
+            raise ValueError("Conformal quantiles can't be combined with early stopping: both use the held-out fold.")
         self.models = {}
-        
-    def train_point_estimator(self, X_train, y_train, name="model", log_transform=False):
-        """Trains a standard LightGBM Regressor"""
-        print(f"Training {name} (Point Estimate)...")
-        
-        target = np.log1p(y_train) if log_transform else y_train
-        
-        model = lgb.LGBMRegressor(
-            random_state=42, 
-            verbose=-1, 
-            n_estimators=2000,
-            learning_rate=0.01,
-            num_leaves=64,
-            max_depth=10,
-            colsample_bytree=0.8,
-            subsample=0.8
-        )
-        model.fit(X_train, target)
-        self.models[name] = {'model': model, 'log_transform': log_transform}
-        
-        # Feature Importance
+        # Optional AmenityMatrix appended (sparse) to every design matrix; rows are looked up by X's listing-id index
+        self.amenity_matrix = amenity_matrix
+        self.quantile_mode = quantile_mode
+        # Global thread budget shared by all concurrent LightGBM fits (default: every core)
+        self.n_jobs = n_jobs
+        # Optional directory for binned Datasets saved across runs (see BinnedDatasets)
+        self.dataset_cache_dir = dataset_cache_dir
+        # Adaptive mode: hold out validation_fraction of the training rows and stop each model once its
+        # validation loss (RMSE for point models, pinball for quantiles) hasn't improved for this many rounds
+        self.early_stopping_rounds = early_stopping_rounds
+        self.validation_fraction = validation_fraction
+        # Fit time per model name, per-fit stats (wall/CPU seconds, trees, shape) and fitted models by task key
+        self.timings = {}
+        self.fit_stats = {}
+        self._fitted = {}
+        # Conformal levels by name prefix: the lookup (point model, offsets) that replaces their trees in exports
+        self.conformal = {}
+        # AnchorQuantiles by (anchor models, levels), so deduplicated anchors share one interpolation
+        self._interpolated = {}
+
+    @property
+    def fitted(self):
+        """The distinct fitted models, in fit order (plan entries that shared a fit appear once)."""
+        return list(self._fitted.values())
+
+    def design_matrix(self, X):
+        """Model input for X: the frame itself, or a CSR matrix with the amenity block appended."""
+        if self.amenity_matrix is None:
+            return X
+        return self.amenity_matrix.hstack(X)
+
+    def feature_names(self, X):
+        names = list(X.columns)
+        if self.amenity_matrix is not None:
+            names += self.amenity_matrix.feature_names
+        return names
+
+    def thread_budget(self, n_fits):
+        """(worker processes, LightGBM threads per fit) so that workers x threads stays within the budget."""
+        budget = self.n_jobs or os.cpu_count() or 1
+        workers = max(1, min(budget, n_fits))
+        return workers, max(1, budget // workers)
+
+    def _validation_rows(self, n_rows):
+        """Held-out rows: the early-stopping fold, or in conformal mode (never early-stopped) the calibration fold."""
+        if not self.early_stopping_rounds and self.quantile_mode != 'conformal':
+            return None
+        return validation_rows(n_rows, self.validation_fraction)
+
+    def _with_early_stopping(self, task):
+        if not self.early_stopping_rounds:
+            return task
+        metric = 'rmse' if task['objective'] == 'regression' else 'quantile'
+        params = {**task['params'], 'early_stopping_round': self.early_stopping_rounds,
+                  'first_metric_only': True, 'metric': metric}
+        return {**task, 'params': params}
+
+    def fit_plan(self, plan, X_train, targets):
+        """
+        Fits a declarative training plan.
+
+        Args:
+            plan: Entries from point_task / quantile_task / quantile_tasks.
+            X_train: Training features (the amenity block is appended if configured).
+            targets: Dict of target name -> training labels, keyed by the entries' 'target'.
+        Entries are deduplicated by a hash of the data, labels, objective and
+        parameters; models this trainer already fitted are reused. The
+        remaining fits run on a process pool sized to the thread budget and
+        share binned Datasets (see BinnedDatasets) instead of re-binning X
+        per fit. Every entry is registered in self.models under its name.
+        With early_stopping_rounds set, every model trains on the same
+        fit/validation split and keeps only its best iteration. In conformal
+        mode every model trains on that fit split, and conformal entries are
+        calibrated on the held-out rows (ConformalQuantiles) instead of fitted.
+        Anchor entries register every level as an interpolation
+        (AnchorQuantiles) of the anchor models, including the anchor names.
+        """
+        X = self.design_matrix(X_train)
+        fit_params = {} if self.amenity_matrix is None else {'feature_name': self.feature_names(X_train)}
+        valid_rows = self._validation_rows(X.shape[0])
+        data_key = fingerprint(X)
+        if valid_rows is not None:
+            data_key = f"{data_key}:valid={self.validation_fraction}"
+        conformal = [task for task in plan if task['objective'] == 'conformal']
+        if conformal and self.quantile_mode != 'conformal':
+            raise ValueError("Conformal plan entries need quantile_mode='conformal' (a held-out calibration fold).")
+        interpolated = [task for task in plan if task['objective'] == 'anchors']
+        plan = [self._with_early_stopping(task) for task in plan if task['objective'] not in ('conformal', 'anchors')]
+
+        labels, target_keys = {}, {}
+        keyed = []
+        for task in plan:
+            label_id = (task['target'], task['log_transform'])
+            if label_id not in labels:
+                y = targets[task['target']]
+                labels[label_id] = np.log1p(y) if task['log_transform'] else y
+                target_keys[label_id] = fingerprint(labels[label_id])
+            keyed.append((_task_key(data_key, target_keys[label_id], task), task, label_id))
+
+        pending = {}
+        for key, task, label_id in keyed:
+            if key not in self._fitted and key not in pending:
+                pending[key] = (task, label_id)
+        workers, threads = self.thread_budget(len(pending))
+        if pending:
+            print(f"Training plan: {len(plan)} models, {len(pending)} to fit "
+                  f"({len(plan) - len(pending)} reused or duplicate), {workers} worker(s) x {threads} thread(s)")
+
+        start = time.perf_counter()
+        fit_times, fit_cpu = {}, {}
+
+        def report(done, key, seconds):
+            task = pending[key][0]
+            level = ''
+            if task['objective'] == 'quantile':
+                level = f" {task['alpha']}"
+            elif task['objective'] == 'multi_quantile':
+                level = f" x{len(task['alpha'])}"
+            trees = self._fitted[key].booster_.num_trees()
+            print(f"  [{done}/{len(pending)}] {task['name']} ({task['objective']}{level}): {seconds:.1f}s, {trees} trees")
+
+        if workers == 1:
+            datasets = BinnedDatasets(
+                X, cache_dir=self.dataset_cache_dir, data_key=data_key, valid_rows=valid_rows, **fit_params
+            )
+            for done, (key, (task, label_id)) in enumerate(pending.items(), 1):
+                self._fitted[key], fit_times[key], fit_cpu[key] = _fit_task(task, datasets, labels[label_id], threads)
+                report(done, key, fit_times[key])
+            binned = (f"{len(datasets.datasets)} binned dataset(s) in {datasets.construct_seconds:.1f}s, "
+                      f"{datasets.cache_hits} from cache")
+        else:
+            worker_datasets = 0
+            with dataset_pool(workers, X, fit_params, self.dataset_cache_dir, data_key, valid_rows) as pool:
+                futures = {
+                    pool.submit(_fit_task_in_worker, task, labels[label_id], threads): key
+                    for key, (task, label_id) in pending.items()
+                }
+                for done, future in enumerate(as_completed(futures), 1):
+                    key = futures[future]
+                    self._fitted[key], fit_times[key], fit_cpu[key], n_datasets = future.result()
+                    worker_datasets = max(worker_datasets, n_datasets)
+                    report(done, key, fit_times[key])
+            binned = f"up to {worker_datasets} binned dataset(s) per worker"
+        if pending:
+            print(f"Training plan done in {time.perf_counter() - start:.1f}s "
+                  f"(sum of fit times {sum(fit_times.values()):.1f}s, {binned})")
+
+        recorded = set()
+        for key, task, _ in keyed:
+            model = self._fitted[key]
+            # Stats go under the first name of each fit (duplicate entries share it)
+            if key in fit_times and key not in recorded:
+                recorded.add(key)
+                self.fit_stats[task['name']] = {
+                    'wall_s': round(fit_times[key], 4), 'cpu_s': round(fit_cpu[key], 4),
+                    'trees': model.booster_.num_trees(), 'rows': X.shape[0], 'cols': X.shape[1],
+                    'objective': task['objective'],
+                }
+            if task['objective'] == 'multi_quantile':
+                for i, alpha in enumerate(model.alphas):
+                    name = quantile_name(task['name'], alpha)
+                    self.models[name] = {'model': QuantileView(model, i), 'log_transform': False}
+                    self.timings[name] = fit_times.get(key, 0.0)
+            else:
+                self.models[task['name']] = {'model': model, 'log_transform': task['log_transform']}
+                self.timings[task['name']] = fit_times.get(key, 0.0)
+
+        for task in conformal:
+            point = self.models[task['point']]
+            model = ConformalQuantiles.calibrate(
+                point['model'], task['alpha'], _take_rows(X, valid_rows),
+                np.asarray(targets[task['target']])[valid_rows], point['log_transform']
+            )
+            self.conformal[task['name']] = model.lookup(task['point'], len(valid_rows))
+            for i, alpha in enumerate(model.alphas):
+                name = quantile_name(task['name'], alpha)
+                # Flagged so exports skip it: the levels ship as a lookup, not as trees
+                self.models[name] = {'model': QuantileView(model, i), 'log_transform': False, 'conformal': True}
+                self.timings[name] = 0.0
+
+        for task in interpolated:
+            anchors = [self.models[name]['model'] for name in task['anchors']]
+            key = (tuple(id(model) for model in anchors), tuple(task['anchor_alpha']), tuple(task['alpha']))
+            if key not in self._interpolated:
+                self._interpolated[key] = AnchorQuantiles(anchors, task['anchor_alpha'], task['alpha'])
+            model = self._interpolated[key]
+            for i, alpha in enumerate(model.alphas):
+                name = quantile_name(task['name'], alpha)
+                self.models[name] = {'model': QuantileView(model, i), 'log_transform': False}
+                # Anchor names keep their fit time; interpolated levels cost none
+                self.timings.setdefault(name, 0.0)
+        return self.models
+
+    def print_feature_importances(self, name, X_train, top=10):
+        model = self.models[name]['model']
         if hasattr(model, 'feature_importances_'):
             importances = pd.DataFrame({
-                'Feature': X_train.columns,
+                'Feature': self.feature_names(X_train),
                 'Importance': model.feature_importances_
-            }).sort_values('Importance', ascending=False).head(10)
-            print(f"Top 10 Features for {name}:")
+            }).sort_values('Importance', ascending=False).head(top)
+            print(f"Top {top} Features for {name}:")
             print(importances.to_string(index=False))
-            
+
+    def train_point_estimator(self, X_train, y_train, name="model", log_transform=False):
+        """Trains a standard LightGBM Regressor"""
+        print(f"Training {name} (Point Estimate)...")
+        self.fit_plan([point_task(name, name, log_transform)], X_train, {name: y_train})
+        self.print_feature_importances(name, X_train)
         return self.models[name]
         
     def train_quantile_estimator(self, X_train, y_train, alpha, name="quantile_model"):
         """Trains a LightGBM Quantile Regressor"""
-        q_suffix = f"_q{int(alpha*100)}"
-        # Append suffix if not present to ensure uniqueness in trainer.models keys
-        full_name = name if name.endswith(q_suffix) else f"{name}{q_suffix}"
-        
+        full_name = quantile_name(name, alpha)
         print(f"Training {full_name} (Quantile: {alpha})...")
-        model = lgb.LGBMRegressor(
-            objective='quantile',
-            alpha=alpha,
-            random_state=42,
-            verbose=-1,
-            n_estimators=1000,
-            learning_rate=0.05,
-            num_leaves=20,
-            min_child_samples=50,
-            reg_alpha=1.0,
-            colsample_bytree=0.8
-        )
-        model.fit(X_train, y_train)
-        self.models[full_name] = {'model': model, 'log_transform': False}
-        return {'model': model, 'log_transform': False}
+        self.fit_plan([quantile_task(name, name, alpha)], X_train, {name: y_train})
+        return self.models[full_name]
+
+    def train_multi_quantile_estimator(self, X_train, y_train, alphas, name_prefix="quantile_model"):
+        """Trains one MultiQuantileRegressor for all `alphas`; each level is registered as <prefix>_qNN."""
+        print(f"Training {name_prefix} (Multi-Quantile: {len(alphas)} levels)...")
+        self.fit_plan(quantile_tasks(name_prefix, name_prefix, alphas, mode='multi'), X_train, {name_prefix: y_train})
+        return self.models[quantile_name(name_prefix, alphas[0])]['model'].parent
 
     def train_quantiles_range(self, X_train, y_train, name_prefix="quantile_model"):
         """Trains LightGBM Quantile Regressors for every 5% percentile"""
-        quantiles = np.arange(0.05, 1.0, 0.05)
-        results = {}
-        for q in quantiles:
-            # Avoid re-training if exact same call
-            q = float(f"{q:.2f}") # Avoid floating point precision issues
-            self.train_quantile_estimator(X_train, y_train, q, name_prefix)
-        return self.models
+        print(f"Training {name_prefix} quantiles ({self.quantile_mode})...")
+        plan = quantile_tasks(name_prefix, name_prefix, mode=self.quantile_mode)
+        return self.fit_plan(plan, X_train, {name_prefix: y_train})
+
+    def predict_distribution(self, X, name_prefix, alphas=QUANTILE_LEVELS):
+        """
+        The <name_prefix>_qNN predictions for every row of X, as an
+        (n_rows x n_quantiles) float32 array with columns in `alphas` order.
+
+        The design matrix is built once and each distinct ensemble predicts
+        once (a multi-quantile model yields all its levels in one pass). Each
+        row is then sorted (monotone rearrangement), so no two quantiles cross.
+        """
+        X = self.design_matrix(X)
+        distribution = np.empty((X.shape[0], len(alphas)), dtype=np.float32)
+        parents = {}
+        for j, alpha in enumerate(alphas):
+            model = self.models[quantile_name(name_prefix, alpha)]['model']
+            if isinstance(model, QuantileView):
+                if id(model.parent) not in parents:
+                    parents[id(model.parent)] = model.parent.predict(X)
+                distribution[:, j] = parents[id(model.parent)][:, model.index]
+            else:
+                distribution[:, j] = model.predict(X)
+        distribution.sort(axis=1)
+        return distribution
 
     def evaluate(self, model_wrapper, X_test, y_test, metric_prefix="Model"):
         model = model_wrapper['model']
         log_transform = model_wrapper['log_transform']
         
-        preds = model.predict(X_test)
+        preds = model.predict(self.design_matrix(X_test))
         
         if log_transform:
             preds = np.expm1(preds)
@@ -0,0 +1,135 @@
+"""
+Checks the exported ONNX graphs against the models they were built from.
+
+The <Group>_Model.onnx graph of every group the trainer exports is loaded
+in ONNX Runtime and each of its outputs named by export.exported_names
+(Price_Point, Price_q5 ... Revenue_q95) is compared with its source
+model's predictions on the same rows, cast to float32 as the graph sees
+them. Then rows/sec and per-call latency are measured for
+each batch size and intra-op thread count. The report is saved next to the
+models as onnx_check.json.
+"""
+import json
+import os
+import time
+
+import numpy as np
+import onnxruntime as ort
+
+from analysis.export import GROUPS, exported_names, reference_predictions
+
+# An output matches when |onnx - model| <= PARITY_ATOL + PARITY_RTOL * max|model|: float32 sums over thousands of
+# trees round at the scale of the output's range, not of each row's value (a near-zero row is as noisy as any other)
+PARITY_RTOL = 1e-4
+PARITY_ATOL = 1e-3
+
+BATCH_SIZES = (1, 100, 1000)
+
+
+def parity(outputs, references, rtol=PARITY_RTOL, atol=PARITY_ATOL):
+    """Per output: max absolute error, the same relative to the output's largest |value|, and rows out of tolerance."""
+    results = {}
+    for name, reference in references.items():
+        error = np.abs(np.asarray(outputs[name], dtype=np.float64).reshape(-1) - reference)
+        scale = float(np.abs(reference).max())
+        mismatches = int(np.sum(~(error <= atol + rtol * scale)))
+        results[name] = {
+            'max_abs_error': float(error.max()), 'max_rel_error': float(error.max() / max(scale, atol)),
+            'mismatches': mismatches, 'passed': mismatches == 0,
+        }
+    return results
+
+
+def time_calls(session, X, calls):
+    """Per-call wall and CPU seconds of running every output of `session` on X (after one warm-up call)."""
+    outputs = [o.name for o in session.get_outputs()]
+    session.run(outputs, {'float_input': X})
+    walls, cpus = [], []
+    for _ in range(calls):
+        cpu, start = time.process_time(), time.perf_counter()
+        session.run(outputs, {'float_input': X})
+        walls.append(time.perf_counter() - start)
+        cpus.append(time.process_time() - cpu)
+    return np.array(walls), np.array(cpus)
+
+
+def throughput(path, X, batch_sizes=BATCH_SIZES, thread_counts=(1,)):
+    """Latency (p50/p99 ms) and rows/sec of a graph per intra-op thread count and batch size."""
+    records = []
+    for threads in thread_counts:
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        for size in batch_sizes:
+            # Batches larger than X repeat its rows
+            batch = X[np.arange(size) % len(X)]
+            walls, _ = time_calls(session, batch, calls=max(3, min(200, 2000 // size)))
+            records.append({
+                'threads': threads, 'batch_size': size, 'p50_ms': round(float(np.median(walls)) * 1e3, 3),
+                'p99_ms': round(float(np.percentile(walls, 99)) * 1e3, 3),
+                'rows_per_s': round(size / float(np.median(walls))),
+            })
+    return records
+
+
+def check_onnx_models(trainer, X, model_dir='outputs', batch_sizes=None, thread_counts=None,
+                      rtol=PARITY_RTOL, atol=PARITY_ATOL):
+    """
+    Runs the parity check on every exported graph, prints a summary and
+    saves the report to <model_dir>/onnx_check.json. Raises RuntimeError,
+    after saving, when a graph is missing a trained model's output or any
+    output is out of tolerance.
+
+    The throughput sweep only runs when `batch_sizes` or `thread_counts` is
+    given (the other defaults to BATCH_SIZES / 1 and all cores).
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    sweep = bool(batch_sizes or thread_counts)
+    batch_sizes = batch_sizes or BATCH_SIZES
+    thread_counts = thread_counts or sorted({1, os.cpu_count() or 1})
+    report = {'rows': len(X), 'rtol': rtol, 'atol': atol, 'graphs': {}}
+    failures = []
+    expected = {group: exported_names(trainer.models, group) for group in GROUPS}
+    expected = {group: names for group, names in expected.items() if names}
+    if not expected:
+        raise RuntimeError("No exported models: the trainer has no models that export as ONNX graphs.")
+    for group, expected_names in expected.items():
+        path = os.path.join(model_dir, f"{group}_Model.onnx")
+        if not os.path.exists(path):
+            failures.append(f"{group}: no graph at {path}")
+            print(f"{path}: missing")
+            continue
+        session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+        names = [o.name for o in session.get_outputs()]
+        missing = sorted(name for name in expected_names if name not in names)
+        unknown = [name for name in names if name not in expected_names]
+        checked = [name for name in names if name in expected_names]
+        results = parity(dict(zip(checked, session.run(checked, {'float_input': X}))),
+                         reference_predictions(trainer, checked, X), rtol, atol)
+        failed = [name for name, result in results.items() if not result['passed']]
+        failures.extend(f"{group}: {name} out of tolerance" for name in failed)
+        failures.extend(f"{group}: no output for {name}" for name in missing)
+        report['graphs'][group] = {
+            'path': path, 'bytes': os.path.getsize(path), 'outputs': results, 'missing_outputs': missing,
+            'unchecked_outputs': unknown, 'throughput': throughput(path, X, batch_sizes, thread_counts) if sweep else [],
+        }
+        if not results:
+            failures.append(f"{group}: no output of {path} matches an exported model")
+            print(f"{path}: no output matches an exported model")
+            continue
+
+        worst = max(results, key=lambda name: results[name]['max_rel_error'])
+        print(f"{path}: {len(checked) - len(failed)}/{len(checked)} outputs match the models "
+              f"(worst {worst}: abs {results[worst]['max_abs_error']:.2g}, rel {results[worst]['max_rel_error']:.2g})"
+              + (f", missing {', '.join(missing)}" if missing else ''))
+        for record in report['graphs'][group]['throughput']:
+            print(f"  threads {record['threads']:>2}  batch {record['batch_size']:>6}  p50 {record['p50_ms']:>9.3f}ms  "
+                  f"p99 {record['p99_ms']:>9.3f}ms  {record['rows_per_s']:>10,} rows/s")
+
+    report_path = os.path.join(model_dir, 'onnx_check.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"ONNX check report saved to '{report_path}'.")
+    if failures:
+        raise RuntimeError("ONNX graphs don't match their models:\n  " + "\n  ".join(failures))
+    return report
@@ -0,0 +1,357 @@
+import numpy as np
+from onnx import AttributeProto, TensorProto, helper, numpy_helper
+
+# Operator sets of the exported graphs (those the onnxmltools LightGBM converter used before)
+ONNX_OPSETS = [helper.make_opsetid('', 8), helper.make_opsetid('ai.onnx.ml', 1)]
+
+# Tree operators: 'TreeEnsembleRegressor' (ai.onnx.ml 1, what every runtime reads) or the compact
+# 'TreeEnsemble' (ai.onnx.ml 5: tensors for thresholds, modes and leaf weights, no per-node ids or hit rates)
+TREE_OPERATORS = ('TreeEnsembleRegressor', 'TreeEnsemble')
+COMPACT_OPSETS = [helper.make_opsetid('', 8), helper.make_opsetid('ai.onnx.ml', 5)]
+
+# LightGBM decision_type bits (text model format)
+_CATEGORICAL_MASK = 1
+_DEFAULT_LEFT_MASK = 2
+_MISSING_NONE = 0
+
+
+def booster_trees(booster):
+    """
+    The trees of a LightGBM booster as arrays, parsed from its text model.
+
+    Each tree is a dict with num_leaves and leaf_value, plus split_feature,
+    threshold, decision_type, left_child and right_child for its internal
+    nodes (children < 0 are leaves ~child). Much faster than dump_model()'s
+    JSON for large ensembles.
+    """
+    model = booster.model_to_string()
+    model = model[:model.index('\nend of trees')]
+    trees = []
+    for block in model.split('\nTree=')[1:]:
+        fields = dict(line.split('=', 1) for line in block.splitlines()[1:] if '=' in line)
+        tree = {'num_leaves': int(fields['num_leaves']),
+                'leaf_value': np.array(fields['leaf_value'].split(), dtype=np.float64)}
+        if tree['num_leaves'] > 1:
+            for key, dtype in (('split_feature', np.int64), ('threshold', np.float64), ('decision_type', np.int64),
+                               ('left_child', np.int64), ('right_child', np.int64)):
+                tree[key] = np.array(fields[key].split(), dtype=dtype)
+        trees.append(tree)
+    return trees
+
+
+def _nan_goes_left(decision_type, threshold):
+    """Where LightGBM sends NaN at each split: as 0.0 when the split has no missing handling, else the default side."""
+    missing_type = (decision_type >> 2) & 3
+    default_left = (decision_type & _DEFAULT_LEFT_MASK) > 0
+    return np.where(missing_type == _MISSING_NONE, 0.0 <= threshold, default_left)
+
+
+def _float32_thresholds(threshold):
+    """Largest float32 <= each threshold, so `x <= t` picks the same side for every float32 input."""
+    limit = float(np.finfo(np.float32).max)
+    value = np.clip(threshold, -limit, limit).astype(np.float32)
+    # Compare in float64: float32-vs-float64 comparisons must not round the threshold first
+    above = value.astype(np.float64) > threshold
+    value[above] = np.nextafter(value[above], np.float32(-np.inf))
+    return value
+
+
+def prune_tree(tree, leaf_weights):
+    """
+    Collapses every split whose two subtrees are identical (same splits,
+    float32 thresholds, NaN routing and float32 leaf weights) into one copy;
+    such splits can't change a prediction. Returns the tree in the
+    booster_trees() format and its (n_leaves x n_targets) leaf weights,
+    renumbered when anything collapsed.
+    """
+    n_leaves = tree['num_leaves']
+    weights = np.asarray(leaf_weights, dtype=np.float64).reshape(n_leaves, -1)
+    if n_leaves == 1:
+        return tree, weights
+    thresholds = _float32_thresholds(tree['threshold'])
+    nan_left = _nan_goes_left(tree['decision_type'], tree['threshold'])
+    leaf_bytes = weights.astype(np.float32)
+    keys = {}
+    n_internal = n_leaves - 1
+    # Per internal node: the subtree it stands for (an id per distinct structure) and what replaces it
+    node_key = [0] * n_internal
+    replacement = list(range(n_internal))
+    children = {}
+
+    def resolve(child):
+        if child < 0:
+            return child, keys.setdefault(('leaf', leaf_bytes[~child].tobytes()), len(keys))
+        return replacement[child], node_key[child]
+
+    # Children are always numbered after their parent, so a reverse sweep sees them first
+    for node in range(n_internal - 1, -1, -1):
+        left, left_key = resolve(tree['left_child'][node])
+        right, right_key = resolve(tree['right_child'][node])
+        if left_key == right_key:
+            replacement[node], node_key[node] = left, left_key
+            continue
+        node_key[node] = keys.setdefault(
+            (tree['split_feature'][node], float(thresholds[node]), bool(nan_left[node]), left_key, right_key), len(keys)
+        )
+        children[node] = (left, right)
+    root = replacement[0]
+    if len(children) == n_internal:
+        return tree, weights
+    if root < 0:
+        return {'num_leaves': 1, 'leaf_value': tree['leaf_value'][[~root]]}, weights[[~root]]
+
+    # Renumber the kept nodes depth-first, parents before children
+    order, stack = [], [root]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(child for child in reversed(children[node]) if child >= 0)
+    index = {node: i for i, node in enumerate(order)}
+    leaves, links = [], []
+    for node in order:
+        for child in children[node]:
+            if child >= 0:
+                links.append(index[child])
+            else:
+                links.append(~len(leaves))
+                leaves.append(~child)
+    order = np.array(order)
+    links = np.array(links, dtype=np.int64).reshape(-1, 2)
+    pruned = {
+        'num_leaves': len(leaves), 'leaf_value': tree['leaf_value'][leaves],
+        'split_feature': tree['split_feature'][order], 'threshold': tree['threshold'][order],
+        'decision_type': tree['decision_type'][order], 'left_child': links[:, 0], 'right_child': links[:, 1],
+    }
+    return pruned, weights[leaves]
+
+
+def _tree_attributes(tree_id, tree, leaf_weights, target_ids):
+    """
+    TreeEnsembleRegressor attribute arrays for one tree.
+
+    Internal node k keeps id k (the root is 0); leaf j gets id
+    n_internal + j. `leaf_weights` is (n_leaves x len(target_ids)): every
+    leaf contributes one weight to each of the tree's targets, so several
+    outputs can share the splits. Targets the tree doesn't list get nothing.
+    """
+    n_leaves = tree['num_leaves']
+    n_internal = n_leaves - 1
+    n_nodes = n_internal + n_leaves
+    leaf_ids = np.arange(n_internal, n_nodes)
+
+    features = np.zeros(n_nodes, dtype=np.int64)
+    values = np.zeros(n_nodes, dtype=np.float32)
+    true_ids = np.zeros(n_nodes, dtype=np.int64)
+    false_ids = np.zeros(n_nodes, dtype=np.int64)
+    missing_true = np.zeros(n_nodes, dtype=np.int64)
+    modes = ['BRANCH_LEQ'] * n_internal + ['LEAF'] * n_leaves
+    if n_internal:
+        if np.any(tree['decision_type'] & _CATEGORICAL_MASK):
+            raise NotImplementedError("Unsupported categorical split (categorical splits are not exported).")
+        features[:n_internal] = tree['split_feature']
+        values[:n_internal] = _float32_thresholds(tree['threshold'])
+        true_ids[:n_internal] = np.where(tree['left_child'] >= 0, tree['left_child'], n_internal + ~tree['left_child'])
+        false_ids[:n_internal] = np.where(tree['right_child'] >= 0, tree['right_child'], n_internal + ~tree['right_child'])
+        missing_true[:n_internal] = _nan_goes_left(tree['decision_type'], tree['threshold'])
+
+    n_targets = len(target_ids)
+    return {
+        'nodes_treeids': np.full(n_nodes, tree_id, dtype=np.int64),
+        'nodes_nodeids': np.arange(n_nodes, dtype=np.int64),
+        'nodes_featureids': features,
+        'nodes_modes': modes,
+        'nodes_values': values,
+        'nodes_truenodeids': true_ids,
+        'nodes_falsenodeids': false_ids,
+        'nodes_missing_value_tracks_true': missing_true,
+        'nodes_hitrates': np.ones(n_nodes, dtype=np.float32),
+        'target_treeids': np.full(n_leaves * n_targets, tree_id, dtype=np.int64),
+        'target_nodeids': np.repeat(leaf_ids, n_targets),
+        'target_ids': np.tile(target_ids, n_leaves),
+        'target_weights': np.asarray(leaf_weights, dtype=np.float64).reshape(-1),
+    }
+
+
+def _array_attribute(name, values):
+    """INTS/FLOATS/STRINGS attribute from an array or list (helper.make_attribute checks every element)."""
+    attribute = AttributeProto(name=name)
+    if isinstance(values, list):
+        attribute.type = AttributeProto.STRINGS
+        attribute.strings.extend(value.encode() for value in values)
+    elif np.issubdtype(values.dtype, np.integer):
+        attribute.type = AttributeProto.INTS
+        attribute.ints.extend(values.tolist())
+    else:
+        attribute.type = AttributeProto.FLOATS
+        attribute.floats.extend(values.tolist())
+    return attribute
+
+
+def _compact_ensemble_node(trees, leaf_weights, tree_targets, n_targets, input_name, output, name):
+    """
+    The ensemble as one ai.onnx.ml 5 TreeEnsemble node.
+
+    Only internal nodes are listed (each branch points at a node or a leaf,
+    flagged by nodes_trueleafs/nodes_falseleafs); thresholds, modes and leaf
+    weights are packed tensors. Every leaf adds to a single target, so each
+    tree must contribute to exactly one output.
+    """
+    arrays = {key: [] for key in ('nodes_featureids', 'nodes_splits', 'nodes_truenodeids', 'nodes_trueleafs',
+                                  'nodes_falsenodeids', 'nodes_falseleafs', 'nodes_missing_value_tracks_true',
+                                  'tree_roots', 'leaf_targetids', 'leaf_weights')}
+    n_nodes = n_leaf_values = 0
+    for tree, weights, targets in zip(trees, leaf_weights, tree_targets):
+        if len(targets) != 1:
+            raise ValueError("TreeEnsemble leaves hold one target; export multi-target trees as TreeEnsembleRegressor.")
+        n_leaves = tree['num_leaves']
+        arrays['tree_roots'].append([n_nodes])
+        arrays['leaf_targetids'].append(np.full(n_leaves, targets[0], dtype=np.int64))
+        arrays['leaf_weights'].append(np.asarray(weights, dtype=np.float32).reshape(-1))
+        if n_leaves == 1:
+            # A constant tree still needs a root split: both branches lead to its leaf
+            left = right = np.array([-1])
+            features, splits, missing = np.zeros(1, np.int64), np.zeros(1, np.float32), np.zeros(1, bool)
+        else:
+            if np.any(tree['decision_type'] & _CATEGORICAL_MASK):
+                raise NotImplementedError("Unsupported categorical split (categorical splits are not exported).")
+            left, right = tree['left_child'], tree['right_child']
+            features = tree['split_feature']
+            splits = _float32_thresholds(tree['threshold'])
+            missing = _nan_goes_left(tree['decision_type'], tree['threshold'])
+        for side, children in (('true', left), ('false', right)):
+            arrays[f'nodes_{side}nodeids'].append(np.where(children >= 0, children + n_nodes, ~children + n_leaf_values))
+            arrays[f'nodes_{side}leafs'].append((children < 0).astype(np.int64))
+        arrays['nodes_featureids'].append(features)
+        arrays['nodes_splits'].append(splits)
+        arrays['nodes_missing_value_tracks_true'].append(missing.astype(np.int64))
+        n_nodes += len(features)
+        n_leaf_values += n_leaves
+
+    ensemble = helper.make_node('TreeEnsemble', [input_name], [output], name=f'{name}TreeEnsemble', domain='ai.onnx.ml',
+                                n_targets=n_targets, aggregate_function=1, post_transform=0)
+    for key, values in arrays.items():
+        values = np.concatenate(values)
+        if key in ('nodes_splits', 'leaf_weights'):
+            ensemble.attribute.append(helper.make_attribute(key, numpy_helper.from_array(values, key)))
+        else:
+            ensemble.attribute.append(_array_attribute(key, values.astype(np.int64)))
+    modes = numpy_helper.from_array(np.zeros(n_nodes, dtype=np.uint8), 'nodes_modes')  # 0: BRANCH_LEQ
+    ensemble.attribute.append(helper.make_attribute('nodes_modes', modes))
+    return ensemble
+
+
+def tree_ensemble_nodes(trees, leaf_weights, base_values, output_names, input_name='float_input', name='',
+                        tree_targets=None, operator='TreeEnsembleRegressor'):
+    """
+    ONNX nodes for a tree ensemble whose leaves carry one weight per output.
+
+    Args:
+        trees: Tree arrays from booster_trees().
+        leaf_weights: One (n_leaves x n_outputs) array per tree, or
+            (n_leaves x len(tree_targets[i])) when tree_targets is given.
+        base_values: Per-output constant added to the tree sum.
+        output_names: One (N x 1) float output per column, in order.
+        name: Prefix for node and intermediate tensor names, so several
+            ensembles can share one graph.
+        tree_targets: Optional output indices each tree contributes to
+            (default: every output), for ensembles packed side by side.
+        operator: One of TREE_OPERATORS; 'TreeEnsemble' needs every tree
+            to contribute to a single output and COMPACT_OPSETS.
+    Returns:
+        The tree operator (n_targets outputs; TreeEnsemble has no base
+        values, so non-zero ones follow as an Add), then a Split into the
+        named outputs when there is more than one.
+    """
+    if operator not in TREE_OPERATORS:
+        raise ValueError(f"Unknown tree operator '{operator}'. Choose from: {', '.join(TREE_OPERATORS)}")
+    n_targets = len(output_names)
+    if tree_targets is None:
+        tree_targets = [np.arange(n_targets, dtype=np.int64)] * len(trees)
+    ensemble_output = output_names[0] if n_targets == 1 else f'{name}ensemble_output'
+    nodes = []
+    if operator == 'TreeEnsemble':
+        has_base = any(float(v) != 0.0 for v in base_values)
+        tree_output = f'{name}tree_sum' if has_base else ensemble_output
+        nodes.append(_compact_ensemble_node(trees, leaf_weights, tree_targets, n_targets, input_name, tree_output, name))
+        if has_base:
+            base = numpy_helper.from_array(np.asarray(base_values, dtype=np.float32), f'{name}base_values')
+            nodes.append(helper.make_node('Constant', [], [f'{name}base_values'], name=f'{name}BaseValues', value=base))
+            nodes.append(helper.make_node('Add', [tree_output, f'{name}base_values'], [ensemble_output],
+                                          name=f'{name}AddBaseValues'))
+    else:
+        per_tree = [
+            _tree_attributes(tree_id, tree, np.asarray(weights).reshape(-1, len(targets)), targets)
+            for tree_id, (tree, weights, targets) in enumerate(zip(trees, leaf_weights, tree_targets))
+        ]
+        ensemble = helper.make_node(
+            'TreeEnsembleRegressor', [input_name], [ensemble_output], name=f'{name}TreeEnsembleRegressor',
+            domain='ai.onnx.ml', n_targets=n_targets, base_values=[float(v) for v in base_values],
+            aggregate_function='SUM', post_transform='NONE'
+        )
+        for key in per_tree[0]:
+            if key == 'nodes_modes':
+                values = [mode for tree in per_tree for mode in tree[key]]
+            else:
+                values = np.concatenate([tree[key] for tree in per_tree])
+            ensemble.attribute.append(_array_attribute(key, values))
+        nodes.append(ensemble)
+    if n_targets > 1:
+        nodes.append(helper.make_node(
+            'Split', [ensemble_output], list(output_names), name=f'{name}Split', axis=1, split=[1] * n_targets
+        ))
+    return nodes
+
+
+def prune_ensemble(trees, leaf_weights):
+    """prune_tree over every tree: (trees, leaf_weights) with duplicate subtrees collapsed."""
+    pruned = [prune_tree(tree, weights) for tree, weights in zip(trees, leaf_weights)]
+    return [tree for tree, _ in pruned], [weights for _, weights in pruned]
+
+
+def booster_ensemble(booster):
+    """(trees, leaf_weights, base_values) of a single-output LightGBM booster: leaf values as the only target."""
+    trees = booster_trees(booster)
+    return trees, [tree['leaf_value'] for tree in trees], [0.0]
+
+
+def booster_nodes(booster, output_name, input_name='float_input', name='', operator='TreeEnsembleRegressor'):
+    """tree_ensemble_nodes for a single-output LightGBM booster."""
+    return tree_ensemble_nodes(*booster_ensemble(booster), [output_name], input_name, name, operator=operator)
+
+
+def fused_ensemble_nodes(ensembles, output_names, input_name='float_input', name='', operator='TreeEnsembleRegressor'):
+    """
+    Several ensembles packed into one TreeEnsembleRegressor.
+
+    `ensembles` are (trees, leaf_weights, base_values) triples with one or
+    more outputs each; `output_names` lists their outputs in the same order.
+    Every tree keeps its own leaves and only adds to its ensemble's targets,
+    so each output equals its ensemble evaluated alone, while the runtime
+    reads the input and walks all the trees in a single operator call.
+    """
+    trees, leaf_weights, base_values, tree_targets = [], [], [], []
+    for ensemble_trees, ensemble_weights, ensemble_base in ensembles:
+        targets = np.arange(len(base_values), len(base_values) + len(ensemble_base), dtype=np.int64)
+        trees.extend(ensemble_trees)
+        leaf_weights.extend(ensemble_weights)
+        tree_targets.extend([targets] * len(ensemble_trees))
+        base_values.extend(ensemble_base)
+    if len(base_values) != len(output_names):
+        raise ValueError(f"{len(output_names)} output names for {len(base_values)} ensemble outputs.")
+    return tree_ensemble_nodes(trees, leaf_weights, base_values, output_names, input_name, name, tree_targets, operator)
+
+
+def graph_model(nodes, n_features, output_names, input_name='float_input', opsets=ONNX_OPSETS):
+    """A ModelProto over `nodes` with one float input and one (N x 1) float output per name."""
+    graph = helper.make_graph(
+        nodes, 'tree_ensemble',
+        [helper.make_tensor_value_info(input_name, TensorProto.FLOAT, [None, n_features])],
+        [helper.make_tensor_value_info(name, TensorProto.FLOAT, [None, 1]) for name in output_names]
+    )
+    return helper.make_model(graph, opset_imports=opsets, producer_name='ml-vancouver-airbnb')
+
+
+def tree_ensemble_model(trees, leaf_weights, base_values, n_features, output_names, input_name='float_input'):
+    """Single-ensemble graph: tree_ensemble_nodes wrapped in a ModelProto."""
+    nodes = tree_ensemble_nodes(trees, leaf_weights, base_values, output_names, input_name)
+    return graph_model(nodes, n_features, output_names, input_name)
@@ -1,26 +1,31 @@
 import numpy as np
 
-from analysis.models import ModelTrainer
+from analysis.models import ModelTrainer, interval_coverage, point_task, quantile_tasks
+
+
+def price_training_plan(quantile_mode='independent'):
+    """Models behind the price analysis, for ModelTrainer.fit_plan (labels under the 'price' target)."""
+    return (
+        [point_task('price', "Price_Point", log_transform=True)]
+        # Naming convention: Price_Lower_q5 ... (same fits as Price_q5 ..., deduplicated by the trainer)
+        + quantile_tasks('price', "Price_Lower", mode=quantile_mode, point_name="Price_Point")
+        + quantile_tasks('price', "Price", mode=quantile_mode, point_name="Price_Point")
+    )
 
 
 def run_price_analysis(trainer, X_train, y_train_price, X_test, y_test_price, test_df):
     print("\n[Price Analysis] Modeling & Optimization")
     
-    # Point Estimate
-    price_model = trainer.train_point_estimator(X_train, y_train_price, "Price_Point", log_transform=True)
+    # Point Estimate + Interval Estimate (all quantiles for detailed distribution); already fitted models are reused
+    trainer.fit_plan(price_training_plan(trainer.quantile_mode), X_train, {'price': y_train_price})
+    trainer.print_feature_importances("Price_Point", X_train)
+    price_model = trainer.models["Price_Point"]
     price_preds, _, _ = trainer.evaluate(price_model, X_test, y_test_price, "Price Model")
     
-    # Interval Estimate (Train all quantiles for detailed distribution)
-    trainer.train_quantiles_range(X_train, y_train_price, "Price_Lower") # Naming convention: Price_Lower_q5 ...
-    # Actually, let's use a cleaner prefix since it's the whole distribution
-    trainer.train_quantiles_range(X_train, y_train_price, "Price")
-    
-    # Retrieve 5th and 95th for legacy support and coverage calc
-    price_low_model = trainer.models["Price_q5"]['model']
-    price_high_model = trainer.models["Price_q95"]['model']
-    
-    p_low_preds = price_low_model.predict(X_test)
-    p_high_preds = price_high_model.predict(X_test)
+    # Full distribution (q5 ... q95) in one batch, rearranged so no two quantiles cross
+    distribution = trainer.predict_distribution(X_test, "Price")
+    p_low_preds = distribution[:, 0]
+    p_high_preds = distribution[:, -1]
     
     # Ensure logical ordering (Low <= Pred <= High)
     stacked_preds = np.vstack((p_low_preds, price_preds, p_high_preds)).T
@@ -33,6 +38,9 @@ def run_price_analysis(trainer, X_train, y_train_price, X_test, y_test_price, te
     # Coverage Calculation
     price_cov = np.mean((y_test_price >= p_low_preds) & (y_test_price <= p_high_preds)) * 100
     print(f"Price Range Coverage: {price_cov:.2f}%")
+    bands = interval_coverage(y_test_price, distribution)
+    print(f"Price Band Coverage ({trainer.quantile_mode} quantiles): "
+          + ", ".join(f"{width:.0%} band {coverage:.2f}%" for width, coverage in bands.items()))
     
     return price_preds, p_low_preds, p_high_preds
 
@@ -0,0 +1,134 @@
+import json
+import os
+import platform
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+
+def _proc_status_mb(field):
+    """A memory field of /proc/self/status (VmRSS, VmHWM) in MB, or None off Linux."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss_mb():
+    """Current resident set size of this process in MB (None where /proc is unavailable)."""
+    return _proc_status_mb('VmRSS')
+
+
+def _reset_peak_rss():
+    """Resets the process' RSS high-water mark (VmHWM); False where the kernel doesn't allow it."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def environment():
+    """Machine and library versions a measurement was taken with."""
+    import lightgbm
+    import numpy
+    import pandas
+    return {
+        'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+        'numpy': numpy.__version__, 'pandas': pandas.__version__, 'lightgbm': lightgbm.__version__,
+    }
+
+
+class StageProfiler:
+    """
+    Wall time, CPU time and memory of named pipeline stages.
+
+    Each `with profiler.stage(name) as record:` block appends one record:
+    wall_s, cpu_s (this process plus reaped child processes, e.g. a
+    finished process pool), rss_mb after the stage, rss_delta_mb and
+    peak_rss_mb (the process' RSS high-water mark during the stage,
+    native allocations included). With trace_memory, traced_peak_mb is the
+    tracemalloc peak of Python/NumPy allocations above the stage's start;
+    tracing slows allocation-heavy code, so it is off by default. Callers
+    may add fields (rows, cols, ...) to the yielded record. Stages are not
+    meant to nest: each one resets the peaks.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, **info):
+        record = {'stage': name, **info}
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            traced_start = tracemalloc.get_traced_memory()[0]
+        peak_reset = _reset_peak_rss()
+        rss_before = rss_mb()
+        cpu_start = time.process_time() + _children_cpu()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = round(time.perf_counter() - start, 4)
+            record['cpu_s'] = round(time.process_time() + _children_cpu() - cpu_start, 4)
+            rss_after = rss_mb()
+            if rss_after is not None:
+                record['rss_mb'] = round(rss_after, 1)
+                record['rss_delta_mb'] = round(rss_after - rss_before, 1)
+            if peak_reset:
+                record['peak_rss_mb'] = round(_proc_status_mb('VmHWM'), 1)
+            if self.trace_memory:
+                record['traced_peak_mb'] = round((tracemalloc.get_traced_memory()[1] - traced_start) / 2**20, 1)
+            self.stages.append(record)
+
+    def record(self, name, **fields):
+        """Adds a stage measured elsewhere (e.g. a fit in a worker process: wall_s, cpu_s, ...)."""
+        self.stages.append({'stage': name, **fields})
+
+    def report(self, **info):
+        """JSON-serialisable report: environment, caller-supplied info and the stage records in order."""
+        return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'environment': environment(), **info,
+                'stages': self.stages}
+
+    def save(self, path, **info):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.report(**info), f, indent=2)
+
+    def summary(self):
+        """One line per stage."""
+        lines = []
+        for r in self.stages:
+            extra = ''
+            if 'peak_rss_mb' in r:
+                extra += f"  peak {r['peak_rss_mb']:,.0f}MB"
+            if 'rss_delta_mb' in r:
+                extra += f"  rss {r['rss_delta_mb']:+,.0f}MB"
+            if 'traced_peak_mb' in r:
+                extra += f"  traced {r['traced_peak_mb']:,.1f}MB"
+            if 'rows' in r and 'cols' in r:
+                extra += f"  {r['rows']:,} x {r['cols']:,}"
+            lines.append(f"  {r['stage']:<48} wall {r['wall_s']:8.2f}s  cpu {r['cpu_s']:8.2f}s{extra}")
+        return '\n'.join(lines)
+
+
+def profile_stage(profiler, name, **info):
+    """profiler.stage(name), or a no-op yielding a throwaway record when profiler is None."""
+    if profiler is None:
+        return nullcontext({})
+    return profiler.stage(name, **info)
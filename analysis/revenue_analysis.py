@@ -1,24 +1,29 @@
 import numpy as np
-from analysis.models import ModelTrainer
+from analysis.models import ModelTrainer, interval_coverage, point_task, quantile_tasks
+
+
+def revenue_training_plan(quantile_mode='independent'):
+    """Models behind the revenue analysis, for ModelTrainer.fit_plan (labels under the 'revenue' target)."""
+    # Reverting log_transform to False as it degraded performance significantly (R2 ~0.14)
+    return (
+        [point_task('revenue', "Revenue_Point", log_transform=False)]
+        + quantile_tasks('revenue', "Revenue", mode=quantile_mode, point_name="Revenue_Point")
+    )
 
 
 def run_revenue_analysis(trainer, X_train, y_train_rev, X_test, y_test_rev, test_df=None):
     print("\n[Revenue Analysis] Modeling & Drivers")
     
-    # Point Estimate
-    # Reverting log_transform to False as it degraded performance significantly (R2 ~0.14)
-    rev_model = trainer.train_point_estimator(X_train, y_train_rev, "Revenue_Point", log_transform=False)
+    # Point Estimate + Interval Estimate (all quantiles); already fitted models are reused
+    trainer.fit_plan(revenue_training_plan(trainer.quantile_mode), X_train, {'revenue': y_train_rev})
+    trainer.print_feature_importances("Revenue_Point", X_train)
+    rev_model = trainer.models["Revenue_Point"]
     rev_preds, _, _ = trainer.evaluate(rev_model, X_test, y_test_rev, "Revenue Model")
     
-    # Interval Estimate (Train all quantiles)
-    trainer.train_quantiles_range(X_train, y_train_rev, "Revenue")
-    
-    # Retrieve 5th and 95th for legacy support
-    rev_low_model = trainer.models["Revenue_q5"]['model']
-    rev_high_model = trainer.models["Revenue_q95"]['model']
-    
-    r_low_preds = rev_low_model.predict(X_test)
-    r_high_preds = rev_high_model.predict(X_test)
+    # Full distribution (q5 ... q95) in one batch, rearranged so no two quantiles cross
+    distribution = trainer.predict_distribution(X_test, "Revenue")
+    r_low_preds = distribution[:, 0]
+    r_high_preds = distribution[:, -1]
     
     # Ensure logical ordering
     stacked_preds = np.vstack((r_low_preds, rev_preds, r_high_preds)).T
@@ -31,6 +36,9 @@ def run_revenue_analysis(trainer, X_train, y_train_rev, X_test, y_test_rev, test
     # Coverage Calculation
     rev_cov = np.mean((y_test_rev >= r_low_preds) & (y_test_rev <= r_high_preds)) * 100
     print(f"Revenue Range Coverage: {rev_cov:.2f}%")
+    bands = interval_coverage(y_test_rev, distribution)
+    print(f"Revenue Band Coverage ({trainer.quantile_mode} quantiles): "
+          + ", ".join(f"{width:.0%} band {coverage:.2f}%" for width, coverage in bands.items()))
     
     return rev_preds, r_low_preds, r_high_preds, rev_model
 
@@ -0,0 +1,142 @@
+import json
+import os
+import re
+import time
+
+import numpy as np
+import onnxruntime as ort
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from analysis.data import INGEST_SCHEMA, FeaturePipeline, clean_listings, read_listings_csv
+
+# Scoring reads the ingest columns minus the targets, which new listings don't have
+SCORING_SCHEMA = {
+    col: dtype for col, dtype in INGEST_SCHEMA.items()
+    if col not in ('price', 'estimated_revenue_l365d', 'estimated_occupancy_l365d')
+}
+
+# Price_Point, Price_q5, Price_q5_Price_q5 (merged-graph naming), Price_Lower_q5 ...
+_OUTPUT_NAME = re.compile(r'^(?P<group>[A-Za-z]+?)_(?:(?P<point>Point)|(?P<lower>Lower_)?q(?P<q>\d+))')
+
+# Point models trained on log1p(target) unless models_metadata.json says otherwise
+DEFAULT_LOG_TRANSFORM = {'Price_Point': True}
+
+
+class OnnxScorer:
+    """
+    Runs the exported <Group>_Model.onnx graphs on a feature matrix.
+
+    Each graph is mapped to clean output columns: <Group>_Point (inverse
+    log-transformed where the point model was trained on log1p) and
+    <Group>_qNN, with quantiles sorted per row so they never cross. Groups
+    trained in conformal quantile mode have no quantile outputs; their
+    <Group>_qNN come from the point output plus the `conformal` lookup
+    (models_metadata.json's conformal_quantiles).
+    """
+
+    def __init__(self, model_dir='outputs', groups=('Price', 'Revenue'), log_transform=None, threads=None,
+                 conformal=None):
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.log_transform = dict(DEFAULT_LOG_TRANSFORM if log_transform is None else log_transform)
+        self.conformal = dict(conformal or {})
+        self.sessions = {}
+        self.outputs = {}
+        for group in groups:
+            path = os.path.join(model_dir, f"{group}_Model.onnx")
+            if not os.path.exists(path):
+                continue
+            session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+            self.sessions[group] = session
+            self.outputs[group] = self._map_outputs(group, [o.name for o in session.get_outputs()])
+        if not self.sessions:
+            raise FileNotFoundError(f"No *_Model.onnx graphs found in '{model_dir}'.")
+
+    @staticmethod
+    def _map_outputs(group, names):
+        """(point output name or None, [(q, output name), ...] sorted by q); Price_Lower_* duplicates are dropped."""
+        point, quantiles = None, {}
+        for name in names:
+            match = _OUTPUT_NAME.match(name)
+            if match is None or match.group('group') != group:
+                continue
+            if match.group('point'):
+                point = name
+            elif not match.group('lower') or int(match.group('q')) not in quantiles:
+                quantiles[int(match.group('q'))] = name
+        return point, sorted(quantiles.items())
+
+    @property
+    def columns(self):
+        columns = []
+        for group, (point, quantiles) in self.outputs.items():
+            if point is not None:
+                columns.append(f'{group}_Point')
+            columns.extend(f'{group}_q{q}' for q, _ in quantiles)
+            if not quantiles and point is not None and group in self.conformal:
+                columns.extend(f'{group}_q{int(alpha * 100)}' for alpha in self.conformal[group]['alphas'])
+        return columns
+
+    def predict(self, X):
+        """Dict of output column -> float32 array for a float32 feature matrix."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        result = {}
+        for group, session in self.sessions.items():
+            point, quantiles = self.outputs[group]
+            names = ([point] if point is not None else []) + [name for _, name in quantiles]
+            values = dict(zip(names, session.run(names, {'float_input': X})))
+            if point is not None:
+                raw = values[point].reshape(-1)
+                pred = np.expm1(raw) if self.log_transform.get(f'{group}_Point', False) else raw
+                result[f'{group}_Point'] = pred.astype(np.float32)
+                if not quantiles and group in self.conformal:
+                    # Conformal levels: the point prediction (in its label space) plus each level's offset
+                    lookup = self.conformal[group]
+                    levels = raw.astype(np.float64)[:, None] + np.asarray(lookup['offsets'])
+                    if lookup['log_transform']:
+                        levels = np.expm1(levels)
+                    for alpha, column in zip(lookup['alphas'], levels.T):
+                        result[f'{group}_q{int(alpha * 100)}'] = column.astype(np.float32)
+            if quantiles:
+                # Rearrangement: sorting each row keeps q5 <= q10 <= ... <= q95
+                stacked = np.sort(np.column_stack([values[name].reshape(-1) for _, name in quantiles]), axis=1)
+                for j, (q, _) in enumerate(quantiles):
+                    result[f'{group}_q{q}'] = stacked[:, j].astype(np.float32)
+        return result
+
+
+def score_listings(input_path, output_path, model_dir='outputs', chunksize=50_000, threads=None):
+    """
+    Scores a listings CSV in chunks and streams predictions to Parquet.
+
+    Each chunk is cleaned, featurized with the fitted FeaturePipeline and run
+    through the exported ONNX graphs, then appended to `output_path` as one
+    row group (id, <Group>_Point, <Group>_q5 ... _q95), so memory stays bounded
+    by the chunk size.
+    """
+    pipeline = FeaturePipeline.load(os.path.join(model_dir, 'feature_pipeline.joblib'))
+    with open(os.path.join(model_dir, 'models_metadata.json')) as f:
+        metadata = json.load(f)
+    scorer = OnnxScorer(model_dir, log_transform=metadata.get('log_transform'), threads=threads,
+                        conformal=metadata.get('conformal_quantiles'))
+
+    schema = pa.schema([('id', pa.int64())] + [(c, pa.float32()) for c in scorer.columns])
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    print(f"Scoring {input_path} -> {output_path} (chunks of {chunksize:,} rows)")
+    start = time.perf_counter()
+    total = 0
+    with pq.ParquetWriter(output_path, schema) as writer:
+        for chunk in read_listings_csv(input_path, SCORING_SCHEMA, chunksize=chunksize):
+            X = pipeline.transform(clean_listings(chunk))
+            predictions = scorer.predict(X.to_numpy(dtype=np.float32))
+            columns = {'id': chunk['id'].to_numpy(dtype=np.int64)}
+            columns.update(predictions)
+            writer.write_table(pa.table(columns, schema=schema))
+            total += len(chunk)
+            print(f"  scored {total:,} rows ({total / (time.perf_counter() - start):,.0f} rows/s)")
+
+    print(f"Scored {total:,} listings in {time.perf_counter() - start:.1f}s.")
+    return total
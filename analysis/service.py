@@ -0,0 +1,352 @@
+"""
+Local prediction service for the exported ONNX models.
+
+Serves the same predictions as the web app (vancouver-airbnb-web/lib/inference.ts)
+from Python: POST /predict takes the PredictionForm JSON and returns
+{price: {point, lower, upper, distribution}, revenue: {...}}. Concurrent
+requests are coalesced into micro-batches, so one ONNX Runtime call serves
+many requests.
+
+    python -m analysis.service --model-dir vancouver-airbnb-web/public/models --port 8000
+"""
+import argparse
+import json
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from analysis.data import FeaturePipeline
+from analysis.scoring import OnnxScorer
+from analysis.text_features import TEXT_KEYWORDS
+
+DEFAULT_MODEL_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'vancouver-airbnb-web', 'public', 'models'
+)
+
+# Property type to room type mapping (inference.ts PROPERTY_TYPE_TO_ROOM_TYPE)
+PROPERTY_TYPE_TO_ROOM_TYPE = {
+    "Camper/RV": "Entire home/apt",
+    "Cave": "Entire home/apt",
+    "Earthen home": "Entire home/apt",
+    "Entire bungalow": "Entire home/apt",
+    "Entire condo": "Entire home/apt",
+    "Entire cottage": "Entire home/apt",
+    "Entire guest suite": "Entire home/apt",
+    "Entire guesthouse": "Entire home/apt",
+    "Entire home": "Entire home/apt",
+    "Entire loft": "Entire home/apt",
+    "Entire place": "Entire home/apt",
+    "Entire rental unit": "Entire home/apt",
+    "Entire serviced apartment": "Entire home/apt",
+    "Entire townhouse": "Entire home/apt",
+    "Entire vacation home": "Entire home/apt",
+    "Entire villa": "Entire home/apt",
+    "Houseboat": "Entire home/apt",
+    "Private room in bed and breakfast": "Private room",
+    "Private room in boat": "Private room",
+    "Private room in bungalow": "Private room",
+    "Private room in camper/rv": "Private room",
+    "Private room in condo": "Private room",
+    "Private room in guest suite": "Private room",
+    "Private room in guesthouse": "Private room",
+    "Private room in home": "Private room",
+    "Private room in hostel": "Private room",
+    "Private room in loft": "Private room",
+    "Private room in rental unit": "Private room",
+    "Private room in resort": "Private room",
+    "Private room in serviced apartment": "Private room",
+    "Private room in tiny home": "Private room",
+    "Private room in tower": "Private room",
+    "Private room in townhouse": "Private room",
+    "Private room in villa": "Private room",
+    "Riad": "Entire home/apt",
+    "Room in aparthotel": "Entire home/apt",
+    "Room in bed and breakfast": "Hotel room",
+    "Room in boutique hotel": "Private room",
+    "Room in hotel": "Private room",
+    "Shared room in barn": "Shared room",
+    "Shared room in condo": "Shared room",
+    "Shared room in home": "Shared room",
+    "Shared room in hostel": "Shared room",
+    "Shared room in hotel": "Shared room",
+    "Shared room in loft": "Shared room",
+    "Shared room in rental unit": "Shared room",
+    "Shared room in tiny home": "Shared room",
+    "Tiny home": "Entire home/apt",
+    "Tower": "Entire home/apt",
+}
+
+# Form amenity -> has_* feature keywords, as matched by the web form
+FORM_AMENITY_MAPPING = {
+    'has_wifi': ['wifi'],
+    'has_kitchen': ['kitchen'],
+    'has_heating': ['heating'],
+    'has_washer': ['washer'],
+    'has_dryer': ['dryer'],
+    'has_air_conditioning': ['air conditioning'],
+    'has_free_parking': ['free parking'],
+    'has_hot_tub': ['hot tub'],
+    'has_pool': ['pool'],
+    'has_gym': ['gym'],
+    'has_pet_friendly': ['pet'],
+    'has_self_check_in': ['self check-in'],
+    'has_lockbox': ['lockbox'],
+    'has_elevator': ['elevator'],
+    'has_balcony': ['balcony'],
+    'has_garden': ['garden'],
+    'has_bbq_grill': ['bbq'],
+    'has_workspace': ['workspace'],
+}
+
+
+def form_to_features(form, metadata):
+    """
+    Feature vector for one PredictionForm payload (port of InferenceEngine.prepareFeatures).
+
+    Fields the form doesn't collect are filled the same way the web app does:
+    training medians for other review scores and host rates, 0 for txt_*
+    keyword flags, and 0 for any feature not set explicitly.
+    """
+    feature_names = metadata['feature_names']
+    medians = metadata.get('medians') or {}
+    features = {}
+
+    room_type = form.get('room_type') or PROPERTY_TYPE_TO_ROOM_TYPE.get(form['property_type'], 'Entire home/apt')
+
+    # 1. Basic numeric inputs
+    for key in ['accommodates', 'bedrooms', 'bathrooms', 'beds', 'host_experience_years',
+                'latitude', 'longitude', 'reviews_per_month', 'review_scores_rating', 'availability_365']:
+        features[key] = form[key]
+    features['total_beds'] = form['beds']
+
+    # Booleans -> 0/1
+    features['instant_bookable'] = 1 if form.get('instant_bookable') else 0
+    features['is_superhost'] = 1 if form.get('host_is_superhost') else 0
+    features['identity_verified'] = 1 if form.get('host_identity_verified') else 0
+
+    # Review scores and host metrics not in the form -> median, flagged as imputed
+    for col in ['review_scores_location', 'review_scores_cleanliness', 'review_scores_value']:
+        features[col] = medians.get(col) or 0
+        features[f'{col}_missing'] = 1
+    for col in ['host_response_rate_clean', 'host_acceptance_rate_clean', 'calculated_host_listings_count']:
+        features[col] = medians.get(col) or 0
+    features['reviews_per_month_missing'] = 0
+    features['review_scores_rating_missing'] = 0
+
+    # 2. Neighborhood Stats
+    stats = metadata['neighborhood_stats'].get(form['neighbourhood_cleansed'], {})
+    for key in ['neighborhood_price_mean', 'neighborhood_price_median', 'neighborhood_price_std',
+                'neighborhood_estimated_occupancy_l365d_mean']:
+        features[key] = stats.get(key) or 0
+
+    # 3. Amenities
+    user_amenities = [a.lower() for a in form.get('amenities', [])]
+    for feature, keywords in FORM_AMENITY_MAPPING.items():
+        features[feature] = 1 if any(k in a for k in keywords for a in user_amenities) else 0
+    features['has_availability'] = 1
+
+    # 4. Categoricals: One-Hot
+    features[f"nbhd_{form['neighbourhood_cleansed']}"] = 1
+    features[f'rt_{room_type}'] = 1
+
+    # 5. Categoricals: Label Encoding (unknown property types fall back to 0)
+    features['property_type'] = metadata['label_encoding'].get('property_type', {}).get(form['property_type'], 0)
+
+    # 6. Target Encoding
+    for col, per_target in (metadata.get('target_encoding') or {}).items():
+        for target_name, te in per_target.items():
+            value = te['map'].get(form.get(col))
+            features[f'TE_{target_name}_{col}'] = te['global_mean'] if value is None else value
+
+    # 7. Text Features (character counts; keyword flags are unknown from the form)
+    features['name_len'] = form['name'] if form.get('name') is not None else medians.get('name_len', 20)
+    features['desc_len'] = form['description'] if form.get('description') is not None else medians.get('desc_len', 100)
+    for keyword in TEXT_KEYWORDS:
+        features[f'txt_{keyword.lower()}'] = 0
+
+    # 8. Computed Features
+    downtown_lat, downtown_lon = FeaturePipeline.DOWNTOWN
+    features['dist_to_downtown'] = math.sqrt(
+        ((form['latitude'] - downtown_lat) * 111) ** 2 + ((form['longitude'] - downtown_lon) * 78) ** 2
+    )
+    features['quality_popularity'] = form['review_scores_rating'] * form['reviews_per_month']
+    features['people_per_bedroom'] = form['accommodates'] / max(form['bedrooms'], 1)
+    features['people_per_bath'] = form['accommodates'] / max(form['bathrooms'], 1)
+
+    return np.array([features.get(name, 0) for name in feature_names], dtype=np.float32)
+
+
+def _round_half_up(value):
+    """Math.round semantics, so responses match the web app to the dollar."""
+    return int(math.floor(float(value) + 0.5))
+
+
+def format_prediction(row):
+    """
+    PredictionResult for one row of OnnxScorer output (values rounded like the web app).
+
+    Raises RuntimeError when the row lacks a level the result reports (a
+    group's Point, q5 or q95): the models don't match the service, and a
+    0 would pass for a prediction.
+    """
+    result = {}
+    for group, key in [('Price', 'price'), ('Revenue', 'revenue')]:
+        distribution = {}
+        point = row.get(f'{group}_Point')
+        if point is not None:
+            distribution['Point'] = _round_half_up(point)
+        for name, value in row.items():
+            if name.startswith(f'{group}_q'):
+                distribution[name[len(group) + 1:]] = _round_half_up(value)
+        missing = [f'{group}_{level}' for level in ('Point', 'q5', 'q95') if level not in distribution]
+        if missing:
+            raise RuntimeError(f"The exported models have no {', '.join(missing)} output.")
+        result[key] = {
+            'point': distribution['Point'],
+            'lower': distribution['q5'],
+            'upper': distribution['q95'],
+            'distribution': distribution
+        }
+    return result
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-row requests into batched model calls.
+
+    A worker thread takes the first queued request, keeps collecting until
+    `max_batch_size` rows are waiting or `max_wait_ms` has passed, runs
+    `predict_fn` once on the stacked rows and resolves each request's Future
+    with its own row.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=2.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, features):
+        future = Future()
+        self._queue.put((features, future))
+        return future
+
+    def predict(self, features, timeout=30.0):
+        return self.submit(features).result(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            futures = [future for _, future in batch]
+            try:
+                outputs = self.predict_fn(np.vstack([features for features, _ in batch]))
+                for i, future in enumerate(futures):
+                    future.set_result({name: values[i] for name, values in outputs.items()})
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            self.batches += 1
+            self.rows += len(batch)
+
+
+class PredictionService:
+    """Loads the ONNX graphs and metadata once and answers form predictions through a MicroBatcher."""
+
+    def __init__(self, model_dir=DEFAULT_MODEL_DIR, max_batch_size=64, max_wait_ms=2.0, threads=None):
+        with open(os.path.join(model_dir, 'models_metadata.json')) as f:
+            self.metadata = json.load(f)
+        self.scorer = OnnxScorer(model_dir, log_transform=self.metadata.get('log_transform'), threads=threads,
+                                 conformal=self.metadata.get('conformal_quantiles'))
+        self.batcher = MicroBatcher(self.scorer.predict, max_batch_size, max_wait_ms)
+
+    def predict(self, form):
+        return format_prediction(self.batcher.predict(form_to_features(form, self.metadata)))
+
+
+def make_handler(service):
+    class PredictionHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send_json(200, {
+                    'status': 'ok', 'batches': service.batcher.batches, 'rows': service.batcher.rows
+                })
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._send_json(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                form = json.loads(self.rfile.read(length))
+                self._send_json(200, service.predict(form))
+            except (ValueError, KeyError, TypeError) as e:
+                self._send_json(400, {'error': f'invalid request: {e}'})
+            except Exception as e:
+                self._send_json(500, {'error': str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictionHandler
+
+
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Default backlog of 5 drops connection bursts into 1s SYN retries
+    request_queue_size = 128
+
+
+def serve(model_dir=DEFAULT_MODEL_DIR, host='127.0.0.1', port=8000, max_batch_size=64, max_wait_ms=2.0, threads=None):
+    service = PredictionService(model_dir, max_batch_size, max_wait_ms, threads)
+    server = PredictionServer((host, port), make_handler(service))
+    print(f"Serving predictions on http://{host}:{port}/predict (models: {model_dir})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local prediction service for the exported ONNX models.")
+    parser.add_argument('--model-dir', default=DEFAULT_MODEL_DIR)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--threads', type=int, default=None, help="ONNX Runtime intra-op threads.")
+    args = parser.parse_args()
+    serve(args.model_dir, args.host, args.port, args.max_batch_size, args.max_wait_ms, args.threads)
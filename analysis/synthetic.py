@@ -0,0 +1,149 @@
+"""
+Synthetic listings in the listings-detail.csv format, for scale testing.
+
+Rows are drawn (with replacement) from a real snapshot and then perturbed,
+so the joint distribution, the neighbourhood mix and every column's string
+format carry over: untouched columns are copied byte for byte, prices stay
+"$1,234.00" strings with revenue = price x occupancy, rates stay "95%"
+strings and amenities stay JSON lists. Ids are unique, and coordinates,
+prices, host start dates, review rates, availability and amenity lists are
+jittered so repeated template rows don't produce identical listings.
+
+    python -m analysis.synthetic --scale 10 --output data/synthetic/listings-detail.csv
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from analysis.data import DATA_DIR
+
+# Synthetic ids start here: above every real Airbnb listing id, below the int64 limit
+ID_OFFSET = 9_000_000_000_000_000_000
+
+# Perturbation strengths
+COORDINATE_SD = 0.001     # degrees (~100m)
+PRICE_SIGMA = 0.08        # log-normal price noise
+HOST_SINCE_DAYS = 90      # +/- shift of host_since
+REVIEWS_SIGMA = 0.1       # log-normal reviews_per_month noise
+AVAILABILITY_DAYS = 10    # +/- shift of availability_365
+AMENITY_DROP = 0.3        # chance of removing one amenity
+AMENITY_ADD = 0.3         # chance of adding one (drawn by overall frequency)
+
+
+def load_template(path=None):
+    """The real snapshot as strings, exactly as written (empty string for missing)."""
+    path = path or os.path.join(DATA_DIR, 'listings-detail.csv')
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+
+class ListingsGenerator:
+    """Draws synthetic listings from a template snapshot (see module docstring)."""
+
+    def __init__(self, template, seed=42):
+        self.template = template
+        self.rng = np.random.default_rng(seed)
+        self.amenity_lists = [json.loads(a) if a else [] for a in template['amenities']]
+        counts = pd.Series([a for items in self.amenity_lists for a in items]).value_counts()
+        self.vocabulary = counts.index.to_numpy()
+        self.amenity_weights = (counts / counts.sum()).to_numpy()
+        self.prices = pd.to_numeric(template['price'].str.replace(r'[$,]', '', regex=True), errors='coerce').to_numpy()
+        self.generated = 0
+
+    def _numeric(self, rows, column):
+        return pd.to_numeric(self.template[column].to_numpy()[rows], errors='coerce')
+
+    def _amenities(self, rows):
+        n = len(rows)
+        drop = self.rng.random(n) < AMENITY_DROP
+        add = self.rng.random(n) < AMENITY_ADD
+        drop_at = self.rng.random(n)
+        additions = self.rng.choice(self.vocabulary, size=n, p=self.amenity_weights)
+        out = []
+        for i, row in enumerate(rows):
+            items = self.amenity_lists[row]
+            if drop[i] and items:
+                items = items[:int(drop_at[i] * len(items))] + items[int(drop_at[i] * len(items)) + 1:]
+            if add[i] and additions[i] not in items:
+                items = items + [additions[i]]
+            out.append(json.dumps(items))
+        return out
+
+    def sample(self, n_rows):
+        """The next `n_rows` synthetic listings, as a string DataFrame with the template's columns."""
+        rng = self.rng
+        rows = rng.integers(len(self.template), size=n_rows)
+        df = self.template.iloc[rows].reset_index(drop=True)
+
+        ids = np.arange(self.generated, self.generated + n_rows, dtype=np.int64) + ID_OFFSET
+        self.generated += n_rows
+        df['id'] = ids.astype(str)
+        df['listing_url'] = [f"https://www.airbnb.com/rooms/{i}" for i in ids]
+
+        for column in ('latitude', 'longitude'):
+            values = self._numeric(rows, column) + rng.normal(0, COORDINATE_SD, n_rows)
+            df[column] = pd.Series(np.round(values, 5)).astype(str)
+
+        # Whole-dollar prices, revenue kept consistent with occupancy
+        price = np.round(self.prices[rows] * np.exp(rng.normal(0, PRICE_SIGMA, n_rows)))
+        price = np.maximum(price, 1)
+        has_price = ~np.isnan(price)
+        df['price'] = [f"${p:,.2f}" if ok else '' for p, ok in zip(price, has_price)]
+        revenue = price * self._numeric(rows, 'estimated_occupancy_l365d')
+        df['estimated_revenue_l365d'] = [str(int(r)) if ok else '' for r, ok in zip(revenue, has_price)]
+
+        host_since = pd.to_datetime(df['host_since'], errors='coerce')
+        shift = pd.to_timedelta(rng.integers(-HOST_SINCE_DAYS, HOST_SINCE_DAYS + 1, n_rows), unit='D')
+        df['host_since'] = (host_since + shift).dt.strftime('%Y-%m-%d').fillna('')
+
+        reviews = self._numeric(rows, 'reviews_per_month') * np.exp(rng.normal(0, REVIEWS_SIGMA, n_rows))
+        df['reviews_per_month'] = [f"{r:.2f}" if not np.isnan(r) else '' for r in reviews]
+
+        availability = self._numeric(rows, 'availability_365')
+        availability = np.clip(availability + rng.integers(-AVAILABILITY_DAYS, AVAILABILITY_DAYS + 1, n_rows), 0, 365)
+        df['availability_365'] = [str(int(a)) if not np.isnan(a) else '' for a in availability]
+
+        df['amenities'] = self._amenities(rows)
+        return df
+
+
+def write_synthetic_listings(output_path, n_rows, template_path=None, seed=42, chunksize=100_000):
+    """Streams `n_rows` synthetic listings to a CSV in chunks (memory bounded by the chunk size)."""
+    generator = ListingsGenerator(load_template(template_path), seed)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    start = time.perf_counter()
+    written = 0
+    with open(output_path, 'w', newline='') as f:
+        while written < n_rows:
+            chunk = generator.sample(min(chunksize, n_rows - written))
+            chunk.to_csv(f, index=False, header=written == 0)
+            written += len(chunk)
+            print(f"  wrote {written:,} / {n_rows:,} rows")
+    print(f"Wrote {written:,} synthetic listings to {output_path} in {time.perf_counter() - start:.1f}s.")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic listings-detail.csv data for scale testing.")
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument('--rows', type=int, default=None, help="Number of listings to generate.")
+    size.add_argument('--scale', type=float, default=None, help="Multiple of the template's row count (default 1).")
+    parser.add_argument('--output', default=os.path.join(DATA_DIR, 'synthetic', 'listings-detail.csv'))
+    parser.add_argument('--template', default=None, help="Snapshot to imitate (default data/listings-detail.csv).")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunksize', type=int, default=100_000)
+    args = parser.parse_args()
+
+    n_rows = args.rows
+    if n_rows is None:
+        with open(args.template or os.path.join(DATA_DIR, 'listings-detail.csv')) as f:
+            n_template = len(pd.read_csv(f, usecols=['id']))
+        n_rows = int(round(n_template * (args.scale or 1)))
+    write_synthetic_listings(args.output, n_rows, args.template, args.seed, args.chunksize)
+
+
+if __name__ == "__main__":
+    main()
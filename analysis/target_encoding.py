@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.model_selection import KFold
+
+
+def te_column_name(target_name, col):
+    return f'TE_{target_name}_{col}'
+
+
+def kfold_target_encode(train_df, cols, targets, n_splits=5, random_state=42):
+    """
+    K-Fold target encoding for several columns and targets at once.
+
+    Each training row is encoded with the target mean of its category over the
+    other folds (out-of-fold), falling back to the target's global mean when
+    the category is missing there. Fold ids are assigned once; per-category
+    sums and counts for every (fold, column, category) come from a single
+    sparse aggregation, and each row's out-of-fold mean is the category total
+    minus its own fold's share.
+
+    Args:
+        train_df: Training frame holding `cols`.
+        cols: Categorical columns to encode (missing columns are skipped).
+        targets: Dict of target name -> Series aligned with train_df.
+    Returns:
+        (block, encoding): a float32 DataFrame with one TE_<target>_<col>
+        column per pair, and {col: {target: {'map', 'global_mean'}}} with the
+        full-training-set means used to encode unseen rows.
+    """
+    cols = [c for c in cols if c in train_df.columns]
+    n = len(train_df)
+    target_names = list(targets)
+    values = np.column_stack([np.asarray(targets[t], dtype=np.float64) for t in target_names])
+
+    # Fold ids (same folds as iterating KFold.split over the frame)
+    fold = np.empty(n, dtype=np.int64)
+    kf = KFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    for k, (_, val_ind) in enumerate(kf.split(np.zeros(n))):
+        fold[val_ind] = k
+
+    # One sparse indicator over (column, fold, category) slots, one nonzero per row and column
+    codes, uniques, offsets = [], [], []
+    offset = 0
+    for col in cols:
+        col_codes, col_uniques = pd.factorize(train_df[col], sort=True)
+        codes.append(col_codes)
+        uniques.append(col_uniques)
+        offsets.append(offset)
+        offset += n_splits * len(col_uniques)
+
+    rows, slots = [], []
+    for col_codes, col_offset, col_uniques in zip(codes, offsets, uniques):
+        valid = col_codes >= 0
+        rows.append(np.flatnonzero(valid))
+        slots.append(col_offset + fold[valid] * len(col_uniques) + col_codes[valid])
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+    slots = np.concatenate(slots) if slots else np.empty(0, dtype=np.int64)
+    indicator = sparse.csr_matrix((np.ones(len(rows)), (rows, slots)), shape=(n, offset))
+
+    # Counts and per-target sums for every slot in one product
+    totals = np.asarray(indicator.T @ np.column_stack([np.ones(n), values]))
+    global_means = values.mean(axis=0)
+
+    block = {}
+    encoding = {}
+    for col, col_codes, col_uniques, col_offset in zip(cols, codes, uniques, offsets):
+        n_cat = len(col_uniques)
+        per_fold = totals[col_offset:col_offset + n_splits * n_cat].reshape(n_splits, n_cat, -1)
+        full = per_fold.sum(axis=0)
+
+        valid = col_codes >= 0
+        safe_codes = np.where(valid, col_codes, 0)
+        oof = full[safe_codes] - per_fold[fold, safe_codes]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            oof_means = oof[:, 1:] / oof[:, :1]
+            full_means = full[:, 1:] / full[:, :1]
+        oof_means[~valid] = np.nan
+
+        encoding[col] = {}
+        for t, target_name in enumerate(target_names):
+            encoded = np.where(np.isnan(oof_means[:, t]), global_means[t], oof_means[:, t])
+            block[te_column_name(target_name, col)] = encoded.astype(np.float32)
+            encoding[col][target_name] = {
+                'map': pd.Series(full_means[:, t], index=np.asarray(col_uniques, dtype=object)).to_dict(),
+                'global_mean': float(global_means[t])
+            }
+
+    return pd.DataFrame(block, index=train_df.index), encoding
+
+
+def apply_target_encoding(df, encoding):
+    """Encodes rows with the full-training-set means from kfold_target_encode; unseen categories get the global mean."""
+    block = {}
+    for col, per_target in encoding.items():
+        for target_name, te in per_target.items():
+            keys = pd.Index(list(te['map'].keys()), dtype=object)
+            # Trailing global mean: unseen categories (position -1) land on it
+            means = np.append(np.fromiter(te['map'].values(), dtype=np.float64, count=len(keys)), te['global_mean'])
+            positions = keys.get_indexer(df[col].astype(object)) if col in df.columns else np.full(len(df), -1)
+            block[te_column_name(target_name, col)] = means[positions].astype(np.float32)
+    return pd.DataFrame(block, index=df.index)
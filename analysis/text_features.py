@@ -0,0 +1,87 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Keywords (Binary Features): txt_<keyword> is set when the keyword occurs in the name or description
+TEXT_KEYWORDS = ['view', 'luxury', 'ocean', 'downtown', 'renovated', 'private', 'quiet', 'garden', 'spacious']
+
+# Joins name and description for the single scan; no keyword can match across it
+_FIELD_SEPARATOR = '\n'
+
+
+def _trie_regex(node):
+    """Regex for a character trie; alternatives are factored on shared prefixes."""
+    branches = [re.escape(ch) + _trie_regex(child) for ch, child in sorted(node.items()) if ch != '']
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    # A word ends here: the longer continuations are optional (greedy, so the longest word wins)
+    if '' in node:
+        body = '(?:' + body + ')?'
+    return body
+
+
+class KeywordMatcher:
+    """
+    Case-insensitive multi-keyword substring matcher.
+
+    Keywords are compiled into one prefix-factored regex inside a lookahead,
+    so each lower-cased text is scanned once and every start position reports
+    the longest keyword beginning there (overlapping keywords included).
+    Shorter keywords that are prefixes of that hit are implied, which makes
+    the result equal to testing every keyword separately. Cost per character
+    depends on the branching of the keyword trie rather than on the number of
+    keywords.
+    """
+
+    def __init__(self, keywords=TEXT_KEYWORDS):
+        self.keywords = list(dict.fromkeys(k.lower() for k in keywords))
+        trie = {}
+        for word in self.keywords:
+            node = trie
+            for ch in word:
+                node = node.setdefault(ch, {})
+            node[''] = True
+        self.pattern = re.compile('(?=(' + _trie_regex(trie) + '))')
+
+        index = {word: i for i, word in enumerate(self.keywords)}
+        # Keyword -> indices of itself and every keyword that is a prefix of it
+        self._implied = {
+            word: [index[word[:n]] for n in range(1, len(word) + 1) if word[:n] in index]
+            for word in self.keywords
+        }
+
+    def flags(self, texts):
+        """int8 array (n_texts x n_keywords): does each keyword occur in each text."""
+        flags = np.zeros((len(texts), len(self.keywords)), dtype=np.int8)
+        findall = self.pattern.findall
+        implied = self._implied
+        for row, text in enumerate(texts):
+            for match in set(findall(text.lower())):
+                flags[row, implied[match]] = 1
+        return flags
+
+
+def extract_text_features(name, description, keywords=TEXT_KEYWORDS, matcher=None):
+    """
+    Text / NLP Features: name_len, desc_len and a txt_<keyword> flag per keyword.
+
+    Name and description are scanned together, once per listing.
+    Returns a DataFrame aligned with the inputs.
+    """
+    matcher = matcher or KeywordMatcher(keywords)
+    name = name.fillna('')
+    description = description.fillna('')
+    texts = (name + _FIELD_SEPARATOR + description).astype(object)
+
+    features = pd.DataFrame({
+        'name_len': name.str.len().to_numpy(dtype=np.int64),
+        'desc_len': description.str.len().to_numpy(dtype=np.int64),
+    }, index=name.index)
+    flags = pd.DataFrame(
+        matcher.flags(texts.to_numpy()),
+        index=name.index,
+        columns=[f'txt_{word}' for word in matcher.keywords]
+    )
+    return pd.concat([features, flags], axis=1)
@@ -0,0 +1,283 @@
+import json
+import math
+import os
+import time
+from concurrent.futures import as_completed
+
+import numpy as np
+
+from analysis.models import BinnedDatasets, build_model, dataset_pool, fingerprint, validation_rows, worker_datasets
+
+# Search spaces: param -> ('log' | 'uniform', low, high), ('int', low, high) or ('choice', [values]).
+# min_child_samples is a dataset parameter, so every distinct value bins its own Dataset: keep it to a few choices.
+POINT_SEARCH_SPACE = {
+    'learning_rate': ('log', 0.005, 0.1),
+    'num_leaves': ('int', 15, 127),
+    'max_depth': ('choice', [-1, 6, 8, 10, 12]),
+    'min_child_samples': ('choice', [10, 20, 50, 100]),
+    'colsample_bytree': ('uniform', 0.5, 1.0),
+    'reg_alpha': ('log', 1e-3, 10.0),
+    'reg_lambda': ('log', 1e-3, 10.0),
+}
+
+QUANTILE_SEARCH_SPACE = {
+    'learning_rate': ('log', 0.01, 0.2),
+    'num_leaves': ('int', 7, 63),
+    'max_depth': ('choice', [-1, 4, 6, 8]),
+    'min_child_samples': ('choice', [20, 50, 100]),
+    'colsample_bytree': ('uniform', 0.5, 1.0),
+    'reg_alpha': ('log', 1e-3, 10.0),
+    'reg_lambda': ('log', 1e-3, 10.0),
+}
+
+SEARCH_METHODS = ('halving', 'random')
+
+DEFAULT_TRIALS_PATH = os.path.join('outputs', 'tuning_trials.jsonl')
+
+
+def sample_params(space, rng):
+    """One random configuration from a search space."""
+    params = {}
+    for name, (kind, *spec) in space.items():
+        if kind == 'log':
+            params[name] = float(np.exp(rng.uniform(np.log(spec[0]), np.log(spec[1]))))
+        elif kind == 'uniform':
+            params[name] = float(rng.uniform(spec[0], spec[1]))
+        elif kind == 'int':
+            params[name] = int(rng.integers(spec[0], spec[1] + 1))
+        elif kind == 'choice':
+            params[name] = spec[0][int(rng.integers(len(spec[0])))]
+        else:
+            raise ValueError(f"Unknown search space kind '{kind}' for {name}.")
+    return params
+
+
+def rung_budgets(max_trees, n_trials, eta=3):
+    """Successive halving tree budgets, smallest first: about log_eta(n_trials) rungs ending at max_trees."""
+    n_rungs = max(1, int(math.floor(math.log(max(n_trials, 1)) / math.log(eta) + 1e-9)))
+    return [max(1, int(max_trees / eta ** k)) for k in reversed(range(n_rungs))]
+
+
+def validation_loss(objective, alpha, y, pred):
+    """RMSE for point models, mean pinball loss at `alpha` for quantile models (lower is better)."""
+    y, pred = np.asarray(y, dtype=np.float64), np.asarray(pred, dtype=np.float64)
+    if objective == 'quantile':
+        diff = y - pred
+        return float(np.mean(np.maximum(alpha * diff, (alpha - 1) * diff)))
+    return float(np.sqrt(np.mean((y - pred) ** 2)))
+
+
+def inference_cost(booster):
+    """(trees, node visits per row): the expected number of splits evaluated per prediction, from the leaf counts."""
+    tree_info = booster.dump_model()['tree_info']
+    visits = 0.0
+    for tree in tree_info:
+        stack = [(tree['tree_structure'], 0)]
+        rows = depth_rows = 0
+        while stack:
+            node, depth = stack.pop()
+            if 'left_child' in node:
+                stack.extend([(node['left_child'], depth + 1), (node['right_child'], depth + 1)])
+            else:
+                rows += node.get('leaf_count', 0)
+                depth_rows += node.get('leaf_count', 0) * depth
+        visits += depth_rows / rows if rows else 0.0
+    return len(tree_info), visits
+
+
+class TrialStore:
+    """Append-only JSON lines file of search trials, one record per fitted configuration and rung."""
+
+    def __init__(self, path=DEFAULT_TRIALS_PATH):
+        self.path = path
+
+    def append(self, record):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def load(self, study=None, data_key=None, seed=None):
+        """Stored trials, optionally only those of one study, data snapshot/split (data_key) and sampling seed."""
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return [r for r in records if (study is None or r['study'] == study)
+                and (data_key is None or r.get('data_key') == data_key) and (seed is None or r.get('seed') == seed)]
+
+
+_RESULT_FIELDS = ('score', 'fit_seconds', 'predict_us_per_row', 'trees', 'node_visits', 'stopped_early')
+
+
+def _run_trial(task, datasets, y, n_jobs=None):
+    """Fits one configuration on the fit rows and scores it on the held-out fold; returns its record fields."""
+    start = time.perf_counter()
+    model = build_model(task, n_jobs)
+    model.fit(
+        datasets.X, datasets.labels(y),
+        dataset=datasets.get(model.params, y), valid_set=datasets.get_valid(model.params, y)
+    )
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pred = model.predict(datasets.X_valid)
+    predict_seconds = time.perf_counter() - start
+
+    trees, node_visits = inference_cost(model.booster_)
+    return {
+        'score': validation_loss(task['objective'], task['alpha'], np.asarray(y)[datasets.valid_rows], pred),
+        'fit_seconds': round(fit_seconds, 3),
+        'predict_us_per_row': round(predict_seconds / len(pred) * 1e6, 3),
+        'trees': trees,
+        'node_visits': round(node_visits, 1),
+        # Early stopping fired before the budget ran out (trees alone can't tell: they are cut to best_iteration)
+        'stopped_early': bool(model.stopped_early_),
+    }
+
+
+def _run_trial_in_worker(task, y, n_jobs):
+    return _run_trial(task, worker_datasets(), y, n_jobs)
+
+
+def run_search(trainer, base_task, X_train, y_train, n_trials=27, method='halving', eta=3, space=None,
+               early_stopping_rounds=50, store=None, study=None, seed=42):
+    """
+    Searches LightGBM parameters for one training plan entry.
+
+    Args:
+        trainer: ModelTrainer supplying the design matrix, thread budget,
+            dataset cache and validation fraction.
+        base_task: Plan entry (point_task / quantile_task) whose params are the
+            starting point and trial 0; sampled values override them, and its
+            n_estimators is the largest tree budget.
+        y_train: Training labels (log1p is applied if the entry asks for it).
+        method: 'halving' fits every configuration on a small tree budget and
+            promotes the best 1/eta to eta times the budget, rung by rung;
+            'random' fits every configuration on the full budget.
+    Every fit also stops early on the held-out fold, and configurations
+    whose early stopping fired before their budget ran out carry their
+    result to the next rung instead of refitting. Each fit is appended to `store` (a TrialStore) as it
+    completes; returns the records of the last rung.
+    """
+    if base_task['objective'] not in ('regression', 'quantile'):
+        raise ValueError(f"Search supports point and quantile entries, got '{base_task['objective']}'.")
+    if method not in SEARCH_METHODS:
+        raise ValueError(f"method must be one of {SEARCH_METHODS}, got '{method}'.")
+    if space is None:
+        space = POINT_SEARCH_SPACE if base_task['objective'] == 'regression' else QUANTILE_SEARCH_SPACE
+    store = store or TrialStore()
+    study = study or base_task['name']
+
+    X = trainer.design_matrix(X_train)
+    fit_params = {} if trainer.amenity_matrix is None else {'feature_name': trainer.feature_names(X_train)}
+    valid_rows = validation_rows(X.shape[0], trainer.validation_fraction)
+    data_key = f"{fingerprint(X)}:valid={trainer.validation_fraction}"
+    y = np.log1p(y_train) if base_task['log_transform'] else np.asarray(y_train)
+
+    rng = np.random.default_rng(seed)
+    # Trial 0 is the entry's own (hard-coded) parameters, as the reference point
+    configs = [{}] + [sample_params(space, rng) for _ in range(n_trials - 1)]
+    max_trees = base_task['params']['n_estimators']
+    budgets = rung_budgets(max_trees, n_trials, eta) if method == 'halving' else [max_trees]
+    metric = 'rmse' if base_task['objective'] == 'regression' else 'quantile'
+    workers, threads = trainer.thread_budget(n_trials)
+    print(f"Searching {study}: {n_trials} configurations, {method} over tree budgets {budgets}, "
+          f"{workers} worker(s) x {threads} thread(s)")
+
+    def make_task(trial, budget):
+        params = {**base_task['params'], **configs[trial], 'n_estimators': budget,
+                  'early_stopping_round': early_stopping_rounds, 'first_metric_only': True, 'metric': metric}
+        return {**base_task, 'params': params}
+
+    pool = None
+    if workers > 1:
+        pool = dataset_pool(workers, X, fit_params, trainer.dataset_cache_dir, data_key, valid_rows)
+    else:
+        datasets = BinnedDatasets(X, cache_dir=trainer.dataset_cache_dir, data_key=data_key,
+                                  valid_rows=valid_rows, **fit_params)
+
+    start = time.perf_counter()
+    survivors = list(range(n_trials))
+    results = {}
+    n_fits = 0
+    try:
+        for rung, budget in enumerate(budgets):
+            rung_results = {}
+            # Early stopping ended these below the previous budget: a larger budget gives the same model
+            for trial in survivors:
+                previous = results.get(trial)
+                if previous is not None and previous.get('stopped_early'):
+                    rung_results[trial] = {**{key: previous[key] for key in _RESULT_FIELDS}, 'reused': True}
+            to_fit = [trial for trial in survivors if trial not in rung_results]
+            if len(to_fit) < len(survivors):
+                print(f"  rung {rung}: {len(survivors) - len(to_fit)} trial(s) stopped early below the last budget, reused")
+
+            if pool is None:
+                fitted = ((trial, _run_trial(make_task(trial, budget), datasets, y, threads)) for trial in to_fit)
+            else:
+                futures = {pool.submit(_run_trial_in_worker, make_task(trial, budget), y, threads): trial
+                           for trial in to_fit}
+                fitted = ((futures[future], future.result()) for future in as_completed(futures))
+            for done, (trial, result) in enumerate(fitted, 1):
+                rung_results[trial] = {**result, 'reused': False}
+                n_fits += 1
+                print(f"  rung {rung} [{done}/{len(to_fit)}] trial {trial}: {metric} {result['score']:.5f}, "
+                      f"{result['trees']} trees, {result['fit_seconds']:.1f}s")
+
+            ranked = sorted(survivors, key=lambda trial: rung_results[trial]['score'])
+            keep = len(ranked) if rung == len(budgets) - 1 else max(1, math.ceil(len(ranked) / eta))
+            for position, trial in enumerate(ranked):
+                status = 'complete' if rung == len(budgets) - 1 else ('promoted' if position < keep else 'pruned')
+                record = {
+                    'study': study, 'trial': trial, 'rung': rung, 'method': method, 'n_estimators': budget,
+                    'objective': base_task['objective'], 'alpha': base_task['alpha'], 'metric': metric,
+                    **rung_results[trial], 'params': configs[trial], 'status': status,
+                    'data_key': data_key[:16], 'seed': seed, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                }
+                results[trial] = record
+                store.append(record)
+            survivors = ranked[:keep]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    print(f"Search done in {time.perf_counter() - start:.1f}s ({n_fits} fits recorded in '{store.path}')")
+    return [results[trial] for trial in survivors]
+
+
+def rank_trials(records, tolerance=0.01):
+    """
+    Ranks completed trials by validation loss, with their inference cost alongside.
+
+    Each returned record gains 'relative_loss' (vs the best trial), 'pareto'
+    (no other trial is both more accurate and cheaper in node visits per
+    row) and 'recommended': the cheapest trial within `tolerance` of the best
+    loss, so a slightly less accurate but much smaller model can win.
+    """
+    complete = [r for r in records if r['status'] == 'complete']
+    if not complete:
+        return []
+    best = min(r['score'] for r in complete)
+    ranked = []
+    for r in sorted(complete, key=lambda r: (r['score'], r['node_visits'])):
+        dominated = any(
+            o['score'] <= r['score'] and o['node_visits'] <= r['node_visits']
+            and (o['score'] < r['score'] or o['node_visits'] < r['node_visits'])
+            for o in complete
+        )
+        ranked.append({**r, 'relative_loss': r['score'] / best - 1 if best else 0.0, 'pareto': not dominated,
+                       'recommended': False})
+    eligible = [r for r in ranked if r['score'] <= best * (1 + tolerance)]
+    min(eligible, key=lambda r: r['node_visits'])['recommended'] = True
+    return ranked
+
+
+def print_ranking(ranked, top=10):
+    print(f"{'trial':>5} {'loss':>10} {'vs best':>8} {'trees':>6} {'visits/row':>10} {'us/row':>8} {'fit s':>7}")
+    for r in ranked[:top]:
+        flags = ('  pareto' if r['pareto'] else '') + ('  <- recommended' if r['recommended'] else '')
+        print(f"{r['trial']:>5} {r['score']:>10.5f} {r['relative_loss']:>+8.2%} {r['trees']:>6} "
+              f"{r['node_visits']:>10.1f} {r['predict_us_per_row']:>8.2f} {r['fit_seconds']:>7.1f}{flags}")
+    recommended = next((r for r in ranked if r['recommended']), None)
+    if recommended is not None:
+        print(f"Recommended params ({recommended['trees']} trees): {json.dumps(recommended['params'])}")
@@ -1,40 +1,78 @@
+import argparse
 import json
 import os
-
-import onnxmltools
-from onnx import save_model
-from onnx.compose import merge_models, add_prefix
-from skl2onnx.common.data_types import FloatTensorType
+import time
 
 from analysis.basket_analysis import run_basket_analysis
-from analysis.data import prepare_data_pipeline
-from analysis.models import ModelTrainer
-from analysis.price_analysis import run_price_analysis
-from analysis.revenue_analysis import run_revenue_analysis
+from analysis.data import DATA_DIR, amenity_matrix_path, load_amenity_matrix, prepare_data_pipeline
+from analysis.export import EXPORT_LAYOUTS, compact_onnx_models, export_onnx_models
+from analysis.models import QUANTILE_MODES, ModelTrainer
+from analysis.onnx_check import BATCH_SIZES, check_onnx_models
+from analysis.price_analysis import price_training_plan, run_price_analysis
+from analysis.profiling import StageProfiler
+from analysis.revenue_analysis import revenue_training_plan, run_revenue_analysis
+from analysis.scoring import score_listings
+from analysis.tuning import DEFAULT_TRIALS_PATH, SEARCH_METHODS, TrialStore, print_ranking, rank_trials, run_search
+
+
+def run_analysis(quantile_mode='independent', n_jobs=None, early_stopping_rounds=None, trace_memory=False,
+                 report_path=None, onnx_layout='separate', compact_onnx=False, check_batch_sizes=None,
+                 check_threads=None, full_amenity_basket=False):
+    """
+    Runs the full analysis and exports the models.
 
+    The amenity basket analysis compares the curated has_* groups, or with
+    full_amenity_basket the full amenity vocabulary (AmenityMatrix).
 
-def run_analysis():
+    Every stage and model fit is profiled (see StageProfiler); the run report
+    is printed one line per stage and saved as JSON to `report_path`
+    (default outputs/run_reports/run-<timestamp>.json), where reports of
+    different runs can be compared with `python -m analysis.benchmark compare`.
+    The exported graphs are checked against the trained models on the test
+    set before the run counts as done; their throughput is measured only
+    when `check_batch_sizes` or `check_threads` is given (see
+    check_onnx_models).
+    """
     print("Starting Vancouver Airbnb Analysis...")
+    profiler = StageProfiler(trace_memory)
     
     # Data Preparation
     print("Running Data Pipeline...")
-    X_train, X_test, y_train_price, y_test_price, y_train_rev, y_test_rev, test_df, features, full_df, metadata = prepare_data_pipeline()
+    X_train, X_test, y_train_price, y_test_price, y_train_rev, y_test_rev, test_df, features, full_df, metadata, pipeline = prepare_data_pipeline(profiler=profiler)
     print(f"Data Loaded. Training samples: {len(X_train)}, Test samples: {len(X_test)}")
     
-    # Amenity Basket Analysis
-    run_basket_analysis(full_df)
+    # Amenity Basket Analysis over the curated has_* groups, or the full vocabulary cached by the data pipeline
+    with profiler.stage('run_basket_analysis', rows=len(full_df), cols=full_df.shape[1]):
+        run_basket_analysis(full_df, load_amenity_matrix(amenity_matrix_path()) if full_amenity_basket else None)
+    
+    # Binned LightGBM Datasets are cached next to the raw data for fast re-runs on the same features
+    trainer = ModelTrainer(
+        quantile_mode=quantile_mode, n_jobs=n_jobs, dataset_cache_dir=os.path.join(DATA_DIR, 'cache', 'lightgbm'),
+        early_stopping_rounds=early_stopping_rounds
+    )
     
-    trainer = ModelTrainer()
+    # Fit every model of both analyses up front, deduplicated and in parallel
+    with profiler.stage('fit_plan', rows=X_train.shape[0], cols=X_train.shape[1]) as stage:
+        trainer.fit_plan(
+            price_training_plan(quantile_mode) + revenue_training_plan(quantile_mode),
+            X_train, {'price': y_train_price, 'revenue': y_train_rev}
+        )
+        stage['models'] = len(trainer.fit_stats)
+    # Fits may run in worker processes: their own wall/CPU times are recorded alongside
+    for name, stats in trainer.fit_stats.items():
+        profiler.record(f"fit:{name}", **stats)
     
     # Price Analysis
-    run_price_analysis(
-        trainer, X_train, y_train_price, X_test, y_test_price, test_df
-    )
+    with profiler.stage('run_price_analysis', rows=X_test.shape[0], cols=X_test.shape[1]):
+        run_price_analysis(
+            trainer, X_train, y_train_price, X_test, y_test_price, test_df
+        )
     
     # Revenue Analysis
-    run_revenue_analysis(
-        trainer, X_train, y_train_rev, X_test, y_test_rev, test_df
-    )
+    with profiler.stage('run_revenue_analysis', rows=X_test.shape[0], cols=X_test.shape[1]):
+        run_revenue_analysis(
+            trainer, X_train, y_train_rev, X_test, y_test_rev, test_df
+        )
     
     # Export Models
     print("Exporting Models...")
@@ -47,109 +85,131 @@ def run_analysis():
     
     # Update metadata with feature names
     metadata['feature_names'] = feature_names
+    # Which point models were trained on log1p(target)
+    metadata['log_transform'] = {
+        name: info['log_transform'] for name, info in trainer.models.items() if name.endswith('_Point')
+    }
+    # Conformal quantile mode: per name prefix, the offsets added to the point model (no quantile trees exported)
+    if trainer.conformal:
+        metadata['conformal_quantiles'] = trainer.conformal
     
-    # Save metadata
-    with open(os.path.join(model_dir, 'models_metadata.json'), 'w') as f:
-        json.dump(metadata, f, indent=2)
-    print(f"Metadata saved to '{model_dir}/models_metadata.json'.")
-        
-    # Group models by target (Price vs Revenue)
-    groups = {'Price': [], 'Revenue': []}
-    for name in trainer.models.keys():
-        if name.startswith('Price'):
-            groups['Price'].append(name)
-        elif name.startswith('Revenue'):
-            groups['Revenue'].append(name)
+    with profiler.stage('save_metadata_and_pipeline'):
+        # Save metadata
+        with open(os.path.join(model_dir, 'models_metadata.json'), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        print(f"Metadata saved to '{model_dir}/models_metadata.json'.")
 
-    for group_name, model_names in groups.items():
-        print(f"Merging models for {group_name}...")
-        combined_model = None
+        # Save the fitted feature pipeline for scoring new listings
+        pipeline.save(os.path.join(model_dir, 'feature_pipeline.joblib'))
+        print(f"Feature pipeline saved to '{model_dir}/feature_pipeline.joblib'.")
         
-        # Sort: Point first, then quantiles numerically
-        def sort_key(n):
-            if 'Point' in n: return -1.0
-            if '_q' in n: return float(n.split('_q')[1])
-            return 0.0
-            
-        model_names.sort(key=sort_key)
-        
-        for name in model_names:
-            model_info = trainer.models[name]
-            model = model_info['model']
-            
-            try:
-                # Convert LightGBM model to ONNX
-                initial_type = [('float_input', FloatTensorType([None, len(feature_names)]))]
-                
-                onnx_model = onnxmltools.convert_lightgbm(
-                    model.booster_,
-                    initial_types=initial_type,
-                    target_opset=12
-                )
-                
-                # Rename the output to match the model name (e.g., Price_Point, Price_q5)
-                # LightGBM converter output is usually 'variable'
-                old_output = onnx_model.graph.output[0]
-                old_output_name = old_output.name
-                
-                # Update all nodes referencing this output
-                for node in onnx_model.graph.node:
-                    for i, output in enumerate(node.output):
-                        if output == old_output_name:
-                            node.output[i] = name
-                
-                # Update the graph output definition
-                old_output.name = name
-                
-                if combined_model is None:
-                    combined_model = onnx_model
-                else:
-                    # Merge Strategy for Shared Input:
-                    # 1. Prefix the new model to avoid collision.
-                    # 2. Merge disjointly.
-                    # 3. Rewire the prefixed input to the main 'float_input'.
-                    
-                    # 1. Prefix
-                    # add_prefix will rename inputs too, e.g. 'float_input' -> 'Price_q5_float_input'
-                    prefixed_model = add_prefix(onnx_model, prefix=f"{name}_")
-                    
-                    # 2. Merge
-                    combined_model = merge_models(
-                        combined_model,
-                        prefixed_model,
-                        io_map=[] 
-                    )
-                    
-                    # 3. Rewire Input
-                    # The combined model now has 'float_input' (from first model) AND 'Price_q5_float_input' (from second).
-                    # We want to delete 'Price_q5_float_input' and point its consumers to 'float_input'.
-                    
-                    redundant_input_name = f"{name}_float_input"
-                    
-                    # Find nodes using the redundant input
-                    for node in combined_model.graph.node:
-                        for i, input_name in enumerate(node.input):
-                            if input_name == redundant_input_name:
-                                node.input[i] = 'float_input'
-                                
-                    # Remove the redundant input from graph inputs
-                    # Filter out the input that matches redundant_input_name
-                    new_inputs = [inp for inp in combined_model.graph.input if inp.name != redundant_input_name]
-                    
-                    # Clear and re-add inputs
-                    del combined_model.graph.input[:]
-                    combined_model.graph.input.extend(new_inputs)
-                    
-            except Exception as e:
-                print(f"Error converting/merging {name}: {e}")
-                # Important: If one quantile fails, we continue, but the combined model might be partial.
-
-        if combined_model:
-            onnx_filename = os.path.join(model_dir, f"{group_name}_Model.onnx")
-            save_model(combined_model, onnx_filename)
-            print(f"Saved Combined ONNX model: {onnx_filename}")
-    
+    with profiler.stage('export_onnx_models', cols=len(feature_names)) as stage:
+        paths = export_onnx_models(trainer, len(feature_names), model_dir, n_jobs, onnx_layout)
+        stage['bytes'] = sum(os.path.getsize(p) for p in paths)
+    if compact_onnx:
+        with profiler.stage('compact_onnx_models', rows=X_test.shape[0], cols=X_test.shape[1]) as stage:
+            compact_onnx_models(trainer, X_test.to_numpy(dtype='float32'), model_dir, n_jobs, onnx_layout)
+            stage['bytes'] = sum(os.path.getsize(p) for p in paths)
     print(f"Models exported to '{model_dir}/'.")
 
+    # Every exported output must reproduce its model on the test set
+    with profiler.stage('check_onnx_models', rows=X_test.shape[0], cols=X_test.shape[1]):
+        check_onnx_models(trainer, X_test.to_numpy(dtype='float32'), model_dir, check_batch_sizes, check_threads)
+
+    # Run report
+    report_path = report_path or os.path.join(model_dir, 'run_reports', f"run-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    config = {'quantile_mode': quantile_mode, 'n_jobs': n_jobs, 'early_stopping_rounds': early_stopping_rounds,
+              'trace_memory': trace_memory, 'onnx_layout': onnx_layout, 'compact_onnx': compact_onnx}
+    profiler.save(report_path, config=config)
+    print("\nRun report:")
+    print(profiler.summary())
+    print(f"Run report saved to '{report_path}'.")
+
+def run_tuning(model_name='Price_Point', method='halving', n_trials=27, eta=3, n_jobs=None,
+               store_path=DEFAULT_TRIALS_PATH, tolerance=0.01):
+    """Hyperparameter search for one model of the training plans; prints the ranked trials."""
+    plan = {task['name']: task for task in price_training_plan() + revenue_training_plan()}
+    if model_name not in plan:
+        raise ValueError(f"Unknown model '{model_name}'. Choose from: {', '.join(plan)}")
+    task = plan[model_name]
+
+    X_train, _, y_train_price, _, y_train_rev, *_ = prepare_data_pipeline()
+    targets = {'price': y_train_price, 'revenue': y_train_rev}
+    trainer = ModelTrainer(n_jobs=n_jobs, dataset_cache_dir=os.path.join(DATA_DIR, 'cache', 'lightgbm'))
+    store = TrialStore(store_path)
+    last_rung = run_search(trainer, task, X_train, targets[task['target']], n_trials, method, eta, store=store)
+
+    # Only trials on this run's data and split (data_key) and seed: results from other snapshots don't compare
+    data_key, seed = last_rung[0]['data_key'], last_rung[0]['seed']
+    print(f"\nTrials of {model_name} in '{store_path}' (data {data_key}, seed {seed}), by validation loss:")
+    print_ranking(rank_trials(store.load(model_name, data_key, seed), tolerance))
+
+def _int_list(text):
+    """'1,100,1000' -> [1, 100, 1000]; None stays None."""
+    return [int(value) for value in text.split(',')] if text else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Vancouver Airbnb analysis: train/export models or score listings.")
+    subparsers = parser.add_subparsers(dest='mode')
+    train = subparsers.add_parser('train', help="Run the analysis and export models (default).")
+    train.add_argument('--quantile-mode', choices=QUANTILE_MODES, default='independent',
+                       help="'multi' learns all quantile levels of a target on one shared set of trees; 'conformal' "
+                            "derives them from the point model and residual offsets on a 20%% calibration fold; "
+                            "'anchors' trains q5/q25/q50/q75/q95 and interpolates the levels in between.")
+    train.add_argument('--n-jobs', type=int, default=None,
+                       help="Total LightGBM threads across parallel fits (default: all cores).")
+    train.add_argument('--early-stopping', type=int, default=None, metavar='ROUNDS',
+                       help="Hold out 20%% of the training rows and stop each model after ROUNDS rounds without "
+                            "validation improvement (trees beyond the best iteration are dropped).")
+    train.add_argument('--trace-memory', action='store_true',
+                       help="Add tracemalloc peaks to the run report (slows the pandas stages several times).")
+    train.add_argument('--report', default=None, metavar='PATH',
+                       help="Where to save the JSON run report (default outputs/run_reports/run-<timestamp>.json).")
+    train.add_argument('--full-amenity-basket', action='store_true',
+                       help="Run the basket analysis over every amenity string (~260) instead of the curated has_* groups.")
+    train.add_argument('--onnx-layout', choices=EXPORT_LAYOUTS, default='separate',
+                       help="'fused' packs each group's models into one multi-target tree operator.")
+    train.add_argument('--compact-onnx', action='store_true',
+                       help="Shrink the exported graphs (duplicate subtrees collapsed, ai.onnx.ml 5 TreeEnsemble "
+                            "encoding) and report size, load time and deviation in outputs/onnx_compaction.json.")
+    train.add_argument('--check-batch-sizes', default=None,
+                       help="Measure the exported graphs' throughput at these comma-separated batch sizes "
+                            f"(off by default; {','.join(map(str, BATCH_SIZES))} when only --check-threads is given).")
+    train.add_argument('--check-threads', default=None,
+                       help="Measure throughput at these comma-separated ONNX Runtime intra-op thread counts "
+                            "(off by default; 1 and all cores when only --check-batch-sizes is given).")
+    score = subparsers.add_parser('score', help="Score a listings CSV with the exported models.")
+    score.add_argument('input', help="Listings CSV in the listings-detail.csv format.")
+    score.add_argument('--output', default='outputs/scores.parquet', help="Parquet file to write.")
+    score.add_argument('--model-dir', default='outputs', help="Directory with the exported models and feature pipeline.")
+    score.add_argument('--chunksize', type=int, default=50_000, help="Rows per chunk (bounds memory).")
+    score.add_argument('--threads', type=int, default=None, help="ONNX Runtime intra-op threads.")
+    tune = subparsers.add_parser('tune', help="Search LightGBM parameters for one model.")
+    tune.add_argument('--model', default='Price_Point', help="Training plan entry to tune, e.g. Price_Point, Price_q95.")
+    tune.add_argument('--method', choices=SEARCH_METHODS, default='halving',
+                      help="'halving' prunes weak configurations on small tree budgets first.")
+    tune.add_argument('--trials', type=int, default=27, help="Number of sampled configurations.")
+    tune.add_argument('--eta', type=int, default=3, help="Halving rate: 1/eta of the configurations survive each rung.")
+    tune.add_argument('--n-jobs', type=int, default=None, help="Total LightGBM threads across parallel fits.")
+    tune.add_argument('--store', default=DEFAULT_TRIALS_PATH, help="JSON lines file the trials are appended to.")
+    tune.add_argument('--tolerance', type=float, default=0.01,
+                      help="Recommend the cheapest trial within this relative loss of the best.")
+    args = parser.parse_args()
+    if getattr(args, 'quantile_mode', None) == 'conformal' and getattr(args, 'early_stopping', None):
+        parser.error("--quantile-mode conformal can't be combined with --early-stopping (both use the held-out fold).")
+
+    if args.mode == 'score':
+        score_listings(args.input, args.output, args.model_dir, args.chunksize, args.threads)
+    elif args.mode == 'tune':
+        run_tuning(args.model, args.method, args.trials, args.eta, args.n_jobs, args.store, args.tolerance)
+    else:
+        run_analysis(
+            getattr(args, 'quantile_mode', 'independent'), getattr(args, 'n_jobs', None),
+            getattr(args, 'early_stopping', None), getattr(args, 'trace_memory', False), getattr(args, 'report', None),
+            getattr(args, 'onnx_layout', 'separate'), getattr(args, 'compact_onnx', False),
+            _int_list(getattr(args, 'check_batch_sizes', None)),
+            _int_list(getattr(args, 'check_threads', None)), getattr(args, 'full_amenity_basket', False)
+        )
+
 if __name__ == "__main__":
-    run_analysis()
+    main()